@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+"""
+Read-only query service for the Anki collection.
+
+AnkiConnect answers every call on Anki's Qt main thread, so reads queue behind
+writes and each other. This service opens collection.anki2 read-only from a
+separate process and answers the reads that only need the database:
+
+    deckNames, modelNames, modelFieldNames, notesInfo (with a "notes" id list)
+
+The REST proxy posts {"action": ..., "params": ...} to /query and falls back to
+AnkiConnect for anything this service can't answer.
+
+Replies:
+    200 {"result": ..., "mod": <col.mod>, "asOf": <ms>, "current": <bool>}
+        mod is the collection's modification stamp in the view that was read,
+        asOf the time (ms) before that view was taken, so every write committed
+        before asOf is included. For a replica written by
+        anki-collection-snapshot.py, asOf is the time the replica was taken.
+        current is true when the view holds every write committed so far: a
+        direct read always does, a replica does if the live collection's
+        col.mod still equals the replica's (false while Anki's exclusive lock
+        keeps the live collection from being read).
+    422 {"error": ...}  action or params not supported here
+    503 {"error": ...}  collection can't be read (missing, locked by Anki)
+
+POST /search {"query": ..., "limit": ..., "offset": ...} runs an FTS5 query
+against a full-text index of note fields and tags (ANKI_SEARCH_INDEX_PATH),
+ranked by bm25, and returns {"result": [{"noteId", "score", "snippet"}], ...};
+current is true when the index was synced from the collection as it is now.
+400 for a query FTS5 can't parse, 503 until the index is first built.
+
+GET /health reports the view's mod and its lag (seconds since asOf).
+
+Usage:
+    ANKI_COLLECTION_PATH=/path/to/collection.anki2 ./anki-collection-reader.py
+"""
+
+import html
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+# Configuration
+COLLECTION_PATH = os.environ.get(
+    "ANKI_COLLECTION_PATH",
+    os.path.expanduser("~/anki/anki_data/.local/share/Anki2/User 1/collection.anki2"),
+)
+PROFILE_NAME = os.environ.get("ANKI_PROFILE_NAME", "User 1")
+PORT = int(os.environ.get("ANKI_READER_PORT", "8768"))
+# How long a query waits for a lock before answering 503
+BUSY_TIMEOUT_S = float(os.environ.get("ANKI_READER_BUSY_TIMEOUT_MS", "200")) / 1000
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# Stay under SQLite's bound-parameter limit
+ID_CHUNK = 500
+# Full-text index of note fields and tags (unset disables POST /search)
+SEARCH_INDEX_PATH = os.environ.get("ANKI_SEARCH_INDEX_PATH", "")
+# How often the index checks the collection for changes
+SEARCH_REFRESH_S = float(os.environ.get("ANKI_SEARCH_REFRESH_MS", "2000")) / 1000
+# Notes re-indexed per index transaction
+SEARCH_BATCH = 2000
+
+# Anki separates fields in notes.flds and deck name components with \x1f
+FIELD_SEPARATOR = "\x1f"
+
+
+class Unsupported(Exception):
+    """The request is valid for AnkiConnect but not answerable from the database."""
+
+
+def unicase(a: str, b: str) -> int:
+    """Anki's case-insensitive collation; its tables and indexes declare it."""
+    a, b = a.casefold(), b.casefold()
+    return (a > b) - (a < b)
+
+
+_local = threading.local()
+
+
+def connection() -> sqlite3.Connection:
+    """One read-only connection per server thread, reopened when the file is replaced."""
+    try:
+        inode = os.stat(COLLECTION_PATH).st_ino
+    except FileNotFoundError:
+        raise sqlite3.OperationalError(f"collection not found: {COLLECTION_PATH}")
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.inode != inode:
+        drop_connection()
+        conn = None
+    if conn is None:
+        uri = "file:" + quote(COLLECTION_PATH) + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_S,
+                               isolation_level=None, check_same_thread=False)
+        conn.create_collation("unicase", unicase)
+        # Replicas from anki-collection-snapshot.py record when they were taken
+        # and which collection they copy
+        _local.snapshot = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'snapshot_meta'").fetchone() is not None
+        _local.source = conn.execute("SELECT source FROM snapshot_meta").fetchone()[0] if _local.snapshot else None
+        _local.conn, _local.inode = conn, inode
+    return conn
+
+
+def live_mod(path: str):
+    """
+    col.mod of the live collection at path, or None if it can't be read (e.g.
+    Anki holds its exclusive lock). Opened per check and never waits, so no
+    connection is left on the file when Anki opens it.
+    """
+    try:
+        conn = sqlite3.connect("file:" + quote(path) + "?mode=ro", uri=True, timeout=0)
+        try:
+            return conn.execute("SELECT mod FROM col").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def view_state(conn: sqlite3.Connection, as_of: int) -> dict:
+    """{"mod", "asOf", "current"} of the view in conn's open read transaction."""
+    if _local.snapshot:
+        (as_of,) = conn.execute("SELECT taken_at FROM snapshot_meta").fetchone()
+    (mod,) = conn.execute("SELECT mod FROM col").fetchone()
+    current = _local.source is None or live_mod(_local.source) == mod
+    return {"mod": mod, "asOf": as_of, "current": current}
+
+
+def drop_connection():
+    """Reopen on the next query, e.g. after the file was replaced."""
+    conn = getattr(_local, "conn", None)
+    _local.conn = None
+    if conn is not None:
+        conn.close()
+
+
+# Notetype metadata (names, field names) only changes with the collection, so
+# it's cached per col.mod
+_notetypes_lock = threading.Lock()
+_notetypes = {"mod": None, "by_id": {}}
+
+
+def notetypes(conn: sqlite3.Connection, mod: int) -> dict:
+    """{notetype id: (name, [field names in order])} for the view at `mod`."""
+    with _notetypes_lock:
+        if _notetypes["mod"] == mod:
+            return _notetypes["by_id"]
+    by_id = {ntid: (name, []) for ntid, name in conn.execute("SELECT id, name FROM notetypes")}
+    for ntid, name in conn.execute("SELECT ntid, name FROM fields ORDER BY ntid, ord"):
+        if ntid in by_id:
+            by_id[ntid][1].append(name)
+    with _notetypes_lock:
+        _notetypes["mod"], _notetypes["by_id"] = mod, by_id
+    return by_id
+
+
+def deck_names(conn, mod, params):
+    return [name.replace(FIELD_SEPARATOR, "::")
+            for (name,) in conn.execute("SELECT name FROM decks ORDER BY name")]
+
+
+def model_names(conn, mod, params):
+    return [name for (name,) in conn.execute("SELECT name FROM notetypes ORDER BY name")]
+
+
+def model_field_names(conn, mod, params):
+    model_name = params.get("modelName")
+    if not isinstance(model_name, str):
+        raise Unsupported("modelName must be a string")
+    for name, fields in notetypes(conn, mod).values():
+        if name == model_name:
+            return list(fields)
+    # Let AnkiConnect produce its own "model was not found" error
+    raise Unsupported(f"model was not found: {model_name}")
+
+
+def notes_info(conn, mod, params):
+    ids = params.get("notes")
+    if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise Unsupported("only notesInfo with a \"notes\" id list is served here")
+    models = notetypes(conn, mod)
+    wanted = list(dict.fromkeys(ids))
+    rows, cards = {}, {}
+    for start in range(0, len(wanted), ID_CHUNK):
+        chunk = wanted[start:start + ID_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        for row in conn.execute(f"SELECT id, mid, mod, tags, flds FROM notes WHERE id IN ({marks})", chunk):
+            rows[row[0]] = row
+        for nid, cid in conn.execute(
+                f"SELECT nid, id FROM cards WHERE nid IN ({marks}) ORDER BY nid, ord", chunk):
+            cards.setdefault(nid, []).append(cid)
+
+    infos = []
+    for note_id in ids:
+        row = rows.get(note_id)
+        if row is None:
+            infos.append({})
+            continue
+        _, mid, note_mod, tags, flds = row
+        model_name, field_names = models.get(mid, (None, []))
+        values = flds.split(FIELD_SEPARATOR)
+        infos.append({
+            "noteId": note_id,
+            "profile": PROFILE_NAME,
+            "tags": tags.split(),
+            "fields": {name: {"value": values[order] if order < len(values) else "", "order": order}
+                       for order, name in enumerate(field_names)},
+            "modelName": model_name,
+            "mod": note_mod,
+            "cards": cards.get(note_id, []),
+        })
+    return infos
+
+
+ACTIONS = {
+    "deckNames": deck_names,
+    "modelNames": model_names,
+    "modelFieldNames": model_field_names,
+    "notesInfo": notes_info,
+}
+
+
+def run_query(action: str, params: dict) -> dict:
+    """Answer one read inside a single read transaction so result and mod match."""
+    handler = ACTIONS.get(action)
+    if handler is None:
+        raise Unsupported(f"unsupported action: {action}")
+    as_of = int(time.time() * 1000)
+    conn = connection()
+    conn.execute("BEGIN")
+    try:
+        view = view_state(conn, as_of)
+        result = handler(conn, view["mod"], params)
+    finally:
+        if conn.in_transaction:
+            conn.execute("COMMIT")
+    return {"result": result, **view}
+
+
+class BadQuery(Exception):
+    """The search query isn't valid FTS5 syntax."""
+
+
+class IndexNotReady(Exception):
+    """The search index hasn't been built yet."""
+
+
+SEARCH_SCHEMA = """
+PRAGMA journal_mode = wal;
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(fields, tags, tokenize = 'unicode61 remove_diacritics 2');
+CREATE TABLE IF NOT EXISTS indexed (id integer PRIMARY KEY, mod integer NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key text PRIMARY KEY, value integer NOT NULL);
+"""
+
+# Line-breaking tags become spaces so words on either side stay apart
+BREAK_TAGS = re.compile(r"<br\s*/?>|</?(?:div|p|li|tr|td|h\d)\b[^>]*>", re.IGNORECASE)
+OTHER_TAGS = re.compile(r"<[^>]*>")
+
+
+def plain_text(flds: str) -> str:
+    """Field text without HTML, fields separated so phrases don't run across them."""
+    return " | ".join(html.unescape(OTHER_TAGS.sub("", BREAK_TAGS.sub(" ", field)))
+                      for field in flds.split(FIELD_SEPARATOR))
+
+
+class SearchIndex:
+    """
+    FTS5 index of note fields and tags, in its own file next to the collection.
+
+    Syncs run when col.mod moves and only read the notes that can have
+    changed, through Anki's index on notes.usn: local edits (usn -1) with a
+    mod at or after the newest one already indexed, and notes synced in from
+    another device (a usn above the highest one seen, whatever their mod).
+    When the note counts differ, notes missing from either side are
+    re-indexed too: deletions, and new notes the watermarks missed (usn -1
+    with a mod older than the newest one indexed, e.g. from a clock that went
+    back). The first build, and a collection whose schema stamp (col.scm)
+    changed, compare every note's mod with the one it was indexed at. Search
+    hits are also checked against the collection and stale ones re-indexed
+    before the reply; that covers edits to indexed notes only, not notes that
+    were never indexed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.last_error = None
+        self.writer = self.open()
+        self.writer.executescript(SEARCH_SCHEMA)
+        # An index left by a previous run is usable at once, if behind
+        self.ready = self.meta(self.writer, "mod") is not None
+
+    def open(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, uri=True, timeout=5, isolation_level=None, check_same_thread=False)
+
+    def reader(self) -> sqlite3.Connection:
+        conn = getattr(_local, "index", None)
+        if conn is None:
+            conn = _local.index = self.open()
+        return conn
+
+    @staticmethod
+    def meta(conn, key):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def set_meta(conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def reindex(self, conn, ids):
+        """Re-read these notes from the attached collection; notes gone from it are dropped."""
+        for start in range(0, len(ids), ID_CHUNK):
+            chunk = ids[start:start + ID_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT id, mod, flds, tags FROM col.notes WHERE id IN ({marks})", chunk).fetchall()
+            conn.execute(f"DELETE FROM notes_fts WHERE rowid IN ({marks})", chunk)
+            conn.execute(f"DELETE FROM indexed WHERE id IN ({marks})", chunk)
+            conn.executemany("INSERT INTO notes_fts (rowid, fields, tags) VALUES (?, ?, ?)",
+                             [(nid, plain_text(flds), tags.strip()) for nid, _, flds, tags in rows])
+            conn.executemany("INSERT INTO indexed (id, mod) VALUES (?, ?)", [(nid, mod) for nid, mod, _, _ in rows])
+
+    def attached(self, work):
+        """Run work(writer) with the collection attached read-only as `col`."""
+        with self.lock:
+            conn = self.writer
+            conn.execute("ATTACH DATABASE ? AS col", ("file:" + quote(COLLECTION_PATH) + "?mode=ro",))
+            try:
+                return work(conn)
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                conn.execute("DETACH DATABASE col")
+
+    def sync(self) -> int:
+        """Bring the index up to date with the collection. Returns notes re-indexed or dropped."""
+        if not os.path.exists(COLLECTION_PATH):
+            raise sqlite3.OperationalError(f"collection not found: {COLLECTION_PATH}")
+
+        def work(conn):
+            as_of = int(time.time() * 1000)
+            conn.execute("BEGIN")
+            if conn.execute("SELECT 1 FROM col.sqlite_master WHERE name = 'snapshot_meta'").fetchone():
+                (as_of,) = conn.execute("SELECT taken_at FROM col.snapshot_meta").fetchone()
+            mod, scm = conn.execute("SELECT mod, scm FROM col.col").fetchone()
+            if mod == self.meta(conn, "mod"):
+                self.set_meta(conn, "as_of", as_of)
+                conn.execute("COMMIT")
+                return 0
+            notes_mod, notes_usn = self.meta(conn, "notes_mod"), self.meta(conn, "notes_usn")
+            # The next sync's watermarks, read in the same transaction as the
+            # changed ids so a commit can't fall between the two
+            (next_mod,) = conn.execute("SELECT max(mod) FROM col.notes WHERE usn = -1").fetchone()
+            (next_usn,) = conn.execute("SELECT max(usn) FROM col.notes").fetchone()
+            if notes_usn is None or scm != self.meta(conn, "scm"):
+                changed = [nid for (nid,) in conn.execute(
+                    "SELECT n.id FROM col.notes n LEFT JOIN indexed i ON i.id = n.id WHERE i.mod IS NOT n.mod")]
+            else:
+                changed = [nid for (nid,) in conn.execute(
+                    "SELECT id FROM col.notes WHERE (usn = -1 AND mod >= ?) OR usn > ?", (notes_mod, notes_usn))]
+            # Commit in batches so a first build doesn't hold one huge
+            # transaction; each batch records the mods it indexed
+            for start in range(0, len(changed), SEARCH_BATCH):
+                self.reindex(conn, changed[start:start + SEARCH_BATCH])
+                conn.execute("COMMIT")
+                conn.execute("BEGIN")
+            # Counts that differ mean deleted notes or new ones the
+            # watermarks missed
+            (live,) = conn.execute("SELECT count(*) FROM col.notes").fetchone()
+            (indexed,) = conn.execute("SELECT count(*) FROM indexed").fetchone()
+            if indexed != live:
+                deleted = [nid for (nid,) in conn.execute(
+                    "SELECT id FROM indexed WHERE id NOT IN (SELECT id FROM col.notes)")]
+                missing = [nid for (nid,) in conn.execute(
+                    "SELECT n.id FROM col.notes n LEFT JOIN indexed i ON i.id = n.id WHERE i.id IS NULL")]
+                self.reindex(conn, deleted + missing)
+                changed += deleted + missing
+            self.set_meta(conn, "mod", mod)
+            self.set_meta(conn, "as_of", as_of)
+            self.set_meta(conn, "scm", scm)
+            self.set_meta(conn, "notes_mod", next_mod or 0)
+            self.set_meta(conn, "notes_usn", -1 if next_usn is None else next_usn)
+            conn.execute("COMMIT")
+            return len(changed)
+
+        count = self.attached(work)
+        self.ready = True
+        self.last_error = None
+        return count
+
+    def refresh_hits(self, hits):
+        """Re-index hits whose note changed or vanished since it was indexed. Returns how many."""
+        ids = [hit[0] for hit in hits]
+        marks = ",".join("?" * len(ids))
+        current = dict(connection().execute(f"SELECT id, mod FROM notes WHERE id IN ({marks})", ids))
+        stale = [nid for nid, indexed_mod, _, _ in hits if current.get(nid) != indexed_mod]
+        if stale:
+            def work(conn):
+                conn.execute("BEGIN")
+                self.reindex(conn, stale)
+                conn.execute("COMMIT")
+            self.attached(work)
+        return len(stale)
+
+    def search(self, query: str, limit: int, offset: int) -> dict:
+        if not self.ready:
+            raise IndexNotReady("search index is still being built")
+        stale = 0
+        for attempt in range(2):
+            conn = self.reader()
+            conn.execute("BEGIN")
+            try:
+                mod, as_of = self.meta(conn, "mod"), self.meta(conn, "as_of")
+                hits = conn.execute(
+                    "SELECT f.rowid, i.mod, -bm25(notes_fts), snippet(notes_fts, -1, '<b>', '</b>', '...', 16) "
+                    "FROM notes_fts f JOIN indexed i ON i.id = f.rowid "
+                    "WHERE notes_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+                    (query, limit, offset)).fetchall()
+            except sqlite3.OperationalError as e:
+                if "fts5" in str(e) or "no such column" in str(e) or "unterminated" in str(e):
+                    raise BadQuery(str(e))
+                raise
+            finally:
+                if conn.in_transaction:
+                    conn.execute("COMMIT")
+            if not hits or attempt:
+                break
+            try:
+                stale = self.refresh_hits(hits)
+            except sqlite3.Error:
+                # Collection unreadable right now: answer from the index as is
+                break
+            if not stale:
+                break
+        try:
+            view = run_query("modelNames", {})
+            current = view["current"] and view["mod"] == mod
+        except sqlite3.Error:
+            current = False
+        return {
+            "result": [{"noteId": nid, "score": round(score, 4), "snippet": snippet}
+                       for nid, _, score, snippet in hits],
+            "mod": mod,
+            "asOf": as_of,
+            "current": current,
+            "staleHits": stale,
+        }
+
+    def stats(self) -> dict:
+        conn = self.reader()
+        as_of = self.meta(conn, "as_of")
+        return {
+            "path": self.path,
+            "ready": self.ready,
+            "notes": conn.execute("SELECT count(*) FROM indexed").fetchone()[0],
+            "mod": self.meta(conn, "mod"),
+            "asOf": as_of,
+            "lagSeconds": (time.time() * 1000 - as_of) / 1000 if as_of else None,
+            "lastError": self.last_error,
+        }
+
+
+search_index = None
+
+
+def keep_index_fresh(index: SearchIndex):
+    while True:
+        try:
+            started = time.monotonic()
+            count = index.sync()
+            if count:
+                print(f"Search index: {count} notes updated in {time.monotonic() - started:.2f}s")
+                sys.stdout.flush()
+        except sqlite3.Error as e:
+            # Locked, missing or mid-rewrite: try again next round
+            index.last_error = str(e)
+        time.sleep(SEARCH_REFRESH_S)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, keep-alive
+    # replies stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": "not found"})
+            return
+        search = search_index.stats() if search_index else None
+        try:
+            reply = run_query("modelNames", {})
+            self.send_json(200, {"path": COLLECTION_PATH, "snapshot": _local.snapshot, "mod": reply["mod"],
+                                 "asOf": reply["asOf"], "current": reply["current"], "lagSeconds": (time.time() * 1000 - reply["asOf"]) / 1000,
+                                 "search": search})
+        except sqlite3.Error as e:
+            self.send_json(503, {"path": COLLECTION_PATH, "error": str(e), "search": search})
+
+    def read_payload(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self.send_json(413, {"error": "request body too large"})
+            return None
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        if self.path == "/search":
+            self.handle_search()
+            return
+        if self.path != "/query":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            payload = self.read_payload()
+            if payload is None:
+                return
+            action, params = payload.get("action"), payload.get("params") or {}
+            if not isinstance(params, dict):
+                raise Unsupported("params must be an object")
+            self.send_json(200, run_query(action, params))
+        except (ValueError, AttributeError) as e:
+            self.send_json(400, {"error": f"invalid request: {e}"})
+        except Unsupported as e:
+            self.send_json(422, {"error": str(e)})
+        except sqlite3.Error as e:
+            # Locked, missing or mid-rewrite: the proxy asks AnkiConnect instead
+            drop_connection()
+            self.send_json(503, {"error": str(e)})
+
+    def handle_search(self):
+        if search_index is None:
+            self.send_json(404, {"error": "search index disabled (set ANKI_SEARCH_INDEX_PATH)"})
+            return
+        try:
+            payload = self.read_payload()
+            if payload is None:
+                return
+            query, limit, offset = payload.get("query"), payload.get("limit", 20), payload.get("offset", 0)
+            if not isinstance(query, str) or not isinstance(limit, int) or not isinstance(offset, int):
+                raise ValueError("query must be a string, limit and offset integers")
+            self.send_json(200, search_index.search(query, limit, offset))
+        except (ValueError, AttributeError, BadQuery) as e:
+            self.send_json(400, {"error": f"invalid search: {e}"})
+        except IndexNotReady as e:
+            self.send_json(503, {"error": str(e)})
+        except sqlite3.Error as e:
+            drop_connection()
+            self.send_json(503, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", PORT), Handler)
+    server.daemon_threads = True
+    print(f"Anki collection reader listening on port {PORT}")
+    print(f"  Collection: {COLLECTION_PATH}")
+    if SEARCH_INDEX_PATH:
+        global search_index
+        search_index = SearchIndex(SEARCH_INDEX_PATH)
+        threading.Thread(target=keep_index_fresh, args=(search_index,), daemon=True).start()
+        print(f"  Search index: {SEARCH_INDEX_PATH}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Keep a read replica of collection.anki2 fresh using SQLite's online backup API.
+
+Readers (the collection reader, ad-hoc analytics) open the replica instead of
+the live collection, so they never hold locks on the file Anki writes to.
+
+Anki opens the collection with an exclusive lock, so copies only succeed while
+Anki has it closed (e.g. while it restarts). While the lock is held each copy
+waits up to ANKI_SNAPSHOT_TIMEOUT_S, fails with "database is locked" and the old
+replica stays in place; the replica stays fresh only with that lock off.
+
+Every ANKI_SNAPSHOT_INTERVAL_S seconds:
+1. If collection.anki2 and its -wal are unchanged since the last snapshot, only
+   the replica's timestamp is refreshed
+2. Otherwise the collection is copied with the backup API, ANKI_SNAPSHOT_PAGES
+   pages at a time with ANKI_SNAPSHOT_SLEEP_MS between batches, so Anki is never
+   blocked for long (0 copies everything in one step). A copy that hasn't
+   finished within ANKI_SNAPSHOT_TIMEOUT_S is abandoned until the next round
+3. The copy is switched to a single-file journal, stamped with the time the
+   copy started and the live collection's path (table snapshot_meta) and
+   fsynced
+4. It is published with an atomic rename over the replica, so readers see the
+   old or the new replica, never a partial one
+
+The replica's lag is now minus snapshot_meta.taken_at: every write committed
+before taken_at is in the replica.
+
+Usage:
+    ANKI_COLLECTION_PATH=... ANKI_SNAPSHOT_PATH=... ./anki-collection-snapshot.py
+    ./anki-collection-snapshot.py --once    # take one snapshot and exit
+"""
+
+import os
+import sqlite3
+import sys
+import time
+from urllib.parse import quote
+
+# Configuration
+COLLECTION_PATH = os.environ.get(
+    "ANKI_COLLECTION_PATH",
+    os.path.expanduser("~/anki/anki_data/.local/share/Anki2/User 1/collection.anki2"),
+)
+SNAPSHOT_PATH = os.environ.get("ANKI_SNAPSHOT_PATH", os.path.expanduser("~/anki/collection-snapshot.anki2"))
+INTERVAL_S = float(os.environ.get("ANKI_SNAPSHOT_INTERVAL_S", "30"))
+PAGES_PER_STEP = int(os.environ.get("ANKI_SNAPSHOT_PAGES", "1024")) or -1
+SLEEP_S = float(os.environ.get("ANKI_SNAPSHOT_SLEEP_MS", "10")) / 1000
+# Give up on a copy that hasn't finished after this long, lock waits included
+COPY_TIMEOUT_S = float(os.environ.get("ANKI_SNAPSHOT_TIMEOUT_S", "60"))
+# How long each backup step waits for a lock on the collection
+BUSY_TIMEOUT_S = 1.0
+# Step statuses for a locked collection (SQLITE_BUSY, SQLITE_LOCKED): the step
+# is retried, nothing was copied, so they are waits rather than restarts
+LOCKED_STATUSES = (5, 6)
+# A commit to the collection between steps restarts the backup; after this
+# many restarts the rest is copied in one step (one read transaction, which in
+# WAL mode doesn't block Anki's writes)
+MAX_RESTARTS = 3
+
+
+class Restarted(Exception):
+    """The backup restarted too often while the collection was being written."""
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def source_signature():
+    """(mtime, size) of the collection and its WAL; any commit changes one of them."""
+    signature = []
+    for path in (COLLECTION_PATH, COLLECTION_PATH + "-wal"):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def fsync_path(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def copy_collection(taken_at: int):
+    """
+    Back up the collection into a temp file and rename it over the replica.
+    Returns (pages, restarts); raises sqlite3.OperationalError after
+    COPY_TIMEOUT_S.
+    """
+    tmp_path = SNAPSHOT_PATH + ".tmp"
+    for suffix in ("", "-journal", "-wal", "-shm"):
+        if os.path.exists(tmp_path + suffix):
+            os.unlink(tmp_path + suffix)
+
+    source = sqlite3.connect("file:" + quote(COLLECTION_PATH) + "?mode=ro", uri=True, timeout=BUSY_TIMEOUT_S)
+    target = sqlite3.connect(tmp_path)
+    deadline = time.monotonic() + COPY_TIMEOUT_S
+    pages, last_remaining, restarts = 0, None, 0
+    try:
+        def check_deadline(status, remaining, total):
+            if time.monotonic() > deadline:
+                reason = "database is locked" if status in LOCKED_STATUSES else f"{remaining} of {total} pages left"
+                raise sqlite3.OperationalError(f"copy abandoned after {COPY_TIMEOUT_S:.0f}s: {reason}")
+
+        def progress(status, remaining, total):
+            nonlocal pages, last_remaining, restarts
+            check_deadline(status, remaining, total)
+            if status in LOCKED_STATUSES:
+                return
+            pages = total
+            if last_remaining is not None and remaining >= last_remaining:
+                restarts += 1
+                if restarts > MAX_RESTARTS:
+                    raise Restarted()
+            last_remaining = remaining
+
+        try:
+            source.backup(target, pages=PAGES_PER_STEP, progress=progress, sleep=SLEEP_S)
+        except Restarted:
+            source.backup(target, pages=-1, progress=check_deadline, sleep=SLEEP_S)
+        # The copy keeps the collection's WAL mode; a single-file replica can be
+        # opened read-only without a -shm file
+        target.execute("PRAGMA journal_mode = DELETE")
+        target.execute("CREATE TABLE snapshot_meta (taken_at integer NOT NULL, source text NOT NULL)")
+        target.execute("INSERT INTO snapshot_meta VALUES (?, ?)", (taken_at, os.path.abspath(COLLECTION_PATH)))
+        target.commit()
+    finally:
+        target.close()
+        source.close()
+
+    fsync_path(tmp_path)
+    os.replace(tmp_path, SNAPSHOT_PATH)
+    fsync_path(os.path.dirname(os.path.abspath(SNAPSHOT_PATH)))
+    return pages, restarts
+
+
+def refresh_timestamp(taken_at: int):
+    """The collection hasn't changed: the existing replica is current as of taken_at."""
+    conn = sqlite3.connect(SNAPSHOT_PATH, timeout=BUSY_TIMEOUT_S)
+    try:
+        conn.execute("UPDATE snapshot_meta SET taken_at = ?", (taken_at,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def snapshot_once(last_signature):
+    """Take or refresh one snapshot. Returns the source signature it reflects."""
+    # Read the signature before copying: a commit during the copy changes it,
+    # so the next round copies again
+    signature = source_signature()
+    taken_at = now_ms()
+    if signature == last_signature and os.path.exists(SNAPSHOT_PATH):
+        refresh_timestamp(taken_at)
+        return signature
+
+    pages, restarts = copy_collection(taken_at)
+    elapsed = (now_ms() - taken_at) / 1000
+    print(f"Snapshot published: {pages} pages in {elapsed:.2f}s ({restarts} restarts) -> {SNAPSHOT_PATH}")
+    sys.stdout.flush()
+    return signature
+
+
+def replica_lag_seconds():
+    """Seconds since the replica was taken, or None if there is no replica yet."""
+    try:
+        conn = sqlite3.connect("file:" + quote(SNAPSHOT_PATH) + "?mode=ro", uri=True)
+        try:
+            (taken_at,) = conn.execute("SELECT taken_at FROM snapshot_meta").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return (now_ms() - taken_at) / 1000
+
+
+def main():
+    print(f"Snapshotting {COLLECTION_PATH}")
+    print(f"  Replica: {SNAPSHOT_PATH}")
+    print(f"  Interval: {INTERVAL_S}s, {PAGES_PER_STEP} pages per step, {SLEEP_S * 1000:.0f}ms between steps")
+    sys.stdout.flush()
+
+    once = "--once" in sys.argv[1:]
+    last_signature = None
+    while True:
+        started = time.monotonic()
+        try:
+            last_signature = snapshot_once(last_signature)
+        except (sqlite3.Error, OSError) as e:
+            # Typically the collection is locked by Anki; keep the old replica
+            lag = replica_lag_seconds()
+            lag_text = "no replica yet" if lag is None else f"replica lag {lag:.0f}s"
+            print(f"Snapshot failed ({lag_text}): {e}", file=sys.stderr)
+            last_signature = None
+            if once:
+                sys.exit(1)
+        if once:
+            return
+        time.sleep(max(0.0, INTERVAL_S - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,137 @@
  */
 
 const http = require('http');
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const zlib = require('zlib');
+const crypto = require('crypto');
 
-const ANKI_CONNECT_URL = 'http://localhost:8765';
-const PORT = 8767;
+function envInt(name, fallback) {
+  const value = parseInt(process.env[name], 10);
+  return Number.isNaN(value) ? fallback : value;
+}
+
+const ANKI_CONNECT_URL = process.env.ANKI_CONNECT_URL || 'http://localhost:8765';
+const PORT = envInt('ANKI_REST_PORT', 8767);
+const OPENAPI_PATH = process.env.ANKI_OPENAPI_PATH || '/home/sprite/anki/openapi-anki.json';
+const MAX_BODY_BYTES = envInt('ANKI_MAX_BODY_BYTES', 100 * 1024 * 1024);
+
+// Raw media uploads (PUT /media/{filename}) are streamed to a temp file here
+// and AnkiConnect is given its path
+const MEDIA_UPLOAD_DIR = process.env.ANKI_MEDIA_UPLOAD_DIR || os.tmpdir();
+const MAX_MEDIA_BYTES = envInt('ANKI_MAX_MEDIA_BYTES', 100 * 1024 * 1024);
+
+// Content-addressed upload dedup: uploads are hashed while streaming and an
+// identical file already in collection.media is reused instead of stored
+// again. The sha256 -> filename index is kept in ANKI_MEDIA_INDEX_PATH if set.
+const MEDIA_DIR = process.env.ANKI_MEDIA_DIR || '/home/sprite/anki/anki_data/.local/share/Anki2/User 1/collection.media';
+const MEDIA_DEDUP = process.env.ANKI_MEDIA_DEDUP !== '0';
+const MEDIA_INDEX_PATH = process.env.ANKI_MEDIA_INDEX_PATH || '';
+
+// Upstream connection pool settings (set ANKI_UPSTREAM_KEEPALIVE=0 to disable reuse)
+const UPSTREAM_KEEPALIVE = process.env.ANKI_UPSTREAM_KEEPALIVE !== '0';
+const UPSTREAM_MAX_SOCKETS = envInt('ANKI_UPSTREAM_MAX_SOCKETS', 8);
+
+// Backpressure: at most UPSTREAM_MAX_INFLIGHT calls hit AnkiConnect at once and
+// at most UPSTREAM_MAX_QUEUE wait behind them; beyond that requests get a 429
+const UPSTREAM_MAX_INFLIGHT = envInt('ANKI_UPSTREAM_MAX_INFLIGHT', 4);
+const UPSTREAM_MAX_QUEUE = envInt('ANKI_UPSTREAM_MAX_QUEUE', 200);
+
+// Upstream timeouts, per action where the default doesn't fit
+const UPSTREAM_TIMEOUT_MS = envInt('ANKI_UPSTREAM_TIMEOUT_MS', 30000);
+const ACTION_TIMEOUT_MS = {
+  version: 3000,
+  deckNames: 10000,
+  modelNames: 10000,
+  modelFieldNames: 10000,
+  sync: envInt('ANKI_SYNC_TIMEOUT_MS', 300000),
+};
+
+// Circuit breaker: after CIRCUIT_FAILURE_THRESHOLD consecutive upstream
+// failures, fail fast with 503 for CIRCUIT_OPEN_MS, then probe with `version`
+const CIRCUIT_FAILURE_THRESHOLD = envInt('ANKI_CIRCUIT_FAILURE_THRESHOLD', 5);
+const CIRCUIT_OPEN_MS = envInt('ANKI_CIRCUIT_OPEN_MS', 10000);
+
+// Startup readiness polling backoff
+const READY_BASE_BACKOFF_MS = 500;
+const READY_MAX_BACKOFF_MS = envInt('ANKI_READY_MAX_BACKOFF_MS', 10000);
+
+// Priority lanes: bulk traffic yields to interactive traffic, and large list
+// payloads are split so they can be interleaved with interactive calls
+const BULK_CHUNK_SIZE = envInt('ANKI_BULK_CHUNK_SIZE', 100);
+const BULK_STARVATION_LIMIT = 4;
+const BULK_ACTIONS = new Set(['addNotes', 'deleteNotes', 'sync']);
+const CHUNKED_ACTIONS = { addNotes: 'notes', notesInfo: 'notes', deleteNotes: 'notes' };
+
+// Metadata cache TTLs per action (0 disables caching for that action)
+const CACHE_TTL_MS = {
+  deckNames: envInt('ANKI_CACHE_TTL_DECKNAMES_MS', 30000),
+  modelNames: envInt('ANKI_CACHE_TTL_MODELNAMES_MS', 300000),
+  modelFieldNames: envInt('ANKI_CACHE_TTL_MODELFIELDNAMES_MS', 300000),
+};
+const CACHE_MAX_ENTRIES = 500;
+
+// Concurrent addNote calls arriving within this window are sent upstream as
+// one `multi` call (0 disables batching)
+const ADDNOTE_BATCH_WINDOW_MS = envInt('ANKI_ADDNOTE_BATCH_WINDOW_MS', 5);
+const ADDNOTE_BATCH_MAX = envInt('ANKI_ADDNOTE_BATCH_MAX', 100);
+
+// Read-only actions: safe to cache and to share one upstream call between identical requests
+const READ_ACTIONS = new Set(['deckNames', 'modelNames', 'modelFieldNames', 'findNotes', 'notesInfo']);
+
+// Actions that may change decks or models and so flush the metadata cache
+const CACHE_INVALIDATING_ACTIONS = new Set(['createDeck', 'addNote', 'addNotes', 'deleteNotes', 'sync']);
+
+const BATCH_MAX_OPERATIONS = envInt('ANKI_BATCH_MAX_OPERATIONS', 100);
+
+// Cursor pagination for findNotes/notesInfo: search results are snapshotted
+// server-side and expire after PAGINATION_TTL_MS without use
+const PAGINATION_TTL_MS = envInt('ANKI_PAGINATION_TTL_MS', 300000);
+const PAGINATION_MAX_SNAPSHOTS = 100;
+const PAGE_DEFAULT_LIMIT = 100;
+const PAGE_MAX_LIMIT = 10000;
+const SEARCH_DEFAULT_LIMIT = 20;
+
+// Write-ahead journal (set ANKI_JOURNAL_PATH to enable): while AnkiConnect is
+// unreachable, writes are appended to the journal, answered with 202 and a
+// job id, and replayed in order once it is back
+const JOURNAL_PATH = process.env.ANKI_JOURNAL_PATH || '';
+const JOURNAL_FSYNC_MS = envInt('ANKI_JOURNAL_FSYNC_MS', 5);
+const JOURNAL_REPLAY_BATCH = envInt('ANKI_JOURNAL_REPLAY_BATCH', 50);
+const JOURNAL_RETRY_MS = 1000;
+const JOURNALED_ACTIONS = new Set(['createDeck', 'addNote', 'addNotes', 'updateNoteFields', 'deleteNotes']);
+const JOB_MAX_ENTRIES = 10000;
+
+// Idempotency-Key support for addNote/addNotes: the first reply for a key is
+// kept (and, if ANKI_IDEMPOTENCY_PATH is set, persisted) so retries get the
+// same reply without another AnkiConnect call
+const IDEMPOTENCY_PATH = process.env.ANKI_IDEMPOTENCY_PATH || '';
+const IDEMPOTENCY_TTL_MS = envInt('ANKI_IDEMPOTENCY_TTL_MS', 24 * 60 * 60 * 1000);
+const IDEMPOTENCY_MAX_KEYS = envInt('ANKI_IDEMPOTENCY_MAX_KEYS', 10000);
+const IDEMPOTENCY_MAX_KEY_LENGTH = 255;
+const IDEMPOTENT_ACTIONS = new Set(['addNote', 'addNotes']);
+
+// Sync jobs: a queued sync waits until writes have been quiet for
+// ANKI_SYNC_DEBOUNCE_MS (default 0, i.e. start at once), but never longer
+// than ANKI_SYNC_MAX_DELAY_MS after it was first requested
+const SYNC_DEBOUNCE_MS = envInt('ANKI_SYNC_DEBOUNCE_MS', 0);
+const SYNC_MAX_DELAY_MS = envInt('ANKI_SYNC_MAX_DELAY_MS', 300000);
+
+// Automatic sync after write bursts (0 disables): one sync once writes have
+// been quiet for ANKI_AUTO_SYNC_QUIET_MS, or ANKI_AUTO_SYNC_MAX_DELAY_MS
+// after the first unsynced write, whichever comes first
+const AUTO_SYNC_QUIET_MS = envInt('ANKI_AUTO_SYNC_QUIET_MS', 0);
+const AUTO_SYNC_MAX_DELAY_MS = envInt('ANKI_AUTO_SYNC_MAX_DELAY_MS', 600000);
+
+// Read-only collection reader (scripts/anki-collection-reader.py, set
+// ANKI_READER_URL to enable): answers these reads from collection.anki2 (or a
+// replica of it) in a separate process instead of on Anki's main thread.
+// After a failed call it is skipped for READER_RETRY_MS.
+const READER_URL = process.env.ANKI_READER_URL || '';
+const READER_TIMEOUT_MS = envInt('ANKI_READER_TIMEOUT_MS', 2000);
+const READER_RETRY_MS = 5000;
+const READER_ACTIONS = new Set(['deckNames', 'modelNames', 'modelFieldNames', 'notesInfo']);
 
 // Map REST endpoints to AnkiConnect actions
 const ENDPOINT_MAP = {
@@ -17,133 +145,1913 @@ const ENDPOINT_MAP = {
   'POST /modelFieldNames': { action: 'modelFieldNames', paramKey: 'modelName' },
   'POST /addNote': { action: 'addNote', paramKey: 'note' },
   'POST /addNotes': { action: 'addNotes', paramKey: 'notes' },
-  'POST /findNotes': { action: 'findNotes', paramKey: 'query' },
-  'POST /notesInfo': { action: 'notesInfo', paramKey: 'notes' },
+  'POST /findNotes': { action: 'findNotes', paramKey: 'query', paginated: true },
+  'POST /notesInfo': { action: 'notesInfo', paramKey: 'notes', paginated: true },
   'POST /updateNoteFields': { action: 'updateNoteFields', paramKey: 'note' },
   'POST /deleteNotes': { action: 'deleteNotes', paramKey: 'notes' },
-  'POST /sync': { action: 'sync' },
+  'POST /storeMediaFile': { handler: storeMediaFile },
+  'PUT /media/{filename}': { handler: uploadMedia, rawBody: true },
+  'POST /sync': { handler: postSync, status: 202 },
+  'GET /sync': { handler: getSyncStatus },
+  'POST /batch': { handler: runBatch },
+  'POST /streamNotes': { handler: streamNotes, stream: true, priority: 'bulk' },
+  'POST /search': { handler: searchNotes },
 };
 
-async function callAnkiConnect(action, params = {}) {
+// ENDPOINT_MAP keys with {param} segments, matched when no exact key does
+const TEMPLATED_ENDPOINTS = Object.keys(ENDPOINT_MAP).filter(key => key.includes('{')).map(key => {
+  const names = [];
+  const pattern = key.replace(/\{(\w+)\}/g, (_, name) => {
+    names.push(name);
+    return '([^/]+)';
+  });
+  return { key, names, regex: new RegExp(`^${pattern}$`) };
+});
+
+function matchEndpoint(method, path) {
+  const key = `${method} ${path}`;
+  if (ENDPOINT_MAP[key]) return { key, endpoint: ENDPOINT_MAP[key], params: {} };
+  for (const { key: template, names, regex } of TEMPLATED_ENDPOINTS) {
+    const match = regex.exec(key);
+    if (match) {
+      const params = Object.fromEntries(names.map((name, i) => [name, match[i + 1]]));
+      return { key: template, endpoint: ENDPOINT_MAP[template], params };
+    }
+  }
+  return null;
+}
+
+// Actions allowed inside POST /batch (sync runs as a job, see POST /sync)
+const BATCH_ACTIONS = new Set(Object.values(ENDPOINT_MAP).map(e => e.action).filter(Boolean));
+
+function httpError(statusCode, message, extra = {}) {
+  const err = new Error(message);
+  err.statusCode = statusCode;
+  Object.assign(err, extra);
+  return err;
+}
+
+// Persistent agent so REST calls reuse TCP connections to AnkiConnect
+// instead of paying a handshake (and leaving a TIME_WAIT socket) per call
+const upstreamAgent = new http.Agent({
+  keepAlive: true,
+  maxSockets: UPSTREAM_MAX_SOCKETS,
+  maxFreeSockets: UPSTREAM_MAX_SOCKETS,
+});
+
+const upstreamStats = { requests: 0, reusedSockets: 0, newSockets: 0, staleSocketRetries: 0, errors: 0, timeouts: 0 };
+const seenSockets = new WeakSet();
+
+function countSockets(sockets) {
+  return Object.values(sockets).reduce((n, list) => n + list.length, 0);
+}
+
+function getUpstreamStats() {
+  return {
+    keepAlive: UPSTREAM_KEEPALIVE,
+    maxSockets: UPSTREAM_MAX_SOCKETS,
+    ...upstreamStats,
+    activeSockets: countSockets(upstreamAgent.sockets),
+    freeSockets: countSockets(upstreamAgent.freeSockets),
+    pendingRequests: countSockets(upstreamAgent.requests),
+  };
+}
+
+// Bounded upstream queue. AnkiConnect runs on Anki's single GUI thread, so
+// extra concurrency only moves the queue into Anki where we can't see or
+// bound it. Waiters sit in one of two priority lanes; a released slot passes
+// straight to the next waiter, preferring the interactive lane but letting
+// one bulk call through after every BULK_STARVATION_LIMIT interactive ones.
+const upstreamLanes = { interactive: [], bulk: [] };
+let upstreamInFlight = 0;
+let interactiveStreak = 0;
+const queueStats = { admitted: 0, queued: 0, rejected: 0, maxWaitMs: 0, avgWaitMs: 0, avgServiceMs: 0 };
+const laneStats = { interactive: { served: 0, avgWaitMs: 0 }, bulk: { served: 0, avgWaitMs: 0 } };
+
+// Exponentially weighted moving average, weighting the latest sample at 10%
+function ewma(previous, sample) {
+  return previous === 0 ? sample : previous * 0.9 + sample * 0.1;
+}
+
+function queueDepth() {
+  return upstreamLanes.interactive.length + upstreamLanes.bulk.length;
+}
+
+function getQueueStats() {
+  const oldest = [upstreamLanes.interactive[0], upstreamLanes.bulk[0]]
+    .filter(Boolean)
+    .reduce((min, w) => Math.min(min, w.enqueuedAt), Infinity);
+  const round = n => Math.round(n * 10) / 10;
+  return {
+    maxInFlight: UPSTREAM_MAX_INFLIGHT,
+    maxQueue: UPSTREAM_MAX_QUEUE,
+    inFlight: upstreamInFlight,
+    depth: queueDepth(),
+    oldestWaitMs: oldest === Infinity ? 0 : Date.now() - oldest,
+    ...queueStats,
+    avgWaitMs: round(queueStats.avgWaitMs),
+    avgServiceMs: round(queueStats.avgServiceMs),
+    lanes: Object.fromEntries(Object.entries(laneStats).map(([lane, stats]) => [lane, {
+      depth: upstreamLanes[lane].length,
+      served: stats.served,
+      avgWaitMs: round(stats.avgWaitMs),
+    }])),
+  };
+}
+
+// Seconds until the current queue should have drained, for Retry-After
+function estimateRetryAfter() {
+  const drainMs = (queueDepth() * queueStats.avgServiceMs) / UPSTREAM_MAX_INFLIGHT;
+  return Math.max(1, Math.ceil(drainMs / 1000));
+}
+
+function acquireUpstreamSlot(priority = 'interactive') {
+  if (upstreamInFlight < UPSTREAM_MAX_INFLIGHT) {
+    upstreamInFlight++;
+    queueStats.admitted++;
+    laneStats[priority].served++;
+    return Promise.resolve();
+  }
+  if (queueDepth() >= UPSTREAM_MAX_QUEUE) {
+    queueStats.rejected++;
+    return Promise.reject(httpError(429, 'Too many requests queued for AnkiConnect. Retry later.', {
+      retryAfter: estimateRetryAfter(),
+      details: { status: 'busy', code: 429 },
+    }));
+  }
+  queueStats.admitted++;
+  queueStats.queued++;
+  return new Promise(resolve => upstreamLanes[priority].push({ resolve, priority, enqueuedAt: Date.now() }));
+}
+
+function nextWaiter() {
+  const { interactive, bulk } = upstreamLanes;
+  if (bulk.length && (!interactive.length || interactiveStreak >= BULK_STARVATION_LIMIT)) {
+    interactiveStreak = 0;
+    return bulk.shift();
+  }
+  if (interactive.length) interactiveStreak++;
+  return interactive.shift();
+}
+
+function releaseUpstreamSlot() {
+  const next = nextWaiter();
+  if (!next) {
+    upstreamInFlight--;
+    return;
+  }
+  const waitMs = Date.now() - next.enqueuedAt;
+  queueStats.avgWaitMs = ewma(queueStats.avgWaitMs, waitMs);
+  queueStats.maxWaitMs = Math.max(queueStats.maxWaitMs, waitMs);
+  laneStats[next.priority].served++;
+  laneStats[next.priority].avgWaitMs = ewma(laneStats[next.priority].avgWaitMs, waitMs);
+  next.resolve();
+}
+
+// Startup readiness. The proxy listens immediately and answers API calls
+// with 503 + Retry-After until the first successful `version` call.
+const readiness = { ready: false, startedAt: Date.now(), readyAt: null, attempts: 0, lastError: null, nextCheckAt: 0 };
+
+function getReadinessStats() {
+  return { ...readiness, retryInMs: readiness.ready ? 0 : Math.max(0, readiness.nextCheckAt - Date.now()) };
+}
+
+function assertReady() {
+  if (readiness.ready) return;
+  throw httpError(503, 'AnkiConnect is not ready yet. Anki may still be starting up.', {
+    retryAfter: Math.max(1, Math.ceil(getReadinessStats().retryInMs / 1000)),
+    details: { status: 'starting', code: 503 },
+  });
+}
+
+// Circuit breaker around AnkiConnect. When Anki is wedged (e.g. behind a
+// modal dialog) calls would otherwise hang until their timeout and hold
+// queue slots. While open, calls are rejected immediately; after
+// CIRCUIT_OPEN_MS a single `version` probe decides whether to close again.
+const circuit = { state: 'closed', consecutiveFailures: 0, openedAt: 0, trips: 0, lastError: null };
+
+function getCircuitStats() {
+  return {
+    ...circuit,
+    retryInMs: circuit.state === 'open' ? Math.max(0, circuit.openedAt + CIRCUIT_OPEN_MS - Date.now()) : 0,
+  };
+}
+
+function openCircuit(err) {
+  circuit.state = 'open';
+  circuit.openedAt = Date.now();
+  circuit.lastError = err.message;
+  circuit.trips++;
+  console.error(`AnkiConnect circuit opened: ${err.message}`);
+  setTimeout(probeCircuit, CIRCUIT_OPEN_MS).unref();
+}
+
+async function probeCircuit() {
+  circuit.state = 'half_open';
+  try {
+    const reply = await postToAnkiConnect('version', {});
+    if (!reply.result) throw new Error('Unexpected reply to version probe');
+    circuit.state = 'closed';
+    circuit.consecutiveFailures = 0;
+    console.log('AnkiConnect circuit closed');
+  } catch (e) {
+    openCircuit(e);
+  }
+}
+
+function recordUpstreamResult(err) {
+  if (!err) {
+    circuit.consecutiveFailures = 0;
+    return;
+  }
+  circuit.consecutiveFailures++;
+  circuit.lastError = err.message;
+  if (circuit.state === 'closed' && circuit.consecutiveFailures >= CIRCUIT_FAILURE_THRESHOLD) openCircuit(err);
+}
+
+function assertCircuitClosed() {
+  if (circuit.state === 'closed') return;
+  throw httpError(503, 'AnkiConnect is not responding. Requests are paused until it recovers.', {
+    retryAfter: Math.max(1, Math.ceil(getCircuitStats().retryInMs / 1000)),
+    details: { status: 'unavailable', code: 503, circuit: circuit.state },
+  });
+}
+
+async function sendUpstream(action, params, priority) {
+  assertCircuitClosed();
+  const queuedAt = process.hrtime.bigint();
+  await acquireUpstreamSlot(priority);
+  const start = process.hrtime.bigint();
+  upstreamQueueWait.observe({ action, lane: priority }, Number(start - queuedAt) / 1e9);
+  try {
+    assertCircuitClosed();
+    const reply = await postToAnkiConnect(action, params);
+    recordUpstreamResult(null);
+    return reply;
+  } catch (e) {
+    if (!e.statusCode) recordUpstreamResult(e);
+    throw e;
+  } finally {
+    const seconds = Number(process.hrtime.bigint() - start) / 1e9;
+    upstreamDuration.observe({ action }, seconds);
+    queueStats.avgServiceMs = ewma(queueStats.avgServiceMs, seconds * 1000);
+    releaseUpstreamSlot();
+  }
+}
+
+// Large list payloads are split into BULK_CHUNK_SIZE pieces, each queued on
+// its own, so interactive calls can slip in between the chunks of an import.
+// Chunks run in order and every chunk is sent even if an earlier one failed,
+// so ids from chunks that were applied are never lost: results are joined in
+// order with null for each item of a failed chunk, and chunk errors are joined
+// into one error. Only if every chunk throws is the first exception rethrown.
+// Whether any chunk was applied is recorded in chunkedApplied for
+// writeApplied, since the joined reply can't tell (a failed deleteNotes chunk
+// leaves an error and a null result even if every other chunk went through).
+const chunkedApplied = new WeakMap();
+
+async function callAnkiConnect(action, params = {}, priority = 'interactive') {
+  const listKey = CHUNKED_ACTIONS[action];
+  const list = listKey && params[listKey];
+  if (!Array.isArray(list) || list.length <= BULK_CHUNK_SIZE) {
+    return sendUpstream(action, params, priority);
+  }
+
+  const results = [];
+  const errors = [];
+  let listResult = false;
+  let firstException = null;
+  let delivered = 0;
+  let applied = false;
+  for (let i = 0; i < list.length; i += BULK_CHUNK_SIZE) {
+    const chunk = list.slice(i, i + BULK_CHUNK_SIZE);
+    let reply;
+    try {
+      reply = await sendUpstream(action, { ...params, [listKey]: chunk }, priority);
+      delivered++;
+      applied = applied || writeApplied(reply);
+    } catch (e) {
+      firstException = firstException || e;
+      reply = { result: null, error: e.message || 'Unknown error occurred' };
+    }
+    if (reply.error) errors.push(`items ${i}-${i + chunk.length - 1}: ${reply.error}`);
+    if (Array.isArray(reply.result)) {
+      listResult = true;
+      results.push(...reply.result);
+    } else {
+      results.push(...chunk.map(() => null));
+    }
+  }
+  if (delivered === 0) throw firstException;
+  const reply = { result: listResult ? results : null, error: errors.length ? errors.join('; ') : null };
+  chunkedApplied.set(reply, applied);
+  return reply;
+}
+
+// X-Priority header wins; otherwise bulk actions and oversized lists go to the bulk lane
+function requestPriority(req, action, params = {}, fallback = 'interactive') {
+  const header = (req.headers['x-priority'] || '').toLowerCase();
+  if (header === 'bulk' || header === 'interactive') return header;
+  if (BULK_ACTIONS.has(action)) return 'bulk';
+  const listKey = CHUNKED_ACTIONS[action];
+  if (listKey && Array.isArray(params[listKey]) && params[listKey].length > BULK_CHUNK_SIZE) return 'bulk';
+  return fallback;
+}
+
+// AnkiConnect closes its socket after every reply without sending
+// `Connection: close`, so a pooled socket can be dead by the time it is
+// reused. A request that fails that way never reached AnkiConnect, so it is
+// retried once on a fresh socket.
+function postToAnkiConnect(action, params, retried = false) {
   const body = JSON.stringify({ action, version: 6, params });
+  const timeoutMs = ACTION_TIMEOUT_MS[action] || UPSTREAM_TIMEOUT_MS;
   return new Promise((resolve, reject) => {
+    upstreamStats.requests++;
     const req = http.request(ANKI_CONNECT_URL, {
       method: 'POST',
+      agent: UPSTREAM_KEEPALIVE && !retried ? upstreamAgent : false,
       headers: { 'Content-Type': 'application/json', 'Content-Length': Buffer.byteLength(body) }
     }, (res) => {
-      let data = '';
-      res.on('data', chunk => data += chunk);
-      res.on('end', () => {
-        try { resolve(JSON.parse(data)); }
+      readBody(res).then(data => {
+        try { resolve(JSON.parse(data.toString('utf8'))); }
         catch (e) { reject(new Error('Invalid JSON from AnkiConnect')); }
-      });
+      }, reject);
+    });
+    req.on('socket', (socket) => {
+      if (seenSockets.has(socket)) {
+        upstreamStats.reusedSockets++;
+      } else {
+        seenSockets.add(socket);
+        upstreamStats.newSockets++;
+      }
+    });
+    const timer = setTimeout(() => {
+      const err = new Error(`AnkiConnect did not answer ${action} within ${timeoutMs}ms`);
+      err.code = 'ETIMEDOUT';
+      upstreamStats.timeouts++;
+      req.destroy(err);
+    }, timeoutMs);
+    req.on('close', () => clearTimeout(timer));
+    req.on('error', (e) => {
+      if (!retried && req.reusedSocket && (e.code === 'ECONNRESET' || e.message === 'socket hang up')) {
+        upstreamStats.staleSocketRetries++;
+        resolve(postToAnkiConnect(action, params, true));
+        return;
+      }
+      upstreamStats.errors++;
+      reject(e);
     });
-    req.on('error', reject);
     req.write(body);
     req.end();
   });
 }
 
-function parseBody(req) {
+// JSON with object keys sorted, so equivalent params produce the same key
+function canonicalJson(value) {
+  if (Array.isArray(value)) return `[${value.map(canonicalJson).join(',')}]`;
+  if (value && typeof value === 'object') {
+    return `{${Object.keys(value).sort().map(k => `${JSON.stringify(k)}:${canonicalJson(value[k])}`).join(',')}}`;
+  }
+  return JSON.stringify(value);
+}
+
+// A reader reply is only used if the reader found its view current (no write
+// to the live collection since the view was taken, whoever made it: this
+// proxy, the GUI, MCP or an AnkiWeb sync) and its collection mod stamp is not
+// older than one already served, so clients still read their own writes and
+// never see the collection go backwards. Anything else - unsupported params,
+// a stale view, the reader down or the collection locked - falls back to
+// AnkiConnect.
+const readerAgent = new http.Agent({ keepAlive: true, maxSockets: 16 });
+const reader = { mod: 0, asOf: 0, skipUntil: 0, lastError: null };
+const readerStats = { served: 0, stale: 0, unsupported: 0, failed: 0 };
+
+// Age of the reader's view (how far a replica trails), as of the last reader
+// reply or health check
+function readerLagSeconds() {
+  return reader.asOf ? (Date.now() - reader.asOf) / 1000 : null;
+}
+
+function getReaderStats() {
+  return {
+    enabled: Boolean(READER_URL), ...readerStats,
+    mod: reader.mod, lagSeconds: readerLagSeconds(), lastError: reader.lastError,
+  };
+}
+
+// POSTs payload to the reader, or GETs path when there is none
+function callReader(path, payload) {
+  const body = payload === undefined ? '' : JSON.stringify(payload);
   return new Promise((resolve, reject) => {
-    let body = '';
-    req.on('data', chunk => body += chunk);
-    req.on('end', () => {
-      if (!body) return resolve({});
-      try { resolve(JSON.parse(body)); }
-      catch (e) { reject(new Error('Invalid JSON in request body')); }
+    const req = http.request(new URL(path, READER_URL), {
+      method: payload === undefined ? 'GET' : 'POST',
+      agent: readerAgent,
+      headers: payload === undefined ? {} : { 'Content-Type': 'application/json', 'Content-Length': Buffer.byteLength(body) },
+    }, (res) => {
+      readBody(res).then(data => {
+        try { resolve({ statusCode: res.statusCode, body: JSON.parse(data.toString('utf8')) }); }
+        catch (e) { reject(new Error('Invalid JSON from collection reader')); }
+      }, reject);
     });
+    req.setTimeout(READER_TIMEOUT_MS, () => req.destroy(new Error(`Collection reader did not answer within ${READER_TIMEOUT_MS}ms`)));
     req.on('error', reject);
+    req.end(body);
+  });
+}
+
+// Returns {result, error} from the reader, or null to fall back to AnkiConnect
+async function queryReader(action, params) {
+  const start = process.hrtime.bigint();
+  let reply;
+  try {
+    reply = await callReader('/query', { action, params });
+  } catch (e) {
+    reply = { statusCode: 503, body: { error: e.message } };
+  }
+  const { statusCode, body } = reply;
+  let outcome = 'served';
+  if (statusCode === 422) outcome = 'unsupported';
+  else if (statusCode !== 200) outcome = 'failed';
+  else if (!body.current || body.mod < reader.mod) outcome = 'stale';
+  readerStats[outcome]++;
+  readerReads.inc({ action, outcome });
+
+  if (statusCode === 200) reader.asOf = body.asOf;
+  if (outcome === 'failed') {
+    reader.lastError = body.error || `HTTP ${statusCode}`;
+    reader.skipUntil = Date.now() + READER_RETRY_MS;
+    return null;
+  }
+  if (outcome !== 'served') return null;
+  reader.mod = body.mod;
+  readerDuration.observe({ action }, Number(process.hrtime.bigint() - start) / 1e9);
+  return { result: body.result, error: null };
+}
+
+// Before /stats and /metrics report the lag: ask the reader how old its view
+// is now (a replica's snapshot_meta.taken_at), so the lag doesn't depend on
+// reads having gone through the reader recently
+async function refreshReaderAge() {
+  if (!READER_URL) return;
+  try {
+    const { statusCode, body } = await callReader('/health');
+    if (statusCode === 200) reader.asOf = body.asOf;
+    else reader.lastError = body.error || `HTTP ${statusCode}`;
+  } catch (e) {
+    reader.lastError = e.message;
+  }
+}
+
+async function readCollection(action, params = {}, priority = 'interactive') {
+  if (READER_URL && READER_ACTIONS.has(action) && Date.now() >= reader.skipUntil) {
+    const reply = await queryReader(action, params);
+    if (reply) return reply;
+  }
+  return callAnkiConnect(action, params, priority);
+}
+
+// Single-flight: concurrent identical reads share one upstream call. The key
+// includes the write epoch so a read issued after a write completes never
+// joins a call that started before it.
+const inflightReads = new Map();
+const coalesceStats = { upstreamCalls: 0, collapsed: 0 };
+let writeEpoch = 0;
+
+function getCoalesceStats() {
+  return { ...coalesceStats, inFlight: inflightReads.size };
+}
+
+function coalescedAnkiConnect(action, params = {}, priority = 'interactive') {
+  const key = `${writeEpoch} ${action} ${canonicalJson(params)}`;
+  const pending = inflightReads.get(key);
+  if (pending) {
+    coalesceStats.collapsed++;
+    return pending;
+  }
+  coalesceStats.upstreamCalls++;
+  const call = readCollection(action, params, priority).finally(() => inflightReads.delete(key));
+  inflightReads.set(key, call);
+  return call;
+}
+
+// In-process cache for metadata reads so they don't queue behind writes
+// on AnkiConnect's single thread. The generation counter stops a read that
+// was in flight during a write from caching its pre-write result.
+const responseCache = new Map();
+const cacheStats = { hits: 0, misses: 0, invalidations: 0 };
+let cacheGeneration = 0;
+
+function invalidateCache() {
+  responseCache.clear();
+  cacheGeneration++;
+  cacheStats.invalidations++;
+}
+
+function getCacheStats() {
+  return { ...cacheStats, entries: responseCache.size, ttlMs: CACHE_TTL_MS };
+}
+
+async function cachedAnkiConnect(action, params = {}, priority = 'interactive') {
+  const ttl = CACHE_TTL_MS[action];
+  if (!ttl) return coalescedAnkiConnect(action, params, priority);
+
+  const key = `${action} ${canonicalJson(params)}`;
+  const entry = responseCache.get(key);
+  if (entry && entry.expires > Date.now()) {
+    cacheStats.hits++;
+    return entry.result;
+  }
+  cacheStats.misses++;
+
+  const generation = cacheGeneration;
+  const result = await coalescedAnkiConnect(action, params, priority);
+  if (!result.error && generation === cacheGeneration) {
+    if (responseCache.size >= CACHE_MAX_ENTRIES) responseCache.delete(responseCache.keys().next().value);
+    responseCache.set(key, { expires: Date.now() + ttl, result });
+  }
+  return result;
+}
+
+// Auto-batching: addNote calls queue here for up to ADDNOTE_BATCH_WINDOW_MS and
+// go upstream as one `multi` call, costing one main-thread hop instead of one
+// per note. Each caller gets back its own {result, error} entry. There is one
+// batch per priority lane, so interactive adds never wait behind bulk ones.
+const pendingAddNotes = { interactive: [], bulk: [] };
+const addNoteTimers = { interactive: null, bulk: null };
+const batchStats = { batches: 0, batchedNotes: 0, largestBatch: 0 };
+
+function getBatchStats() {
+  const pending = pendingAddNotes.interactive.length + pendingAddNotes.bulk.length;
+  return { windowMs: ADDNOTE_BATCH_WINDOW_MS, maxBatch: ADDNOTE_BATCH_MAX, ...batchStats, pending };
+}
+
+function batchedAddNote(params, priority) {
+  return new Promise((resolve, reject) => {
+    const pending = pendingAddNotes[priority];
+    pending.push({ params, resolve, reject });
+    if (pending.length >= ADDNOTE_BATCH_MAX) flushAddNotes(priority);
+    else if (!addNoteTimers[priority]) addNoteTimers[priority] = setTimeout(flushAddNotes, ADDNOTE_BATCH_WINDOW_MS, priority);
+  });
+}
+
+async function flushAddNotes(priority) {
+  clearTimeout(addNoteTimers[priority]);
+  addNoteTimers[priority] = null;
+  const batch = pendingAddNotes[priority];
+  pendingAddNotes[priority] = [];
+  if (batch.length === 0) return;
+
+  batchStats.batches++;
+  batchStats.batchedNotes += batch.length;
+  batchStats.largestBatch = Math.max(batchStats.largestBatch, batch.length);
+
+  try {
+    if (batch.length === 1) {
+      batch[0].resolve(await callAnkiConnect('addNote', batch[0].params, priority));
+      return;
+    }
+    const actions = batch.map(({ params }) => ({ action: 'addNote', version: 6, params }));
+    const reply = await callAnkiConnect('multi', { actions }, priority);
+    batch.forEach(({ resolve }, i) => {
+      resolve(reply.error ? { result: null, error: reply.error } : reply.result[i]);
+    });
+  } catch (e) {
+    batch.forEach(({ reject }) => reject(e));
+  }
+}
+
+function recordWrite(action) {
+  writeEpoch++;
+  // A full sync download can replace the collection with an older mod
+  if (action === 'sync') reader.mod = 0;
+  if (CACHE_INVALIDATING_ACTIONS.has(action)) invalidateCache();
+  if (action !== 'sync') noteWriteForSync();
+}
+
+// Whether a write changed anything: for a chunked list, whether any chunk was
+// applied; otherwise no error, or a list reply with at least one item through
+function writeApplied(reply) {
+  if (chunkedApplied.has(reply)) return chunkedApplied.get(reply);
+  if (!reply.error) return true;
+  return Array.isArray(reply.result) && reply.result.some(item => item !== null);
+}
+
+// Writes that fail or are rejected don't count as writes (no cache flush, no auto-sync)
+async function ankiRequest(action, params = {}, priority = 'interactive') {
+  if (READ_ACTIONS.has(action)) return cachedAnkiConnect(action, params, priority);
+  const reply = action === 'addNote' && ADDNOTE_BATCH_WINDOW_MS > 0
+    ? await batchedAddNote(params, priority)
+    : await callAnkiConnect(action, params, priority);
+  if (writeApplied(reply)) recordWrite(action);
+  return reply;
+}
+
+// POST /batch: run an ordered list of whitelisted operations in one
+// AnkiConnect `multi` call and return a {result, error} entry per operation.
+// Without an X-Priority header the batch goes to the bulk lane if any of its
+// operations would on its own. A `multi` call can't be split into chunks, so
+// lists longer than BULK_CHUNK_SIZE are refused; their own endpoints chunk them.
+async function runBatch(body, { priority, req }) {
+  const operations = body.operations;
+  if (!Array.isArray(operations) || operations.length === 0) {
+    throw httpError(400, 'Request body must contain a non-empty "operations" array');
+  }
+  if (operations.length > BATCH_MAX_OPERATIONS) {
+    throw httpError(400, `Too many operations (max ${BATCH_MAX_OPERATIONS})`);
+  }
+  const actions = operations.map((op, i) => {
+    if (!op || !BATCH_ACTIONS.has(op.action)) {
+      throw httpError(400, `Operation ${i}: unsupported action ${JSON.stringify(op && op.action)}`);
+    }
+    const params = op.params || {};
+    const listKey = CHUNKED_ACTIONS[op.action];
+    if (listKey && Array.isArray(params[listKey]) && params[listKey].length > BULK_CHUNK_SIZE) {
+      throw httpError(400, `Operation ${i}: ${op.action} with more than ${BULK_CHUNK_SIZE} ${listKey} must be sent to /${op.action}`);
+    }
+    return { action: op.action, version: 6, params };
   });
+  const lane = actions.some(({ action, params }) => requestPriority(req, action, params) === 'bulk') ? 'bulk' : priority;
+
+  const reply = await callAnkiConnect('multi', { actions }, lane);
+  if (Array.isArray(reply.result)) {
+    actions.forEach(({ action }, i) => {
+      const entry = reply.result[i];
+      if (!READ_ACTIONS.has(action) && entry && !entry.error) recordWrite(action);
+    });
+  }
+  return reply;
 }
 
-const server = http.createServer(async (req, res) => {
+// Jobs for work accepted with 202, polled with GET /jobs/{id}. Finished jobs
+// are evicted oldest first once there are more than JOB_MAX_ENTRIES.
+const jobs = new Map();
+
+function recordJob(job) {
+  jobs.set(job.id, job);
+  if (jobs.size <= JOB_MAX_ENTRIES) return;
+  for (const [id, old] of jobs) {
+    if (old.status === 'done' || old.status === 'failed') {
+      jobs.delete(id);
+      return;
+    }
+  }
+}
+
+// Append-only JSON-lines file, used by the write journal and the idempotency
+// store. Appends are group-committed: lines queued within JOURNAL_FSYNC_MS
+// share one write and fsync, and each append resolves once its line is on
+// disk. File operations run one at a time on `chain`.
+function createAppendLog(path) {
+  return { path, fh: null, queue: [], flushTimer: null, chain: Promise.resolve(), fsyncs: 0, lastError: null };
+}
+
+function runOnLog(log, task) {
+  const run = log.chain.then(task);
+  log.chain = run.catch(e => { log.lastError = e.message; });
+  return run;
+}
+
+// Every record in the file, skipping blank lines and a line torn by a crash mid-append
+async function readAppendLog(log) {
+  let text = '';
+  try {
+    text = await fs.promises.readFile(log.path, 'utf8');
+  } catch (e) {
+    if (e.code !== 'ENOENT') throw e;
+  }
+  const records = [];
+  for (const line of text.split('\n')) {
+    try { records.push(JSON.parse(line)); } catch (e) { continue; }
+  }
+  return records;
+}
+
+// Atomically replace the file contents with `records` and reopen it for appending
+function rewriteAppendLog(log, records) {
+  return runOnLog(log, async () => {
+    const tmpPath = `${log.path}.tmp`;
+    const tmp = await fs.promises.open(tmpPath, 'w');
+    await tmp.writeFile(records.map(r => JSON.stringify(r) + '\n').join(''));
+    await tmp.sync();
+    await tmp.close();
+    await fs.promises.rename(tmpPath, log.path);
+    if (log.fh) await log.fh.close();
+    log.fh = await fs.promises.open(log.path, 'a');
+  });
+}
+
+function appendRecord(log, record) {
+  return new Promise((resolve, reject) => {
+    log.queue.push({ line: JSON.stringify(record) + '\n', resolve, reject });
+    if (!log.flushTimer) log.flushTimer = setTimeout(() => flushAppendLog(log), JOURNAL_FSYNC_MS);
+  });
+}
+
+function flushAppendLog(log) {
+  log.flushTimer = null;
+  const batch = log.queue;
+  log.queue = [];
+  runOnLog(log, async () => {
+    await log.fh.write(batch.map(entry => entry.line).join(''));
+    await log.fh.sync();
+    log.fsyncs++;
+  }).then(() => batch.forEach(entry => entry.resolve()), e => batch.forEach(entry => entry.reject(e)));
+}
+
+// Write-ahead journal. Each line is {"op":"write",id,action,params,at} when a
+// write is accepted or {"op":"done",id,at} once it has been replayed; callers
+// only get their 202 once the write line is on disk. Replay is
+// at-least-once: a crash after AnkiConnect applied a batch but before its
+// done lines reached disk replays that batch again on restart.
+const journalLog = createAppendLog(JOURNAL_PATH);
+const journal = { pending: [], replaying: false, rerun: false, retryTimer: null };
+const journalStats = { accepted: 0, replayed: 0, failed: 0, replayBatches: 0, lastError: null };
+
+function getJournalStats() {
+  return {
+    enabled: Boolean(JOURNAL_PATH),
+    path: JOURNAL_PATH || null,
+    pending: journal.pending.length,
+    ...journalStats,
+    fsyncs: journalLog.fsyncs,
+  };
+}
+
+function upstreamAvailable() {
+  return readiness.ready && circuit.state === 'closed';
+}
+
+function queuedJob(record) {
+  return { id: record.id, action: record.action, status: 'queued', acceptedAt: record.at, completedAt: null, result: null, error: null };
+}
+
+// Rebuild the pending list from the journal and rewrite it with only the unfinished writes
+async function openJournal() {
+  const unfinished = new Map();
+  for (const record of await readAppendLog(journalLog)) {
+    if (record.op === 'write') unfinished.set(record.id, record);
+    else if (record.op === 'done') unfinished.delete(record.id);
+  }
+  await rewriteAppendLog(journalLog, [...unfinished.values()]);
+
+  for (const record of unfinished.values()) {
+    record.committed = true;
+    journal.pending.push(record);
+    recordJob(queuedJob(record));
+  }
+  if (unfinished.size) console.log(`Journal: ${unfinished.size} writes waiting to be replayed`);
+}
+
+// Once everything has been replayed the journal is cut back to empty
+function truncateJournal() {
+  runOnLog(journalLog, async () => {
+    if (journal.pending.length === 0 && journalLog.queue.length === 0) await journalLog.fh.truncate(0);
+  }).catch(e => { journalStats.lastError = e.message; });
+}
+
+async function journalWrite(action, params) {
+  const record = { op: 'write', id: crypto.randomBytes(9).toString('base64url'), action, params, at: Date.now() };
+  journal.pending.push(record);
+  try {
+    await appendRecord(journalLog, record);
+  } catch (e) {
+    journal.pending.splice(journal.pending.indexOf(record), 1);
+    journalStats.lastError = e.message;
+    throw e;
+  }
+  record.committed = true;
+  journalStats.accepted++;
+  const job = queuedJob(record);
+  recordJob(job);
+  replayJournal();
+  return job;
+}
+
+// Consecutive committed writes, up to JOURNAL_REPLAY_BATCH. A write whose
+// list needs chunking is replayed on its own so callAnkiConnect can split it.
+function nextReplayBatch() {
+  const batch = [];
+  for (const record of journal.pending) {
+    if (!record.committed || batch.length >= JOURNAL_REPLAY_BATCH) break;
+    const listKey = CHUNKED_ACTIONS[record.action];
+    const oversized = listKey && Array.isArray(record.params[listKey]) && record.params[listKey].length > BULK_CHUNK_SIZE;
+    if (oversized && batch.length) break;
+    batch.push(record);
+    if (oversized) break;
+  }
+  return batch;
+}
+
+async function replayBatch(batch) {
+  journalStats.replayBatches++;
+  let replies;
+  if (batch.length === 1) {
+    replies = [await callAnkiConnect(batch[0].action, batch[0].params, 'bulk')];
+  } else {
+    const actions = batch.map(({ action, params }) => ({ action, version: 6, params }));
+    const reply = await callAnkiConnect('multi', { actions }, 'bulk');
+    replies = batch.map((_, i) => (reply.error ? { result: null, error: reply.error } : reply.result[i]));
+  }
+  batch.forEach((record, i) => {
+    if (replies[i] && writeApplied(replies[i])) recordWrite(record.action);
+  });
+  return replies;
+}
+
+function finishJob(record, reply = { result: null, error: 'No reply from AnkiConnect' }) {
+  const failed = Boolean(reply.error);
+  journalStats[failed ? 'failed' : 'replayed']++;
+  const job = jobs.get(record.id);
+  if (!job) return;
+  Object.assign(job, { status: failed ? 'failed' : 'done', completedAt: Date.now(), result: reply.result, error: reply.error });
+  settleIdempotentJob(job);
+}
+
+function scheduleReplay() {
+  if (journal.retryTimer) return;
+  journal.retryTimer = setTimeout(() => {
+    journal.retryTimer = null;
+    replayJournal();
+  }, JOURNAL_RETRY_MS);
+}
+
+async function replayJournal() {
+  if (journal.replaying) {
+    journal.rerun = true;
+    return;
+  }
+  journal.replaying = true;
+  let retry = false;
+  try {
+    while (journal.pending.length && journal.pending[0].committed) {
+      if (!upstreamAvailable()) {
+        retry = true;
+        break;
+      }
+      const batch = nextReplayBatch();
+      const replies = await replayBatch(batch);
+      journal.pending.splice(0, batch.length);
+      batch.forEach((record, i) => finishJob(record, replies[i]));
+      await Promise.all(batch.map(record => appendRecord(journalLog, { op: 'done', id: record.id, at: Date.now() })));
+    }
+    if (journal.pending.length === 0) truncateJournal();
+  } catch (e) {
+    journalStats.lastError = e.message;
+    retry = true;
+  } finally {
+    journal.replaying = false;
+  }
+  if (journal.rerun) {
+    journal.rerun = false;
+    replayJournal();
+  } else if (retry) {
+    scheduleReplay();
+  }
+}
+
+// Journaled writes go straight to AnkiConnect when it is up and nothing is
+// waiting in the journal; otherwise (or if the call could not be delivered)
+// they are journaled, so replayed and new writes keep their order
+async function journaledRequest(action, params, priority) {
+  if (upstreamAvailable() && journal.pending.length === 0) {
+    try {
+      return { result: await ankiRequest(action, params, priority) };
+    } catch (e) {
+      if (e.code !== 'ECONNREFUSED' && e.statusCode !== 503) throw e;
+    }
+  }
+  return { job: await journalWrite(action, params) };
+}
+
+async function runAction(action, params, priority) {
+  if (JOURNAL_PATH && JOURNALED_ACTIONS.has(action)) {
+    const outcome = await journaledRequest(action, params, priority);
+    return outcome.job ? { statusCode: 202, body: outcome.job } : { statusCode: 200, body: outcome.result };
+  }
+  assertReady();
+  return { statusCode: 200, body: await ankiRequest(action, params, priority) };
+}
+
+// Idempotency store: key -> {key, fingerprint, statusCode, body, at}, oldest
+// first. Entries expire IDEMPOTENCY_TTL_MS after the first reply and the
+// oldest are evicted beyond IDEMPOTENCY_MAX_KEYS. Failed calls are not
+// stored, so a retry after a 429 or 503 runs again. A journaled write is
+// stored with a copy of its 202 job; once the job settles the entry is
+// replaced by the job's {result, error}, so replays (also after a restart,
+// when the job is gone) get the outcome. idempotencyJobs maps job id -> key.
+const idempotencyLog = createAppendLog(IDEMPOTENCY_PATH);
+const idempotencyStore = new Map();
+const idempotencyInflight = new Map();
+const idempotencyJobs = new Map();
+const idempotencyStats = { stored: 0, replayed: 0, conflicts: 0, evictions: 0 };
+let idempotencyLogLines = 0;
+
+function getIdempotencyStats() {
+  return {
+    keys: idempotencyStore.size,
+    maxKeys: IDEMPOTENCY_MAX_KEYS,
+    ttlMs: IDEMPOTENCY_TTL_MS,
+    persisted: Boolean(IDEMPOTENCY_PATH),
+    ...idempotencyStats,
+    inFlight: idempotencyInflight.size,
+  };
+}
+
+function expireIdempotencyKeys(now) {
+  for (const [key, entry] of idempotencyStore) {
+    if (entry.at + IDEMPOTENCY_TTL_MS > now && idempotencyStore.size <= IDEMPOTENCY_MAX_KEYS) break;
+    idempotencyStore.delete(key);
+    idempotencyStats.evictions++;
+  }
+}
+
+async function loadIdempotencyStore() {
+  for (const record of await readAppendLog(idempotencyLog)) {
+    // A settled job's record has the same `at` as its 202 record and keeps its place
+    const previous = idempotencyStore.get(record.key);
+    if (previous && previous.at !== record.at) idempotencyStore.delete(record.key);
+    idempotencyStore.set(record.key, record);
+  }
+  expireIdempotencyKeys(Date.now());
+  for (const entry of idempotencyStore.values()) {
+    if (entry.statusCode === 202) idempotencyJobs.set(entry.body.id, entry.key);
+  }
+  await rewriteAppendLog(idempotencyLog, [...idempotencyStore.values()]);
+  idempotencyLogLines = idempotencyStore.size;
+}
+
+// The file is append-only; once it holds twice as many lines as there can be
+// live keys it is rewritten from the store instead
+function persistIdempotencyKey(entry) {
+  idempotencyLogLines++;
+  if (idempotencyLogLines <= 2 * IDEMPOTENCY_MAX_KEYS) return appendRecord(idempotencyLog, entry);
+  idempotencyLogLines = idempotencyStore.size;
+  return rewriteAppendLog(idempotencyLog, [...idempotencyStore.values()]);
+}
+
+// What a replay returns: a copy of the reply as sent, or for a journaled
+// write whose job has already finished, the job's outcome
+function storedReply(statusCode, body) {
+  if (statusCode === 202 && (body.status === 'done' || body.status === 'failed')) {
+    return { statusCode: 200, body: { result: body.result, error: body.error } };
+  }
+  return { statusCode, body: structuredClone(body) };
+}
+
+function settleIdempotentJob(job) {
+  const key = idempotencyJobs.get(job.id);
+  if (!key) return;
+  idempotencyJobs.delete(job.id);
+  const entry = idempotencyStore.get(key);
+  if (!entry || entry.statusCode !== 202 || entry.body.id !== job.id) return;
+  const settled = { ...entry, ...storedReply(202, job) };
+  idempotencyStore.set(key, settled);
+  if (IDEMPOTENCY_PATH) {
+    persistIdempotencyKey(settled).catch(e => console.error(`Failed to persist Idempotency-Key: ${e.message}`));
+  }
+}
+
+// A retry that arrives while the first call is still running waits for its
+// reply; reusing a key with a different request is rejected with 422
+async function idempotentAction(key, action, params, priority) {
+  if (key.length > IDEMPOTENCY_MAX_KEY_LENGTH) {
+    throw httpError(400, `Idempotency-Key must be at most ${IDEMPOTENCY_MAX_KEY_LENGTH} characters`);
+  }
+  const fingerprint = crypto.createHash('sha256').update(`${action} ${canonicalJson(params)}`).digest('base64url');
+  expireIdempotencyKeys(Date.now());
+
+  const known = idempotencyStore.get(key) || idempotencyInflight.get(key);
+  if (known) {
+    if (known.fingerprint !== fingerprint) {
+      idempotencyStats.conflicts++;
+      throw httpError(422, 'Idempotency-Key was already used with a different request');
+    }
+    let stored = known;
+    if (known.reply) {
+      const first = await known.reply;
+      stored = storedReply(first.statusCode, first.body);
+    }
+    const { statusCode, body } = stored;
+    idempotencyStats.replayed++;
+    return { statusCode, body, headers: { 'Idempotent-Replayed': 'true' } };
+  }
+
+  const reply = runAction(action, params, priority);
+  idempotencyInflight.set(key, { fingerprint, reply });
+  try {
+    const { statusCode, body } = await reply;
+    const entry = { key, fingerprint, ...storedReply(statusCode, body), at: Date.now() };
+    idempotencyStore.set(key, entry);
+    if (entry.statusCode === 202) idempotencyJobs.set(body.id, key);
+    idempotencyStats.stored++;
+    if (IDEMPOTENCY_PATH) {
+      try {
+        await persistIdempotencyKey(entry);
+      } catch (e) {
+        console.error(`Failed to persist Idempotency-Key: ${e.message}`);
+      }
+    }
+    return { statusCode, body };
+  } finally {
+    idempotencyInflight.delete(key);
+  }
+}
+
+// Sync jobs. AnkiWeb sync holds Anki's main thread for seconds to minutes,
+// so POST /sync answers 202 with a job at once. Each trigger (a POST /sync,
+// or a write when auto-sync is on) attaches to the running sync unless
+// something was written after it started; then it attaches to a single
+// queued follow-up sync instead. Every trigger that attaches is a sync avoided.
+const syncState = {
+  running: null,
+  runningEpoch: 0,
+  queued: null,
+  quietMs: 0,
+  deadline: 0,
+  last: null,
+  timer: null,
+  lastWriteAt: 0,
+};
+const syncStats = { triggers: { request: 0, auto: 0 }, avoided: { request: 0, auto: 0 }, started: 0, failed: 0 };
+
+function getSyncStats() {
+  return {
+    debounceMs: SYNC_DEBOUNCE_MS,
+    maxDelayMs: SYNC_MAX_DELAY_MS,
+    autoSync: AUTO_SYNC_QUIET_MS > 0 ? { quietMs: AUTO_SYNC_QUIET_MS, maxDelayMs: AUTO_SYNC_MAX_DELAY_MS } : null,
+    ...syncStats,
+    running: syncState.running && syncState.running.id,
+    queued: syncState.queued && syncState.queued.id,
+    dueInMs: syncState.timer ? Math.max(0, syncDueAt() - Date.now()) : null,
+  };
+}
+
+// A queued sync keeps the shortest quiet period and earliest deadline of the triggers attached to it
+function requestSync(trigger) {
+  const quietMs = trigger === 'auto' ? AUTO_SYNC_QUIET_MS : SYNC_DEBOUNCE_MS;
+  const deadline = Date.now() + (trigger === 'auto' ? AUTO_SYNC_MAX_DELAY_MS : SYNC_MAX_DELAY_MS);
+  syncStats.triggers[trigger]++;
+
+  const running = syncState.running;
+  if (running && syncState.runningEpoch === writeEpoch) {
+    running.attached++;
+    syncStats.avoided[trigger]++;
+    return running;
+  }
+  if (syncState.queued) {
+    syncState.queued.attached++;
+    syncStats.avoided[trigger]++;
+    syncState.quietMs = Math.min(syncState.quietMs, quietMs);
+    syncState.deadline = Math.min(syncState.deadline, deadline);
+  } else {
+    syncState.queued = {
+      id: crypto.randomBytes(9).toString('base64url'),
+      action: 'sync',
+      status: 'queued',
+      trigger,
+      acceptedAt: Date.now(),
+      startedAt: null,
+      completedAt: null,
+      attached: 0,
+      result: null,
+      error: null,
+    };
+    syncState.quietMs = quietMs;
+    syncState.deadline = deadline;
+    recordJob(syncState.queued);
+  }
+  scheduleQueuedSync();
+  return syncState.queued;
+}
+
+function syncDueAt() {
+  return Math.min(syncState.lastWriteAt + syncState.quietMs, syncState.deadline);
+}
+
+function scheduleQueuedSync() {
+  clearTimeout(syncState.timer);
+  syncState.timer = null;
+  if (!syncState.queued || syncState.running) return;
+  syncState.timer = setTimeout(runQueuedSync, Math.max(0, syncDueAt() - Date.now()));
+}
+
+function noteWriteForSync() {
+  syncState.lastWriteAt = Date.now();
+  if (AUTO_SYNC_QUIET_MS > 0) requestSync('auto');
+  else if (syncState.queued) scheduleQueuedSync();
+}
+
+async function runQueuedSync() {
+  const job = syncState.queued;
+  syncState.queued = null;
+  syncState.timer = null;
+  syncState.running = job;
+  syncState.runningEpoch = writeEpoch;
+  syncStats.started++;
+  Object.assign(job, { status: 'running', startedAt: Date.now() });
+  try {
+    const reply = await ankiRequest('sync', {}, 'bulk');
+    Object.assign(job, { status: reply.error ? 'failed' : 'done', result: reply.result, error: reply.error });
+  } catch (e) {
+    Object.assign(job, { status: 'failed', error: e.message || 'Unknown error occurred' });
+  } finally {
+    job.completedAt = Date.now();
+    if (job.status === 'failed') syncStats.failed++;
+    syncDuration.observe({ status: job.status }, (job.completedAt - job.startedAt) / 1000);
+    syncState.running = null;
+    syncState.last = job;
+    scheduleQueuedSync();
+  }
+}
+
+// POST /sync: start a sync job, or attach to the one that will cover this request
+async function postSync() {
+  return requestSync('request');
+}
+
+// GET /sync: the running, queued and most recently finished sync jobs
+async function getSyncStatus() {
+  return { running: syncState.running, queued: syncState.queued, last: syncState.last };
+}
+
+// OpenAPI spec held in memory (raw and gzipped) with a content hash ETag,
+// reloaded when the file changes so spec fetches cost no disk I/O
+let openapiSpec = null;
+
+function loadOpenapiSpec() {
+  fs.readFile(OPENAPI_PATH, (err, raw) => {
+    if (err) {
+      if (!openapiSpec) console.error(`Failed to load OpenAPI spec from ${OPENAPI_PATH}: ${err.message}`);
+      return;
+    }
+    zlib.gzip(raw, { level: zlib.constants.Z_BEST_COMPRESSION }, (gzErr, gzipped) => {
+      const hash = crypto.createHash('sha256').update(raw).digest('base64url').slice(0, 27);
+      // Each encoding is a different representation, so it gets its own ETag
+      openapiSpec = { raw, gzipped: gzErr ? null : gzipped, etag: `"${hash}"`, gzipEtag: `"${hash}-gzip"` };
+    });
+  });
+}
+
+function etagMatches(ifNoneMatch, etag) {
+  if (!ifNoneMatch) return false;
+  return ifNoneMatch.split(',').some(tag => {
+    const t = tag.trim();
+    return t === '*' || t === etag || t === `W/${etag}`;
+  });
+}
+
+function sendOpenapiSpec(req, res) {
+  if (!openapiSpec) {
+    sendJson(res, 500, { error: 'Failed to load OpenAPI spec' });
+    return;
+  }
+  const gzip = Boolean(openapiSpec.gzipped) && /\bgzip\b/.test(req.headers['accept-encoding'] || '');
+  const etag = gzip ? openapiSpec.gzipEtag : openapiSpec.etag;
+  const headers = {
+    'Content-Type': 'application/json',
+    'Cache-Control': 'public, max-age=300',
+    'ETag': etag,
+    'Vary': 'Accept-Encoding',
+  };
+  if (etagMatches(req.headers['if-none-match'], etag)) {
+    res.writeHead(304, headers);
+    res.end();
+    return;
+  }
+  let body = openapiSpec.raw;
+  if (gzip) {
+    body = openapiSpec.gzipped;
+    headers['Content-Encoding'] = 'gzip';
+  }
+  headers['Content-Length'] = body.length;
+  res.writeHead(200, headers);
+  res.end(req.method === 'HEAD' ? undefined : body);
+}
+
+// Prometheus metrics, rendered in the text exposition format by hand since
+// the sprite has no npm dependencies for the proxy
+const LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30];
+const SYNC_BUCKETS = [0.5, 1, 2.5, 5, 10, 30, 60, 120, 300];
+const SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864];
+const metricRegistry = [];
+
+function labelString(labels) {
+  const pairs = Object.entries(labels).map(([k, v]) =>
+    `${k}="${String(v).replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n')}"`);
+  return pairs.length ? `{${pairs.join(',')}}` : '';
+}
+
+function counter(name, help) {
+  const values = new Map();
+  const metric = {
+    inc(labels = {}, n = 1) {
+      const key = labelString(labels);
+      values.set(key, (values.get(key) || 0) + n);
+    },
+    render: () => [`# HELP ${name} ${help}`, `# TYPE ${name} counter`,
+      ...Array.from(values, ([key, value]) => `${name}${key} ${value}`)],
+  };
+  metricRegistry.push(metric);
+  return metric;
+}
+
+function histogram(name, help, buckets) {
+  const series = new Map();
+  const metric = {
+    observe(labels, value) {
+      const key = labelString(labels);
+      let entry = series.get(key);
+      if (!entry) {
+        entry = { labels, counts: new Array(buckets.length).fill(0), sum: 0, count: 0 };
+        series.set(key, entry);
+      }
+      buckets.forEach((le, i) => { if (value <= le) entry.counts[i]++; });
+      entry.sum += value;
+      entry.count++;
+    },
+    render: () => {
+      const lines = [`# HELP ${name} ${help}`, `# TYPE ${name} histogram`];
+      for (const [key, { labels, counts, sum, count }] of series) {
+        buckets.forEach((le, i) => lines.push(`${name}_bucket${labelString({ ...labels, le })} ${counts[i]}`));
+        lines.push(`${name}_bucket${labelString({ ...labels, le: '+Inf' })} ${count}`);
+        lines.push(`${name}_sum${key} ${sum}`);
+        lines.push(`${name}_count${key} ${count}`);
+      }
+      return lines;
+    },
+  };
+  metricRegistry.push(metric);
+  return metric;
+}
+
+// Gauges and counters read from existing state at scrape time;
+// collect() returns [[labels, value], ...]
+function collected(name, help, type, collect) {
+  metricRegistry.push({
+    render: () => [`# HELP ${name} ${help}`, `# TYPE ${name} ${type}`,
+      ...collect().map(([labels, value]) => `${name}${labelString(labels)} ${value}`)],
+  });
+}
+
+const httpRequestsTotal = counter('anki_proxy_http_requests_total', 'HTTP requests by endpoint and status code');
+const httpErrorsTotal = counter('anki_proxy_http_errors_total', 'HTTP error responses by endpoint and class');
+const httpDuration = histogram('anki_proxy_http_request_duration_seconds', 'End-to-end request latency', LATENCY_BUCKETS);
+const httpRequestBytes = histogram('anki_proxy_http_request_bytes', 'Request body size', SIZE_BUCKETS);
+const httpResponseBytes = histogram('anki_proxy_http_response_bytes', 'Response body size', SIZE_BUCKETS);
+const upstreamQueueWait = histogram('anki_proxy_upstream_queue_wait_seconds', 'Time spent waiting for an upstream slot', LATENCY_BUCKETS);
+const upstreamDuration = histogram('anki_proxy_upstream_duration_seconds', 'AnkiConnect call latency', LATENCY_BUCKETS);
+const syncDuration = histogram('anki_proxy_sync_duration_seconds', 'AnkiWeb sync job duration', SYNC_BUCKETS);
+const readerReads = counter('anki_proxy_reader_reads_total', 'Reads offered to the collection reader by outcome (served, stale, unsupported, failed)');
+const readerDuration = histogram('anki_proxy_reader_duration_seconds', 'Latency of reads served by the collection reader', LATENCY_BUCKETS);
+let httpInFlight = 0;
+
+collected('anki_proxy_http_inflight_requests', 'HTTP requests currently being handled', 'gauge',
+  () => [[{}, httpInFlight]]);
+collected('anki_proxy_upstream_inflight_requests', 'Calls currently running against AnkiConnect', 'gauge',
+  () => [[{}, upstreamInFlight]]);
+collected('anki_proxy_upstream_queue_depth', 'Calls waiting for an upstream slot', 'gauge',
+  () => Object.keys(upstreamLanes).map(lane => [{ lane }, upstreamLanes[lane].length]));
+collected('anki_proxy_upstream_rejected_total', 'Calls rejected with 429 because the queue was full', 'counter',
+  () => [[{}, queueStats.rejected]]);
+collected('anki_proxy_upstream_ready', 'Whether AnkiConnect has answered since startup (1) or not yet (0)', 'gauge',
+  () => [[{}, readiness.ready ? 1 : 0]]);
+collected('anki_proxy_circuit_state', 'AnkiConnect circuit breaker state (0 closed, 1 half open, 2 open)', 'gauge',
+  () => [[{}, { closed: 0, half_open: 1, open: 2 }[circuit.state]]]);
+collected('anki_proxy_circuit_trips_total', 'Times the AnkiConnect circuit breaker opened', 'counter',
+  () => [[{}, circuit.trips]]);
+collected('anki_proxy_upstream_timeouts_total', 'AnkiConnect calls abandoned after their timeout', 'counter',
+  () => [[{}, upstreamStats.timeouts]]);
+collected('anki_proxy_upstream_sockets_total', 'Upstream requests by socket reuse', 'counter',
+  () => [[{ socket: 'new' }, upstreamStats.newSockets], [{ socket: 'reused' }, upstreamStats.reusedSockets]]);
+collected('anki_proxy_cache_lookups_total', 'Metadata cache lookups', 'counter',
+  () => [[{ result: 'hit' }, cacheStats.hits], [{ result: 'miss' }, cacheStats.misses]]);
+collected('anki_proxy_coalesced_reads_total', 'Reads that joined an identical in-flight call', 'counter',
+  () => [[{}, coalesceStats.collapsed]]);
+collected('anki_proxy_journal_pending_writes', 'Journaled writes waiting to be replayed to AnkiConnect', 'gauge',
+  () => [[{}, journal.pending.length]]);
+collected('anki_proxy_journal_writes_total', 'Journaled writes by outcome', 'counter',
+  () => [[{ outcome: 'accepted' }, journalStats.accepted], [{ outcome: 'replayed' }, journalStats.replayed],
+    [{ outcome: 'failed' }, journalStats.failed]]);
+collected('anki_proxy_idempotency_keys', 'Idempotency keys currently stored', 'gauge',
+  () => [[{}, idempotencyStore.size]]);
+collected('anki_proxy_idempotency_replays_total', 'Requests answered from the idempotency store', 'counter',
+  () => [[{}, idempotencyStats.replayed]]);
+collected('anki_proxy_sync_triggers_total', 'Sync triggers: POST /sync requests and, with auto-sync on, writes', 'counter',
+  () => Object.keys(syncStats.triggers).map(trigger => [{ trigger }, syncStats.triggers[trigger]]));
+collected('anki_proxy_syncs_avoided_total', 'Sync triggers that joined a running or queued sync instead of starting one', 'counter',
+  () => Object.keys(syncStats.avoided).map(trigger => [{ trigger }, syncStats.avoided[trigger]]));
+collected('anki_proxy_syncs_started_total', 'AnkiWeb syncs sent to AnkiConnect', 'counter',
+  () => [[{}, syncStats.started]]);
+collected('anki_proxy_media_uploads_total', 'Media uploads by whether an identical file was reused', 'counter',
+  () => [[{ outcome: 'stored' }, mediaStats.uploads - mediaStats.deduplicated], [{ outcome: 'deduplicated' }, mediaStats.deduplicated]]);
+collected('anki_proxy_media_dedup_bytes_saved_total', 'Upload bytes not stored again because the content already existed', 'counter',
+  () => [[{}, mediaStats.bytesSaved]]);
+collected('anki_proxy_reader_lag_seconds', 'Seconds since the collection reader view was taken (the replica age)', 'gauge',
+  () => (reader.asOf ? [[{}, readerLagSeconds()]] : []));
+collected('anki_proxy_addnote_batched_notes_total', 'addNote calls sent upstream inside a batch', 'counter',
+  () => [[{}, batchStats.batchedNotes]]);
+
+function renderMetrics() {
+  return metricRegistry.flatMap(metric => metric.render()).join('\n') + '\n';
+}
+
+const FIXED_PATHS = new Set(['/health', '/stats', '/metrics', '/openapi.json']);
+
+// Bounded label values: unknown paths collapse into one series
+function endpointLabel(method, path) {
+  if (path.startsWith('/jobs/')) return `${method} /jobs/{id}`;
+  if (FIXED_PATHS.has(path)) return `${method} ${path}`;
+  const match = matchEndpoint(method, path);
+  return match ? match.key : 'other';
+}
+
+function errorClass(statusCode) {
+  if (statusCode === 503) return 'upstream_unavailable';
+  if (statusCode === 429) return 'busy';
+  if (statusCode >= 500) return 'internal';
+  return 'client';
+}
+
+function sendJson(res, statusCode, payload, headers = {}) {
+  const body = Buffer.from(JSON.stringify(payload));
+  res.writeHead(statusCode, { 'Content-Type': 'application/json', 'Content-Length': body.length, ...headers });
+  res.end(body);
+}
+
+// Id snapshots for cursor pagination. A cursor is "<snapshotId>.<offset>",
+// so re-sending a cursor returns the same page and never re-runs the search.
+const searchSnapshots = new Map();
+
+function getPaginationStats() {
+  return { snapshots: searchSnapshots.size, ttlMs: PAGINATION_TTL_MS };
+}
+
+function expireSnapshots(now) {
+  for (const [id, snapshot] of searchSnapshots) {
+    if (snapshot.expires <= now) searchSnapshots.delete(id);
+  }
+}
+
+// The ids to page through: the `notes` list a notesInfo call was given, or
+// the result of running its `query` (always a query for findNotes)
+async function snapshotIds(action, body, priority) {
+  if (action === 'notesInfo' && body.notes !== undefined) {
+    if (!Array.isArray(body.notes)) throw httpError(400, '"notes" must be an array of note ids');
+    return body.notes;
+  }
+  if (typeof body.query !== 'string') throw httpError(400, 'Request body must contain a "query" string or a "cursor"');
+  const found = await ankiRequest('findNotes', { query: body.query }, priority);
+  if (found.error) throw httpError(400, found.error);
+  return found.result || [];
+}
+
+async function openSnapshot(action, body, priority) {
+  const ids = await snapshotIds(action, body, priority);
+  const now = Date.now();
+  expireSnapshots(now);
+  if (searchSnapshots.size >= PAGINATION_MAX_SNAPSHOTS) searchSnapshots.delete(searchSnapshots.keys().next().value);
+  const id = crypto.randomBytes(9).toString('base64url');
+  const snapshot = { ids, expires: now + PAGINATION_TTL_MS };
+  searchSnapshots.set(id, snapshot);
+  return { id, snapshot, offset: 0 };
+}
+
+function resumeSnapshot(cursor) {
+  const match = /^([\w-]+)\.(\d+)$/.exec(String(cursor));
+  if (!match) throw httpError(400, 'Malformed cursor');
+  const now = Date.now();
+  expireSnapshots(now);
+  const snapshot = searchSnapshots.get(match[1]);
+  if (!snapshot) throw httpError(410, 'Cursor expired; run the search again');
+  snapshot.expires = now + PAGINATION_TTL_MS;
+  return { id: match[1], snapshot, offset: parseInt(match[2], 10) };
+}
+
+// Paged findNotes/notesInfo. Start with {query, limit} (or, for notesInfo,
+// {notes: [ids], limit}); continue with {cursor, limit}. findNotes pages
+// return ids, notesInfo pages return note details, and a cursor from either
+// endpoint works with the other.
+async function paginate(action, body, priority) {
+  const limit = body.limit === undefined ? PAGE_DEFAULT_LIMIT : Number(body.limit);
+  if (!Number.isInteger(limit) || limit < 1 || limit > PAGE_MAX_LIMIT) {
+    throw httpError(400, `"limit" must be an integer between 1 and ${PAGE_MAX_LIMIT}`);
+  }
+  const { id, snapshot, offset } = body.cursor !== undefined
+    ? resumeSnapshot(body.cursor)
+    : await openSnapshot(action, body, priority);
+
+  const ids = snapshot.ids.slice(offset, offset + limit);
+  const nextOffset = offset + ids.length;
+  const page = {
+    nextCursor: nextOffset < snapshot.ids.length ? `${id}.${nextOffset}` : null,
+    total: snapshot.ids.length,
+  };
+  if (action === 'findNotes') return { result: ids, error: null, ...page };
+
+  const info = ids.length ? await ankiRequest('notesInfo', { notes: ids }, priority) : { result: [], error: null };
+  return { ...info, ...page };
+}
+
+// POST /search: full-text search of note fields and tags in the collection
+// reader's FTS5 index, best match first, with a highlighted snippet per note.
+// Only offered when ANKI_READER_URL is set; otherwise it answers 404.
+// `stale` is set when the collection has changed since the index last synced,
+// so recent writes may not be reflected yet.
+async function searchNotes(body) {
+  if (!READER_URL) throw httpError(404, 'Full-text search is off: it needs the collection reader (set ANKI_READER_URL)');
+  if (typeof body.query !== 'string' || !body.query.trim()) {
+    throw httpError(400, 'Request body must contain a non-empty "query" string');
+  }
+  const limit = body.limit === undefined ? SEARCH_DEFAULT_LIMIT : Number(body.limit);
+  if (!Number.isInteger(limit) || limit < 1 || limit > PAGE_MAX_LIMIT) {
+    throw httpError(400, `"limit" must be an integer between 1 and ${PAGE_MAX_LIMIT}`);
+  }
+  const offset = body.offset === undefined ? 0 : Number(body.offset);
+  if (!Number.isInteger(offset) || offset < 0) throw httpError(400, '"offset" must be a non-negative integer');
+
+  let reply;
+  try {
+    reply = await callReader('/search', { query: body.query, limit, offset });
+  } catch (e) {
+    throw httpError(503, `Search index unavailable: ${e.message}`, { retryAfter: READER_RETRY_MS / 1000 });
+  }
+  const { statusCode, body: answer } = reply;
+  if (statusCode === 400) throw httpError(400, answer.error);
+  if (statusCode !== 200) {
+    throw httpError(503, `Search index unavailable: ${answer.error || `HTTP ${statusCode}`}`, { retryAfter: READER_RETRY_MS / 1000 });
+  }
+  return { result: answer.result, error: null, indexedAt: answer.asOf, stale: !answer.current };
+}
+
+// Resolves when the client has drained the socket buffer, or has gone away
+function waitForDrain(res) {
+  return new Promise(resolve => {
+    const done = () => {
+      res.off('drain', done);
+      res.off('close', done);
+      resolve();
+    };
+    res.on('drain', done);
+    res.on('close', done);
+  });
+}
+
+// POST /streamNotes: run findNotes, then fetch notesInfo one BULK_CHUNK_SIZE
+// page at a time and write each note as an NDJSON line, waiting for the
+// client to drain between pages. Only one page is held in memory at once.
+// Errors after the first line are reported as a final {"error": ...} line.
+async function streamNotes(body, { priority, res }) {
+  if (typeof body.query !== 'string') throw httpError(400, 'Request body must contain a "query" string');
+  const found = await ankiRequest('findNotes', { query: body.query }, priority);
+  if (found.error) throw httpError(400, found.error);
+  const ids = found.result || [];
+
+  res.writeHead(200, { 'Content-Type': 'application/x-ndjson', 'X-Total-Count': String(ids.length) });
+  let aborted = false;
+  res.on('close', () => { if (!res.writableFinished) aborted = true; });
+
+  try {
+    for (let i = 0; i < ids.length && !aborted; i += BULK_CHUNK_SIZE) {
+      const page = await readCollection('notesInfo', { notes: ids.slice(i, i + BULK_CHUNK_SIZE) }, priority);
+      if (page.error) throw new Error(page.error);
+      const lines = page.result.map(note => JSON.stringify(note)).join('\n') + '\n';
+      if (!res.write(lines)) await waitForDrain(res);
+    }
+  } catch (e) {
+    res.write(JSON.stringify({ error: e.message || 'Unknown error occurred' }) + '\n');
+  }
+  res.end();
+}
+
+function mediaTooLarge() {
+  return httpError(413, `Media file exceeds ${MAX_MEDIA_BYTES} bytes`, { headers: { Connection: 'close' } });
+}
+
+// Media filenames are flat names inside collection.media
+function mediaFilename(encoded) {
+  let name = null;
+  try { name = decodeURIComponent(encoded); } catch (e) { /* malformed escape */ }
+  if (!name || name === '.' || name === '..' || /[/\\\0]/.test(name) || Buffer.byteLength(name) > 255) {
+    throw httpError(400, 'Invalid media filename');
+  }
+  return name;
+}
+
+// Write a request body to filePath as it arrives, pausing the request while
+// the file catches up. Past maxBytes the file is abandoned and the rest of
+// the body is drained, so the 413 can still be sent.
+function receiveToFile(req, filePath, maxBytes, hash) {
+  return new Promise((resolve, reject) => {
+    const out = fs.createWriteStream(filePath, { flags: 'wx', mode: 0o600 });
+    let size = 0;
+    let failed = false;
+    const fail = (err) => {
+      if (failed) return;
+      failed = true;
+      out.destroy();
+      req.resume();
+      reject(err);
+    };
+    req.on('data', chunk => {
+      if (failed) return;
+      size += chunk.length;
+      req.bodyBytes = size;
+      if (size > maxBytes) {
+        fail(mediaTooLarge());
+        return;
+      }
+      if (hash) hash.update(chunk);
+      if (!out.write(chunk)) {
+        req.pause();
+        out.once('drain', () => req.resume());
+      }
+    });
+    req.on('end', () => { if (!failed) out.end(); });
+    req.on('error', fail);
+    out.on('error', fail);
+    out.on('finish', () => resolve(size));
+  });
+}
+
+// POST /storeMediaFile: AnkiConnect's JSON form, from base64 `data` or a
+// `url`. `path` is refused so clients can't copy arbitrary local files into
+// collection.media, where GET /media/{filename} would serve them.
+async function storeMediaFile(body, { priority }) {
+  if (body.path !== undefined) throw httpError(400, '"path" is not accepted; upload with PUT /media/{filename}');
+  return ankiRequest('storeMediaFile', body, priority);
+}
+
+// Media index: sha256 -> {hash, filename, size, mtimeMs} for files in
+// collection.media, plus the same entries by filename. An entry is trusted
+// only while the file's size and mtime still match; otherwise it is dropped.
+// Index lines are {hash, filename, size, mtimeMs}, or {filename, hash: null}
+// when a file is forgotten; the last line for a filename wins.
+const mediaIndexLog = createAppendLog(MEDIA_INDEX_PATH);
+const mediaByHash = new Map();
+const mediaByName = new Map();
+const mediaStats = { uploads: 0, deduplicated: 0, bytesSaved: 0, hashed: 0, scanning: false };
+let mediaIndexLines = 0;
+
+function getMediaStats() {
+  return { dedup: MEDIA_DEDUP, indexed: mediaByName.size, persisted: Boolean(MEDIA_INDEX_PATH), ...mediaStats };
+}
+
+function persistMediaRecord(record) {
+  if (!MEDIA_INDEX_PATH) return;
+  mediaIndexLines++;
+  const write = mediaIndexLines <= 2 * mediaByName.size + 1000
+    ? appendRecord(mediaIndexLog, record)
+    : rewriteAppendLog(mediaIndexLog, [...mediaByName.values()]).then(() => { mediaIndexLines = mediaByName.size; });
+  write.catch(e => console.error(`Failed to update media index: ${e.message}`));
+}
+
+function rememberMedia(entry) {
+  forgetMedia(entry.filename, false);
+  mediaByName.set(entry.filename, entry);
+  mediaByHash.set(entry.hash, entry);
+  persistMediaRecord(entry);
+}
+
+function forgetMedia(filename, persist = true) {
+  const entry = mediaByName.get(filename);
+  if (!entry) return;
+  mediaByName.delete(filename);
+  if (mediaByHash.get(entry.hash) === entry) mediaByHash.delete(entry.hash);
+  if (persist) persistMediaRecord({ filename, hash: null });
+}
+
+async function loadMediaIndex() {
+  for (const record of await readAppendLog(mediaIndexLog)) {
+    if (record.hash) {
+      forgetMedia(record.filename, false);
+      mediaByName.set(record.filename, record);
+      mediaByHash.set(record.hash, record);
+    } else {
+      forgetMedia(record.filename, false);
+    }
+  }
+  await rewriteAppendLog(mediaIndexLog, [...mediaByName.values()]);
+  mediaIndexLines = mediaByName.size;
+}
+
+function hashFile(filePath) {
+  return new Promise((resolve, reject) => {
+    const hash = crypto.createHash('sha256');
+    fs.createReadStream(filePath)
+      .on('data', chunk => hash.update(chunk))
+      .on('end', () => resolve(hash.digest('hex')))
+      .on('error', reject);
+  });
+}
+
+// Record a file as it is now on disk, hashing it unless the digest is known
+async function indexMediaFile(filename, digest) {
+  const filePath = path.join(MEDIA_DIR, filename);
+  const stat = await fs.promises.stat(filePath);
+  if (!stat.isFile()) return;
+  let hash = digest;
+  if (!hash) {
+    hash = await hashFile(filePath);
+    mediaStats.hashed++;
+  }
+  rememberMedia({ hash, filename, size: stat.size, mtimeMs: stat.mtimeMs });
+}
+
+// Bring the index in line with collection.media in the background, one file
+// at a time: hash new or changed files and forget deleted ones
+async function scanMediaDir() {
+  let names;
+  try {
+    names = await fs.promises.readdir(MEDIA_DIR);
+  } catch (e) {
+    if (e.code !== 'ENOENT') console.error(`Media dedup: cannot read ${MEDIA_DIR}: ${e.message}`);
+    return;
+  }
+  mediaStats.scanning = true;
+  const present = new Set(names);
+  for (const filename of [...mediaByName.keys()]) {
+    if (!present.has(filename)) forgetMedia(filename);
+  }
+  for (const filename of names) {
+    try {
+      const stat = await fs.promises.stat(path.join(MEDIA_DIR, filename));
+      const known = mediaByName.get(filename);
+      if (known && known.size === stat.size && known.mtimeMs === stat.mtimeMs) continue;
+      await indexMediaFile(filename);
+    } catch (e) {
+      forgetMedia(filename);
+    }
+  }
+  mediaStats.scanning = false;
+  console.log(`Media dedup: ${mediaByName.size} files indexed`);
+}
+
+// The indexed file with this content, if it is still unchanged on disk
+async function findMedia(digest, size) {
+  const entry = mediaByHash.get(digest);
+  if (!entry || entry.size !== size) return null;
+  try {
+    const stat = await fs.promises.stat(path.join(MEDIA_DIR, entry.filename));
+    if (stat.size === entry.size && stat.mtimeMs === entry.mtimeMs) return entry.filename;
+  } catch (e) {
+    // deleted from collection.media since it was indexed
+  }
+  forgetMedia(entry.filename);
+  return null;
+}
+
+// PUT /media/{filename}: stream the raw body to a temp file and have
+// AnkiConnect store it from that path, so the file is never held in memory
+// or base64-encoded. The body is hashed on the way; if collection.media
+// already has a file with the same content, that filename is returned and
+// nothing is stored (skip with ?dedup=0). The temp file is removed either way.
+async function uploadMedia(body, { req, params, query, priority }) {
+  const filename = mediaFilename(params.filename);
+  if (parseInt(req.headers['content-length'], 10) > MAX_MEDIA_BYTES) throw mediaTooLarge();
+  const tmpPath = path.join(MEDIA_UPLOAD_DIR, `anki-upload-${crypto.randomBytes(9).toString('base64url')}`);
+  const hash = crypto.createHash('sha256');
+  try {
+    const size = await receiveToFile(req, tmpPath, MAX_MEDIA_BYTES, hash);
+    const digest = hash.digest('hex');
+    mediaStats.uploads++;
+
+    const dedup = MEDIA_DEDUP && query.get('dedup') !== '0';
+    const existing = dedup && await findMedia(digest, size);
+    if (existing) {
+      mediaStats.deduplicated++;
+      mediaStats.bytesSaved += size;
+      return { result: existing, error: null, deduplicated: true, bytesSaved: size, sha256: digest };
+    }
+
+    const reply = await ankiRequest('storeMediaFile', { filename, path: tmpPath }, priority);
+    if (!reply.error && MEDIA_DEDUP) {
+      await indexMediaFile(typeof reply.result === 'string' ? reply.result : filename, digest)
+        .catch(e => console.error(`Media dedup: cannot index ${filename}: ${e.message}`));
+    }
+    return { ...reply, deduplicated: false, bytesSaved: 0, sha256: digest };
+  } finally {
+    await fs.promises.unlink(tmpPath).catch(() => {});
+  }
+}
+
+function bodyTooLarge() {
+  return httpError(413, `Request body exceeds ${MAX_BODY_BYTES} bytes`, { headers: { Connection: 'close' } });
+}
+
+// Collect a stream as Buffer chunks and join them once, so there is no
+// repeated string copying and multibyte UTF-8 split across chunks survives
+// the single decode at the end. Fails with 413 as soon as maxBytes is passed.
+function readBody(stream, maxBytes = Infinity) {
+  return new Promise((resolve, reject) => {
+    const chunks = [];
+    let size = 0;
+    let failed = false;
+    stream.on('data', chunk => {
+      if (failed) return;
+      size += chunk.length;
+      stream.bodyBytes = size;
+      if (size > maxBytes) {
+        failed = true;
+        reject(bodyTooLarge());
+        return;
+      }
+      chunks.push(chunk);
+    });
+    stream.on('end', () => resolve(Buffer.concat(chunks, size)));
+    stream.on('error', reject);
+  });
+}
+
+async function parseBody(req) {
+  if (parseInt(req.headers['content-length'], 10) > MAX_BODY_BYTES) throw bodyTooLarge();
+  const raw = await readBody(req, MAX_BODY_BYTES);
+  if (raw.length === 0) return {};
+  try { return JSON.parse(raw.toString('utf8')); }
+  catch (e) { throw new Error('Invalid JSON in request body'); }
+}
+
+async function handleRequest(req, res) {
   res.setHeader('Access-Control-Allow-Origin', '*');
-  res.setHeader('Access-Control-Allow-Methods', 'GET, POST, OPTIONS');
-  res.setHeader('Access-Control-Allow-Headers', 'Content-Type, X-API-Key, Authorization');
+  res.setHeader('Access-Control-Allow-Methods', 'GET, POST, PUT, OPTIONS');
+  res.setHeader('Access-Control-Allow-Headers', 'Content-Type, X-API-Key, Authorization, X-Priority, Idempotency-Key');
 
   if (req.method === 'OPTIONS') { res.writeHead(204); res.end(); return; }
 
   const url = new URL(req.url, `http://${req.headers.host}`);
   const path = url.pathname;
 
-  if (path === '/health') { res.writeHead(200, { 'Content-Type': 'text/plain' }); res.end('ok'); return; }
+  if (path === '/health') {
+    let status = 'ok';
+    if (!readiness.ready) status = 'starting';
+    else if (circuit.state !== 'closed') status = 'degraded';
+    sendJson(res, 200, { status, ready: readiness.ready, readiness: getReadinessStats(), circuit: getCircuitStats() });
+    return;
+  }
+
+  if (path === '/stats') {
+    await refreshReaderAge();
+    sendJson(res, 200, {
+      upstream: getUpstreamStats(),
+      queue: getQueueStats(),
+      cache: getCacheStats(),
+      coalesce: getCoalesceStats(),
+      addNoteBatching: getBatchStats(),
+      pagination: getPaginationStats(),
+      circuit: getCircuitStats(),
+      journal: getJournalStats(),
+      idempotency: getIdempotencyStats(),
+      sync: getSyncStats(),
+      media: getMediaStats(),
+      reader: getReaderStats(),
+      memory: { rssBytes: process.memoryUsage.rss(), heapUsedBytes: process.memoryUsage().heapUsed },
+    });
+    return;
+  }
+
+  if (path === '/metrics') {
+    await refreshReaderAge();
+    res.writeHead(200, { 'Content-Type': 'text/plain; version=0.0.4' });
+    res.end(renderMetrics());
+    return;
+  }
 
   if (path === '/openapi.json') {
-    try {
-      const fs = require('fs');
-      const spec = fs.readFileSync('/home/sprite/anki/openapi-anki.json', 'utf8');
-      res.writeHead(200, { 'Content-Type': 'application/json' });
-      res.end(spec);
-    } catch (e) {
-      res.writeHead(500, { 'Content-Type': 'application/json' });
-      res.end(JSON.stringify({ error: 'Failed to load OpenAPI spec' }));
-    }
+    sendOpenapiSpec(req, res);
     return;
   }
 
-  const endpointKey = `${req.method} ${path}`;
-  const endpoint = ENDPOINT_MAP[endpointKey];
+  if (req.method === 'GET' && path.startsWith('/jobs/')) {
+    const job = jobs.get(path.slice('/jobs/'.length));
+    if (job) sendJson(res, 200, job);
+    else sendJson(res, 404, { error: 'Unknown or expired job id' });
+    return;
+  }
 
-  if (!endpoint) {
-    res.writeHead(404, { 'Content-Type': 'application/json' });
-    res.end(JSON.stringify({ error: `Unknown endpoint: ${endpointKey}` }));
+  const match = matchEndpoint(req.method, path);
+  if (!match) {
+    sendJson(res, 404, { error: `Unknown endpoint: ${req.method} ${path}` });
     return;
   }
+  const { endpoint } = match;
+
+  // Readiness is checked only where a request must go upstream: journaled
+  // writes are queued instead, and an Idempotency-Key replay is answered from
+  // the store (runAction checks readiness for everything else).
+  const journaled = Boolean(JOURNAL_PATH) && JOURNALED_ACTIONS.has(endpoint.action);
 
   try {
+    if (endpoint.handler) {
+      if (!journaled) assertReady();
+      const priority = requestPriority(req, null, {}, endpoint.priority);
+      const body = endpoint.rawBody ? null : await parseBody(req);
+      const result = await endpoint.handler(body, { priority, req, res, params: match.params, query: url.searchParams });
+      if (!endpoint.stream) sendJson(res, endpoint.status || 200, result);
+      return;
+    }
+
     let params = {};
     if (req.method === 'POST') {
       const body = await parseBody(req);
+      if (endpoint.paginated && (body.limit !== undefined || body.cursor !== undefined)) {
+        assertReady();
+        sendJson(res, 200, await paginate(endpoint.action, body, requestPriority(req, endpoint.action)));
+        return;
+      }
       if (endpoint.paramKey) {
         params = { [endpoint.paramKey]: body[endpoint.paramKey] || body };
       } else {
         params = body;
       }
     }
-    const result = await callAnkiConnect(endpoint.action, params);
-    res.writeHead(200, { 'Content-Type': 'application/json' });
-    res.end(JSON.stringify(result));
+    const priority = requestPriority(req, endpoint.action, params);
+    const idempotencyKey = req.headers['idempotency-key'];
+    const reply = idempotencyKey && IDEMPOTENT_ACTIONS.has(endpoint.action)
+      ? await idempotentAction(idempotencyKey, endpoint.action, params, priority)
+      : await runAction(endpoint.action, params, priority);
+    sendJson(res, reply.statusCode, reply.body, reply.headers);
   } catch (e) {
-    if (e.code === 'ECONNREFUSED' || e.code === 'ENOTFOUND' || e.code === 'ETIMEDOUT') {
-      res.writeHead(503, { 'Content-Type': 'application/json' });
-      res.end(JSON.stringify({
+    if (res.headersSent) {
+      res.destroy(e);
+    } else if (e.statusCode) {
+      sendJson(res, e.statusCode, { error: e.message, ...e.details }, {
+        ...(e.retryAfter ? { 'Retry-After': String(e.retryAfter) } : {}),
+        ...e.headers,
+      });
+    } else if (e.code === 'ECONNREFUSED' || e.code === 'ENOTFOUND' || e.code === 'ETIMEDOUT') {
+      sendJson(res, 503, {
         error: 'AnkiConnect is not available. Anki may still be starting up.',
         status: 'unavailable',
         code: 503
-      }));
+      });
     } else {
-      res.writeHead(500, { 'Content-Type': 'application/json' });
-      res.end(JSON.stringify({ error: e.message || 'Unknown error occurred' }));
+      sendJson(res, 500, { error: e.message || 'Unknown error occurred' });
     }
   }
+}
+
+const server = http.createServer((req, res) => {
+  const start = process.hrtime.bigint();
+  httpInFlight++;
+  res.on('close', () => {
+    httpInFlight--;
+    const endpoint = endpointLabel(req.method, req.url.split('?')[0]);
+    httpRequestsTotal.inc({ endpoint, code: res.statusCode });
+    if (res.statusCode >= 400) httpErrorsTotal.inc({ endpoint, class: errorClass(res.statusCode) });
+    httpDuration.observe({ endpoint }, Number(process.hrtime.bigint() - start) / 1e9);
+    httpRequestBytes.observe({ endpoint }, req.bodyBytes || 0);
+    httpResponseBytes.observe({ endpoint }, Number(res.getHeader('Content-Length')) || 0);
+  });
+  handleRequest(req, res);
 });
 
-async function waitForAnkiConnect(maxAttempts = 60, intervalMs = 1000) {
-  for (let i = 0; i < maxAttempts; i++) {
+// Poll AnkiConnect until it answers, backing off exponentially with equal
+// jitter (half the delay fixed, half random). Never gives up: Anki can take
+// minutes to start, and the proxy is already serving 503s meanwhile.
+async function waitForAnkiConnect() {
+  for (let attempt = 1; ; attempt++) {
+    readiness.attempts = attempt;
     try {
-      const result = await callAnkiConnect('version');
+      const result = await postToAnkiConnect('version', {});
       if (result.result) {
-        console.log('AnkiConnect is ready');
-        return true;
+        readiness.ready = true;
+        readiness.readyAt = Date.now();
+        readiness.nextCheckAt = 0;
+        console.log(`AnkiConnect is ready (after ${attempt} attempts)`);
+        return;
       }
+      readiness.lastError = 'Unexpected reply to version';
     } catch (e) {
-      console.log(`Waiting for AnkiConnect... (${i + 1}/${maxAttempts})`);
+      readiness.lastError = e.message;
     }
-    await new Promise(r => setTimeout(r, intervalMs));
+    const backoff = Math.min(READY_MAX_BACKOFF_MS, READY_BASE_BACKOFF_MS * 2 ** (attempt - 1));
+    const delay = Math.round(backoff / 2 + Math.random() * backoff / 2);
+    readiness.nextCheckAt = Date.now() + delay;
+    console.log(`Waiting for AnkiConnect... (attempt ${attempt}, retrying in ${Math.round(delay)}ms)`);
+    await new Promise(r => setTimeout(r, delay));
   }
-  throw new Error('AnkiConnect did not become available');
 }
 
 async function startup() {
-  await waitForAnkiConnect();
+  if (JOURNAL_PATH) await openJournal();
+  if (IDEMPOTENCY_PATH) await loadIdempotencyStore();
+  if (MEDIA_DEDUP && MEDIA_INDEX_PATH) await loadMediaIndex();
+  loadOpenapiSpec();
+  fs.watchFile(OPENAPI_PATH, { interval: 2000 }, loadOpenapiSpec);
   server.listen(PORT, () => {
     console.log(`Anki REST API proxy listening on port ${PORT}`);
     console.log(`OpenAPI spec available at http://localhost:${PORT}/openapi.json`);
   });
+  if (MEDIA_DEDUP) scanMediaDir();
+  await waitForAnkiConnect();
+  if (JOURNAL_PATH) replayJournal();
 }
 
-startup().catch(err => {
-  console.error('Failed to start:', err.message);
-  process.exit(1);
-});
+if (require.main === module) {
+  startup().catch(err => {
+    console.error('Failed to start:', err.message);
+    process.exit(1);
+  });
+}
+
+// Exported for the micro-benchmarks in tests/bench
+module.exports = { readBody, parseBody };
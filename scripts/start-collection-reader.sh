@@ -0,0 +1,13 @@
+#!/bin/bash
+# Read-only collection reader startup script
+# Answers deckNames/modelNames/modelFieldNames/notesInfo for the REST proxy
+# from the read replica kept by start-collection-snapshot.sh, off Anki's main thread
+
+cd /home/sprite/anki
+
+export ANKI_COLLECTION_PATH="${ANKI_COLLECTION_PATH:-/home/sprite/anki/collection-snapshot.anki2}"
+export ANKI_READER_PORT="${ANKI_READER_PORT:-8768}"
+# Full-text index for POST /anki-api/search
+export ANKI_SEARCH_INDEX_PATH="${ANKI_SEARCH_INDEX_PATH:-/home/sprite/anki/search-index.sqlite}"
+
+exec python3 /home/sprite/anki/anki-collection-reader.py
@@ -0,0 +1,12 @@
+#!/bin/bash
+# Collection snapshot startup script
+# Keeps /home/sprite/anki/collection-snapshot.anki2 as a read replica of the
+# live collection for the collection reader and ad-hoc queries
+
+cd /home/sprite/anki
+
+export ANKI_COLLECTION_PATH="${ANKI_COLLECTION_PATH:-/home/sprite/anki/anki_data/.local/share/Anki2/User 1/collection.anki2}"
+export ANKI_SNAPSHOT_PATH="${ANKI_SNAPSHOT_PATH:-/home/sprite/anki/collection-snapshot.anki2}"
+export ANKI_SNAPSHOT_INTERVAL_S="${ANKI_SNAPSHOT_INTERVAL_S:-30}"
+
+exec python3 /home/sprite/anki/anki-collection-snapshot.py
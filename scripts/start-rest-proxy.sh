@@ -7,4 +7,16 @@ cd /home/sprite/anki
 export NVM_DIR="/.sprite/languages/node/nvm"
 [ -s "$NVM_DIR/nvm.sh" ] && \. "$NVM_DIR/nvm.sh"
 
+# Idempotency-Key replies survive proxy restarts
+export ANKI_IDEMPOTENCY_PATH="${ANKI_IDEMPOTENCY_PATH:-/home/sprite/anki/idempotency-keys.log}"
+# Hash index of collection.media for upload dedup
+export ANKI_MEDIA_INDEX_PATH="${ANKI_MEDIA_INDEX_PATH:-/home/sprite/anki/media-index.log}"
+# Optional settings from setup-anki.sh, e.g. ANKI_READER_URL when the
+# collection reader is enabled (ANKI_READ_REPLICA=true in .env)
+if [ -f /home/sprite/anki/rest-proxy.env ]; then
+    set -a
+    . /home/sprite/anki/rest-proxy.env
+    set +a
+fi
+
 exec node /home/sprite/anki/anki-rest-proxy.js
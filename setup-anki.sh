@@ -298,6 +298,14 @@ chmod +x ~/anki/start-rest-proxy.sh
 cp "${SCRIPTS_DIR}/start-anki-native.sh" ~/anki/start-anki-native.sh
 chmod +x ~/anki/start-anki-native.sh
 
+cp "${SCRIPTS_DIR}/anki-collection-reader.py" ~/anki/anki-collection-reader.py
+cp "${SCRIPTS_DIR}/start-collection-reader.sh" ~/anki/start-collection-reader.sh
+chmod +x ~/anki/anki-collection-reader.py ~/anki/start-collection-reader.sh
+
+cp "${SCRIPTS_DIR}/anki-collection-snapshot.py" ~/anki/anki-collection-snapshot.py
+cp "${SCRIPTS_DIR}/start-collection-snapshot.sh" ~/anki/start-collection-snapshot.sh
+chmod +x ~/anki/anki-collection-snapshot.py ~/anki/start-collection-snapshot.sh
+
 cp "${SCRIPTS_DIR}/start-caddy.sh" ~/anki/start-caddy.sh
 chmod +x ~/anki/start-caddy.sh
 
@@ -439,6 +447,27 @@ else
     sprite-env services create anki-rest --cmd /home/sprite/anki/start-rest-proxy.sh --needs anki
 fi
 
+# The read replica and collection reader are opt-in: Anki keeps an exclusive
+# lock on the collection while it is open, so the replica only refreshes
+# while Anki is closed (see README)
+if [ "${ANKI_READ_REPLICA:-false}" = "true" ]; then
+    if sprite-env services list | grep -q '^anki-snapshot\b'; then
+        echo "Service anki-snapshot already exists, skipping..."
+    else
+        sprite-env services create anki-snapshot --cmd /home/sprite/anki/start-collection-snapshot.sh --needs anki
+    fi
+
+    if sprite-env services list | grep -q '^anki-reader\b'; then
+        echo "Service anki-reader already exists, skipping..."
+    else
+        sprite-env services create anki-reader --cmd /home/sprite/anki/start-collection-reader.sh --needs anki
+    fi
+
+    echo "ANKI_READER_URL=http://localhost:8768" > ~/anki/rest-proxy.env
+else
+    rm -f ~/anki/rest-proxy.env
+fi
+
 # ============================================================================
 # Complete
 # ============================================================================
@@ -0,0 +1,42 @@
+#!/usr/bin/env node
+/**
+ * Benchmark: concurrent POST /addNote with auto-batching on vs off
+ * Usage: node tests/bench/bench-addnote-batching.js [total] [concurrency]
+ */
+
+const { startFakeAnki, stopServer, startProxy, stopProxy, request, runLoad, formatRow } = require('./harness');
+
+const TOTAL = parseInt(process.argv[2] || '2000', 10);
+const CONCURRENCY = parseInt(process.argv[3] || '64', 10);
+
+function note(i) {
+  return { note: { deckName: 'Default', modelName: 'Basic', fields: { Front: `Q${i}`, Back: `A${i}` }, tags: ['bench'] } };
+}
+
+async function measure(label, env) {
+  // 2ms per main-thread hop plus 0.1ms per note inside a batch
+  const anki = await startFakeAnki({ serviceMs: 2, itemMs: 0.1 });
+  const proxy = await startProxy(env);
+  try {
+    const result = await runLoad({
+      total: TOTAL,
+      concurrency: CONCURRENCY,
+      makeRequest: i => request('POST', '/addNote', note(i)),
+    });
+    const stats = JSON.parse((await request('GET', '/stats')).body).addNoteBatching;
+    console.log(formatRow(label, result).replace('req/s', 'notes/s'));
+    console.log(`${''.padEnd(28)} upstream calls: ${JSON.stringify(anki.state.calls)}, ` +
+      `largest batch: ${stats.largestBatch}`);
+  } finally {
+    await stopProxy(proxy);
+    await stopServer(anki);
+  }
+}
+
+async function main() {
+  console.log(`POST /addNote x${TOTAL}, concurrency ${CONCURRENCY}`);
+  await measure('batching off', { ANKI_ADDNOTE_BATCH_WINDOW_MS: '0' });
+  await measure('batching on (5ms window)', { ANKI_ADDNOTE_BATCH_WINDOW_MS: '5' });
+}
+
+main().catch(err => { console.error(err); process.exit(1); });
@@ -0,0 +1,68 @@
+#!/usr/bin/env node
+/**
+ * Benchmark: an agent that adds notes and syncs, comparing POST /sync after
+ * every note with debounced syncs and with auto-sync and no /sync calls
+ * Usage: node tests/bench/bench-auto-sync.js [notes] [concurrency]
+ */
+
+const { startFakeAnki, stopServer, startProxy, stopProxy, request, runLoad, formatRow } = require('./harness');
+
+const TOTAL = parseInt(process.argv[2] || '500', 10);
+const CONCURRENCY = parseInt(process.argv[3] || '8', 10);
+
+function note(i) {
+  return { note: { deckName: 'Default', modelName: 'Basic', fields: { Front: `Q${i}`, Back: `A${i}` }, tags: ['bench'] } };
+}
+
+function percentile(sorted, p) {
+  return sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+}
+
+async function waitForIdleSync() {
+  for (;;) {
+    const sync = JSON.parse((await request('GET', '/stats')).body).sync;
+    if (!sync.running && !sync.queued) return sync;
+    await new Promise(r => setTimeout(r, 50));
+  }
+}
+
+async function measure(label, env, syncAfterEachNote) {
+  // 2ms per main-thread hop; a sync holds the main thread for 200ms
+  const anki = await startFakeAnki({ serviceMs: 2, syncMs: 200 });
+  const proxy = await startProxy(env);
+  const latencies = [];
+  try {
+    const result = await runLoad({
+      total: TOTAL,
+      concurrency: CONCURRENCY,
+      makeRequest: async i => {
+        const start = process.hrtime.bigint();
+        const res = await request('POST', '/addNote', note(i));
+        latencies.push(Number(process.hrtime.bigint() - start) / 1e6);
+        if (syncAfterEachNote && res.status === 200) {
+          const sync = await request('POST', '/sync');
+          return { status: sync.status === 202 ? 200 : sync.status };
+        }
+        return res;
+      },
+    });
+    const stats = await waitForIdleSync();
+    latencies.sort((a, b) => a - b);
+    console.log(formatRow(label, result).replace('req/s', 'notes/s'));
+    console.log(`${''.padEnd(28)} syncs run: ${anki.state.calls.sync || 0}, ` +
+      `avoided: ${stats.avoided.request + stats.avoided.auto}, ` +
+      `addNote p50 ${percentile(latencies, 0.5).toFixed(1)}ms p99 ${percentile(latencies, 0.99).toFixed(1)}ms`);
+  } finally {
+    await stopProxy(proxy);
+    await stopServer(anki);
+  }
+}
+
+async function main() {
+  console.log(`${TOTAL} notes, concurrency ${CONCURRENCY}, 200ms per sync`);
+  await measure('/sync after every note', {}, true);
+  await measure('/sync, 500ms debounce', { ANKI_SYNC_DEBOUNCE_MS: '500' }, true);
+  await measure('auto-sync, 500ms quiet', { ANKI_AUTO_SYNC_QUIET_MS: '500' }, false);
+}
+
+main().catch(err => { console.error(err); process.exit(1); });
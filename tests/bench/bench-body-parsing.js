@@ -0,0 +1,76 @@
+#!/usr/bin/env node
+/**
+ * Micro-benchmark: request body handling for 1 / 10 / 50 MB addNotes payloads,
+ * legacy `data += chunk` string concatenation vs the proxy's Buffer-based readBody
+ * Usage: node tests/bench/bench-body-parsing.js
+ *
+ * Payloads contain multibyte text, so the legacy path's per-chunk decoding
+ * shows up as U+FFFD replacement characters after JSON.parse.
+ */
+
+const path = require('path');
+const { Readable } = require('stream');
+const { readBody } = require(path.join(__dirname, '..', '..', 'scripts', 'anki-rest-proxy.js'));
+
+const SIZES_MB = [1, 10, 50];
+const CHUNK_BYTES = 64 * 1024;
+const RUNS = 3;
+
+// The previous parseBody implementation, kept here for comparison
+function legacyReadBody(stream) {
+  return new Promise((resolve, reject) => {
+    let body = '';
+    stream.on('data', chunk => body += chunk);
+    stream.on('end', () => resolve(body));
+    stream.on('error', reject);
+  });
+}
+
+function addNotesPayload(megabytes) {
+  const notes = [];
+  let size = 0;
+  for (let i = 0; size < megabytes * 1048576; i++) {
+    const note = {
+      deckName: 'Default', modelName: 'Basic', tags: ['bench'],
+      fields: { Front: `Vocabulary ${i}: 日本語の単語 ${i}`, Back: `<div>Ünïcødé answer ✓ ${'text '.repeat(40)}</div>` },
+    };
+    size += Buffer.byteLength(JSON.stringify(note)) + 1;
+    notes.push(note);
+  }
+  return Buffer.from(JSON.stringify({ notes }));
+}
+
+function chunked(buf) {
+  const chunks = [];
+  for (let i = 0; i < buf.length; i += CHUNK_BYTES) chunks.push(buf.subarray(i, i + CHUNK_BYTES));
+  return Readable.from(chunks, { objectMode: false });
+}
+
+async function measure(read, payload) {
+  let best = Infinity;
+  let replaced = 0;
+  for (let run = 0; run < RUNS; run++) {
+    global.gc && global.gc();
+    const start = process.hrtime.bigint();
+    const raw = await read(chunked(payload));
+    const text = typeof raw === 'string' ? raw : raw.toString('utf8');
+    const parsed = JSON.parse(text);
+    best = Math.min(best, Number(process.hrtime.bigint() - start) / 1e6);
+    replaced = (JSON.stringify(parsed).match(/\uFFFD/g) || []).length;
+  }
+  return { ms: best, replaced };
+}
+
+async function main() {
+  console.log(`Body read + JSON.parse, ${CHUNK_BYTES / 1024} KiB chunks, best of ${RUNS}`);
+  for (const mb of SIZES_MB) {
+    const payload = addNotesPayload(mb);
+    const legacy = await measure(legacyReadBody, payload);
+    const buffered = await measure(stream => readBody(stream), payload);
+    console.log(`\naddNotes ${mb} MB (${payload.length} bytes)`);
+    console.log(`  string +=         ${legacy.ms.toFixed(1).padStart(8)}ms  mangled chars: ${legacy.replaced}`);
+    console.log(`  Buffer chunks     ${buffered.ms.toFixed(1).padStart(8)}ms  mangled chars: ${buffered.replaced}`);
+  }
+}
+
+main().catch(err => { console.error(err); process.exit(1); });
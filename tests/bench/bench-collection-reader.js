@@ -0,0 +1,96 @@
+#!/usr/bin/env node
+/**
+ * Benchmark: notesInfo and deckNames throughput through AnkiConnect (one
+ * main-thread queue) vs the read-only collection reader, with the same notes
+ * in the fake AnkiConnect and in a generated collection.anki2
+ * Usage: node tests/bench/bench-collection-reader.js [total] [concurrency] [serviceMs]
+ */
+
+const os = require('os');
+const fs = require('fs');
+const path = require('path');
+const { spawn, spawnSync } = require('child_process');
+const { startFakeAnki, stopServer, startProxy, stopProxy, request, runLoad, formatRow } = require('./harness');
+
+const TOTAL = parseInt(process.argv[2] || '2000', 10);
+const CONCURRENCY = parseInt(process.argv[3] || '32', 10);
+const NOTES = 5000;
+const IDS_PER_CALL = 20;
+const READER_PORT = 18768;
+// Per-call main-thread time; real notesInfo calls on a large collection take longer
+const SERVICE_MS = parseFloat(process.argv[4] || '5');
+const READER_SCRIPT = path.join(__dirname, '..', '..', 'scripts', 'anki-collection-reader.py');
+
+function seedNotes(state) {
+  state.decks.push('Bench', 'Bench::Sub');
+  for (let i = 0; i < NOTES; i++) {
+    const id = state.nextId++;
+    state.notes.set(id, {
+      noteId: id, modelName: 'Basic', tags: ['bench'], mod: 1790000000,
+      fields: { Front: `front ${i}`, Back: `back ${i} `.repeat(10) },
+    });
+  }
+}
+
+function buildCollection(state, dbPath) {
+  const input = JSON.stringify({ decks: state.decks, models: state.models, notes: Array.from(state.notes.values()) });
+  const out = spawnSync('python3', [path.join(__dirname, 'build-collection.py'), dbPath], { input, stdio: ['pipe', 'inherit', 'inherit'] });
+  if (out.status !== 0) throw new Error('build-collection.py failed');
+}
+
+function startReader(dbPath) {
+  const child = spawn('python3', [READER_SCRIPT], {
+    env: { ...process.env, ANKI_COLLECTION_PATH: dbPath, ANKI_READER_PORT: String(READER_PORT) },
+    stdio: ['ignore', 'pipe', 'inherit'],
+  });
+  return new Promise((resolve, reject) => {
+    child.stdout.on('data', chunk => { if (String(chunk).includes('listening on port')) resolve(child); });
+    child.on('exit', code => reject(new Error(`collection reader exited with code ${code}`)));
+  });
+}
+
+async function measure(label, ids, env) {
+  const proxy = await startProxy(env);
+  try {
+    const pick = i => Array.from({ length: IDS_PER_CALL }, (_, j) => ids[(i * IDS_PER_CALL + j * 7919) % ids.length]);
+    const notesInfo = await runLoad({
+      total: TOTAL, concurrency: CONCURRENCY,
+      makeRequest: i => request('POST', '/notesInfo', { notes: pick(i) }),
+    });
+    const mixed = await runLoad({
+      total: TOTAL, concurrency: CONCURRENCY,
+      makeRequest: i => (i % 4 === 0 ? request('GET', '/deckNames') : request('POST', '/notesInfo', { notes: pick(i) })),
+    });
+    const stats = JSON.parse((await request('GET', '/stats')).body);
+    console.log(formatRow(`${label} notesInfo`, notesInfo));
+    console.log(formatRow(`${label} mixed`, mixed));
+    console.log(`  served by reader: ${stats.reader.served}, AnkiConnect calls: ${stats.upstream.requests}`);
+    return JSON.parse((await request('POST', '/notesInfo', { notes: ids.slice(0, 3) })).body);
+  } finally {
+    await stopProxy(proxy);
+  }
+}
+
+async function main() {
+  const dbPath = path.join(os.tmpdir(), `bench-collection-${process.pid}.anki2`);
+  const anki = await startFakeAnki({ serviceMs: SERVICE_MS, itemMs: 0.05 });
+  seedNotes(anki.state);
+  buildCollection(anki.state, dbPath);
+  const reader = await startReader(dbPath);
+  try {
+    const ids = Array.from(anki.state.notes.keys());
+    console.log(`${NOTES} notes, ${TOTAL} requests of ${IDS_PER_CALL} ids, concurrency ${CONCURRENCY}, ${SERVICE_MS}ms per AnkiConnect call`);
+    const viaAnki = await measure('AnkiConnect', ids, {});
+    const viaReader = await measure('collection reader', ids, { ANKI_READER_URL: `http://localhost:${READER_PORT}` });
+    const strip = reply => reply.result.map(({ noteId, tags, fields, modelName, mod }) => ({ noteId, tags, fields, modelName, mod }));
+    const same = JSON.stringify(strip(viaAnki)) === JSON.stringify(strip(viaReader));
+    console.log(`notesInfo replies match: ${same}`);
+  } finally {
+    reader.removeAllListeners('exit');
+    reader.kill();
+    await stopServer(anki);
+    for (const suffix of ['', '-wal', '-shm']) fs.rmSync(dbPath + suffix, { force: true });
+  }
+}
+
+main().catch(err => { console.error(err); process.exit(1); });
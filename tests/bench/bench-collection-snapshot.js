@@ -0,0 +1,103 @@
+#!/usr/bin/env node
+/**
+ * Benchmark: how long anki-collection-snapshot.py takes to publish a replica,
+ * and what it costs a process committing to the collection at the same time
+ * (commit latency), copying in one step vs in page batches with sleeps
+ * Usage: node tests/bench/bench-collection-snapshot.js [notes] [snapshots]
+ */
+
+const os = require('os');
+const fs = require('fs');
+const path = require('path');
+const { spawn, spawnSync } = require('child_process');
+
+const NOTES = parseInt(process.argv[2] || '20000', 10);
+const SNAPSHOTS = parseInt(process.argv[3] || '3', 10);
+const SNAPSHOT_SCRIPT = path.join(__dirname, '..', '..', 'scripts', 'anki-collection-snapshot.py');
+
+// Commits one small note update every 5ms until stdin closes, then prints
+// commit latencies in ms as JSON, like Anki saving edits
+const WRITER = `
+import json, sqlite3, sys, threading, time
+conn = sqlite3.connect(sys.argv[1], timeout=30)
+ids = [r[0] for r in conn.execute("SELECT id FROM notes")]
+done = threading.Event()
+threading.Thread(target=lambda: (sys.stdin.read(), done.set()), daemon=True).start()
+latencies, i = [], 0
+while not done.is_set():
+    start = time.perf_counter()
+    conn.execute("UPDATE notes SET mod = mod + 1 WHERE id = ?", (ids[i % len(ids)],))
+    conn.execute("UPDATE col SET mod = mod + 1")
+    conn.commit()
+    latencies.append((time.perf_counter() - start) * 1000)
+    i += 1
+    time.sleep(0.005)
+print(json.dumps(latencies))
+`;
+
+function buildCollection(dbPath) {
+  const notes = Array.from({ length: NOTES }, (_, i) => ({
+    noteId: 1500000000000 + i, modelName: 'Basic', tags: ['bench'], mod: 1790000000,
+    fields: { Front: `front ${i}`, Back: `back ${i} `.repeat(100) },
+  }));
+  const input = JSON.stringify({ decks: ['Default'], models: { Basic: ['Front', 'Back'] }, notes });
+  const out = spawnSync('python3', [path.join(__dirname, 'build-collection.py'), dbPath], { input, stdio: ['pipe', 'inherit', 'inherit'] });
+  if (out.status !== 0) throw new Error('build-collection.py failed');
+}
+
+function run(command, args, env) {
+  return new Promise((resolve, reject) => {
+    const child = spawn(command, args, { env: { ...process.env, ...env }, stdio: ['ignore', 'pipe', 'inherit'] });
+    child.stdout.resume();
+    child.on('exit', code => (code === 0 ? resolve() : reject(new Error(`${command} exited with code ${code}`))));
+  });
+}
+
+function startWriter(dbPath) {
+  const child = spawn('python3', ['-c', WRITER, dbPath], { stdio: ['pipe', 'pipe', 'inherit'] });
+  let output = '';
+  child.stdout.on('data', chunk => { output += chunk; });
+  const finished = new Promise(resolve => child.on('exit', () => resolve(JSON.parse(output))));
+  return { stop: () => { child.stdin.end(); return finished; } };
+}
+
+function percentile(sorted, p) {
+  return sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+}
+
+async function measure(label, dbPath, pages) {
+  const replica = path.join(os.tmpdir(), `bench-replica-${process.pid}.anki2`);
+  const writer = startWriter(dbPath);
+  await new Promise(r => setTimeout(r, 500));
+  const times = [];
+  for (let i = 0; i < SNAPSHOTS && pages !== null; i++) {
+    fs.rmSync(replica, { force: true });
+    const start = process.hrtime.bigint();
+    await run('python3', [SNAPSHOT_SCRIPT, '--once'], {
+      ANKI_COLLECTION_PATH: dbPath, ANKI_SNAPSHOT_PATH: replica, ANKI_SNAPSHOT_PAGES: String(pages),
+    });
+    times.push(Number(process.hrtime.bigint() - start) / 1e6);
+  }
+  if (pages === null) await new Promise(r => setTimeout(r, 2000));
+  const latencies = (await writer.stop()).sort((a, b) => a - b);
+  fs.rmSync(replica, { force: true });
+  const snapshot = times.length ? `snapshot median ${times.sort((a, b) => a - b)[Math.floor(times.length / 2)].toFixed(0).padStart(5)} ms  ` : ''.padEnd(25);
+  console.log(`${label.padEnd(22)} ${snapshot}commit p50 ${percentile(latencies, 0.5).toFixed(2)} ms  ` +
+    `p99 ${percentile(latencies, 0.99).toFixed(2)} ms  max ${latencies[latencies.length - 1].toFixed(2)} ms  (${latencies.length} commits)`);
+}
+
+async function main() {
+  const dbPath = path.join(os.tmpdir(), `bench-live-${process.pid}.anki2`);
+  buildCollection(dbPath);
+  try {
+    console.log(`${NOTES} notes (${(fs.statSync(dbPath).size / 1048576).toFixed(0)} MB), ${SNAPSHOTS} snapshots each, writer committing every 5ms`);
+    await measure('no snapshot', dbPath, null);
+    await measure('one step', dbPath, 0);
+    await measure('1024 pages/step', dbPath, 1024);
+    await measure('128 pages/step', dbPath, 128);
+  } finally {
+    for (const suffix of ['', '-wal', '-shm']) fs.rmSync(dbPath + suffix, { force: true });
+  }
+}
+
+main().catch(err => { console.error(err); process.exit(1); });
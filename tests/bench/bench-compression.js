@@ -0,0 +1,61 @@
+#!/usr/bin/env node
+/**
+ * Benchmark: response size and time-to-deliver for representative notesInfo
+ * payloads, uncompressed vs gzip / brotli / zstd (zstd needs Node >= 22.15)
+ * Usage: node tests/bench/bench-compression.js [linkMbit]
+ *
+ * Caddy's `encode zstd gzip` does the compression in production; this
+ * estimates what it buys on a slow link (compress time + transfer time).
+ */
+
+const zlib = require('zlib');
+
+const LINK_MBIT = parseFloat(process.argv[2] || '5');
+const NOTE_COUNTS = [100, 1000, 5000];
+
+// Shape matches AnkiConnect notesInfo: HTML-ish fields, tags, card ids
+function notesInfo(count) {
+  return {
+    result: Array.from({ length: count }, (_, i) => ({
+      noteId: 1500000000000 + i,
+      modelName: 'Basic',
+      tags: ['vocab', `chapter-${i % 20}`],
+      fields: {
+        Front: { value: `<div>What is the meaning of <b>word ${i}</b> in context ${i % 37}?</div>`, order: 0 },
+        Back: { value: `<div>Definition ${i}: a term used in chapter ${i % 20}.<br>Example: sentence number ${i * 7}.</div>`, order: 1 },
+      },
+      cards: [1500000000000 + i * 2],
+      mod: 1700000000 + i,
+    })),
+    error: null,
+  };
+}
+
+const CODECS = [
+  ['identity', buf => buf],
+  ['gzip (level 5)', buf => zlib.gzipSync(buf, { level: 5 })],
+  ['brotli (quality 4)', buf => zlib.brotliCompressSync(buf, { params: { [zlib.constants.BROTLI_PARAM_QUALITY]: 4 } })],
+];
+if (zlib.zstdCompressSync) CODECS.push(['zstd (default)', buf => zlib.zstdCompressSync(buf)]);
+
+function timeMs(fn, runs = 5) {
+  fn();
+  const start = process.hrtime.bigint();
+  let out;
+  for (let i = 0; i < runs; i++) out = fn();
+  return { out, ms: Number(process.hrtime.bigint() - start) / 1e6 / runs };
+}
+
+console.log(`Estimated delivery over a ${LINK_MBIT} Mbit/s link`);
+for (const count of NOTE_COUNTS) {
+  const raw = Buffer.from(JSON.stringify(notesInfo(count)));
+  console.log(`\nnotesInfo x${count} (${(raw.length / 1024).toFixed(0)} KiB)`);
+  for (const [name, compress] of CODECS) {
+    const { out, ms } = timeMs(() => compress(raw));
+    const transferMs = (out.length * 8) / (LINK_MBIT * 1000);
+    console.log(`  ${name.padEnd(20)} ${(out.length / 1024).toFixed(1).padStart(9)} KiB  ` +
+      `ratio ${(raw.length / out.length).toFixed(1).padStart(5)}x  ` +
+      `compress ${ms.toFixed(1).padStart(6)}ms  total ${(ms + transferMs).toFixed(0).padStart(6)}ms`);
+  }
+}
+if (!zlib.zstdCompressSync) console.log('\n(zstd skipped: this Node has no zlib.zstdCompressSync)');
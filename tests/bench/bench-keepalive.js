@@ -0,0 +1,44 @@
+#!/usr/bin/env node
+/**
+ * Benchmark: upstream keep-alive pool vs a fresh connection per call, against an
+ * upstream that keeps connections open and one that closes after every reply
+ * like AnkiConnect
+ * Usage: node tests/bench/bench-keepalive.js [total] [concurrency]
+ */
+
+const { startFakeAnki, stopServer, startProxy, stopProxy, request, runLoad, formatRow } = require('./harness');
+
+const TOTAL = parseInt(process.argv[2] || '5000', 10);
+const CONCURRENCY = parseInt(process.argv[3] || '32', 10);
+
+async function measure(label, env, closeAfterReply = false) {
+  const anki = await startFakeAnki({ serviceMs: 0, closeAfterReply });
+  const proxy = await startProxy(env);
+  try {
+    const result = await runLoad({
+      total: TOTAL,
+      concurrency: CONCURRENCY,
+      // A distinct query per request, so coalescing doesn't collapse calls
+      // and every request reaches AnkiConnect
+      makeRequest: i => request('POST', '/findNotes', { query: `deck:Default nid:${i}` }),
+    });
+    const stats = JSON.parse((await request('GET', '/stats')).body).upstream;
+    console.log(formatRow(label, result));
+    console.log(`${''.padEnd(28)} upstream calls: ${anki.state.calls.findNotes}, ` +
+      `connections opened: ${anki.state.connections}, reused sockets: ${stats.reusedSockets}, ` +
+      `stale socket retries: ${stats.staleSocketRetries}`);
+  } finally {
+    await stopProxy(proxy);
+    await stopServer(anki);
+  }
+}
+
+async function main() {
+  console.log(`POST /findNotes x${TOTAL}, concurrency ${CONCURRENCY}`);
+  await measure('no keep-alive', { ANKI_UPSTREAM_KEEPALIVE: '0' });
+  await measure('keep-alive pool', { ANKI_UPSTREAM_KEEPALIVE: '1' });
+  await measure('no keep-alive, closing', { ANKI_UPSTREAM_KEEPALIVE: '0' }, true);
+  await measure('keep-alive pool, closing', { ANKI_UPSTREAM_KEEPALIVE: '1' }, true);
+}
+
+main().catch(err => { console.error(err); process.exit(1); });
@@ -0,0 +1,88 @@
+#!/usr/bin/env node
+/**
+ * Benchmark: proxy peak memory and latency for storing a media file,
+ * base64 inside JSON (POST /storeMediaFile) vs a raw streamed upload
+ * (PUT /media/{filename}, chunked, handed to AnkiConnect as a path), with
+ * upload dedup off and on (the same file under new names is then reused)
+ * Usage: node tests/bench/bench-media-upload.js [megabytes]
+ */
+
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const http = require('http');
+const { PROXY_PORT, startFakeAnki, stopServer, startProxy, stopProxy, request } = require('./harness');
+
+const MEGABYTES = parseInt(process.argv[2] || '20', 10);
+const RUNS = 3;
+
+// Poll the proxy's RSS while `work` runs and return the peak above baseline
+async function peakRss(work) {
+  const rss = async () => JSON.parse((await request('GET', '/stats')).body).memory.rssBytes;
+  const baseline = await rss();
+  let peak = baseline;
+  let running = true;
+  const sampler = (async () => {
+    while (running) {
+      peak = Math.max(peak, await rss());
+      await new Promise(r => setTimeout(r, 10));
+    }
+  })();
+  const start = process.hrtime.bigint();
+  const status = await work();
+  const ms = Number(process.hrtime.bigint() - start) / 1e6;
+  running = false;
+  await sampler;
+  return { peakMb: (peak - baseline) / 1048576, ms, status };
+}
+
+// Stream a file from disk with chunked transfer encoding, as a client would
+function putFile(urlPath, filePath) {
+  return new Promise((resolve, reject) => {
+    const req = http.request({ host: 'localhost', port: PROXY_PORT, method: 'PUT', path: urlPath }, res => {
+      res.resume();
+      res.on('end', () => resolve(res.statusCode));
+    });
+    req.on('error', reject);
+    fs.createReadStream(filePath).pipe(req);
+  });
+}
+
+async function measure(label, work, env = {}) {
+  // A fresh collection.media per run, shared by the fake AnkiConnect and the proxy's dedup index
+  const mediaDir = fs.mkdtempSync(path.join(os.tmpdir(), 'bench-media-dir-'));
+  const anki = await startFakeAnki({ serviceMs: 0, mediaDir });
+  const proxy = await startProxy({ ANKI_MEDIA_DIR: mediaDir, ...env });
+  try {
+    const runs = [];
+    for (let i = 0; i < RUNS; i++) runs.push(await peakRss(() => work(i)));
+    const peakMb = Math.max(...runs.map(r => r.peakMb));
+    const ms = runs.map(r => r.ms).sort((a, b) => a - b)[Math.floor(RUNS / 2)];
+    const failed = runs.filter(r => r.status !== 200).length;
+    const { deduplicated } = JSON.parse((await request('GET', '/stats')).body).media;
+    console.log(`${label.padEnd(34)} peak RSS +${peakMb.toFixed(0).padStart(4)} MB  ` +
+      `median ${ms.toFixed(0).padStart(5)} ms  (${failed} failed, ${deduplicated} deduplicated)`);
+  } finally {
+    await stopProxy(proxy);
+    await stopServer(anki);
+    fs.rmSync(mediaDir, { recursive: true, force: true });
+  }
+}
+
+async function main() {
+  const filePath = path.join(os.tmpdir(), `bench-media-${process.pid}.bin`);
+  fs.writeFileSync(filePath, require('crypto').randomBytes(MEGABYTES * 1048576));
+  try {
+    console.log(`${MEGABYTES} MB media file, ${RUNS} uploads each`);
+    await measure('storeMediaFile (base64 JSON)', async i => {
+      const data = fs.readFileSync(filePath).toString('base64');
+      return (await request('POST', '/storeMediaFile', { filename: `bench-${i}.bin`, data })).status;
+    });
+    await measure('PUT /media (streamed)', i => putFile(`/media/bench-${i}.bin`, filePath), { ANKI_MEDIA_DEDUP: '0' });
+    await measure('PUT /media (streamed, dedup)', i => putFile(`/media/bench-${i}.bin`, filePath));
+  } finally {
+    fs.unlinkSync(filePath);
+  }
+}
+
+main().catch(err => { console.error(err); process.exit(1); });
@@ -0,0 +1,72 @@
+#!/usr/bin/env node
+/**
+ * Benchmark: interactive findNotes latency during a bulk addNotes import,
+ * with priority lanes + chunking vs everything FIFO in one lane
+ * Usage: node tests/bench/bench-priority-lanes.js [imports] [notesPerImport]
+ */
+
+const { startFakeAnki, stopServer, startProxy, stopProxy, request } = require('./harness');
+
+const IMPORTS = parseInt(process.argv[2] || '20', 10);
+const NOTES_PER_IMPORT = parseInt(process.argv[3] || '1000', 10);
+const BULK_CLIENTS = 4;
+const INTERACTIVE_CLIENTS = 4;
+
+function percentile(sorted, p) {
+  return sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+}
+
+function importPayload(n) {
+  return {
+    notes: Array.from({ length: NOTES_PER_IMPORT }, (_, i) => ({
+      deckName: 'Default', modelName: 'Basic', fields: { Front: `bulk ${n}-${i}`, Back: '' },
+    })),
+  };
+}
+
+async function measure(label, env, bulkHeaders) {
+  // 1ms per main-thread hop plus 0.05ms per note inside a batch
+  const anki = await startFakeAnki({ serviceMs: 1, itemMs: 0.05 });
+  const proxy = await startProxy(env);
+  try {
+    let remaining = IMPORTS;
+    let importing = true;
+    const latencies = [];
+
+    const bulkWorker = async () => {
+      while (remaining-- > 0) await request('POST', '/addNotes', importPayload(remaining), bulkHeaders);
+    };
+    const interactiveWorker = async (id) => {
+      while (importing) {
+        const start = process.hrtime.bigint();
+        // distinct queries so single-flight doesn't hide the queueing
+        await request('POST', '/findNotes', { query: `tag:probe-${id}-${latencies.length}` });
+        latencies.push(Number(process.hrtime.bigint() - start) / 1e6);
+      }
+    };
+
+    const start = Date.now();
+    const interactive = Array.from({ length: INTERACTIVE_CLIENTS }, (_, i) => interactiveWorker(i));
+    await Promise.all(Array.from({ length: BULK_CLIENTS }, bulkWorker));
+    importing = false;
+    await Promise.all(interactive);
+    const seconds = (Date.now() - start) / 1000;
+
+    latencies.sort((a, b) => a - b);
+    console.log(`${label.padEnd(28)} interactive p50 ${percentile(latencies, 0.5).toFixed(1).padStart(7)}ms  ` +
+      `p99 ${percentile(latencies, 0.99).toFixed(1).padStart(7)}ms  ` +
+      `(${latencies.length} probes, import took ${seconds.toFixed(2)}s)`);
+  } finally {
+    await stopProxy(proxy);
+    await stopServer(anki);
+  }
+}
+
+async function main() {
+  console.log(`${IMPORTS} x addNotes(${NOTES_PER_IMPORT}) from ${BULK_CLIENTS} clients, ` +
+    `${INTERACTIVE_CLIENTS} interactive findNotes clients`);
+  await measure('single FIFO lane', { ANKI_BULK_CHUNK_SIZE: '1000000' }, { 'X-Priority': 'interactive' });
+  await measure('priority lanes + chunking', {}, {});
+}
+
+main().catch(err => { console.error(err); process.exit(1); });
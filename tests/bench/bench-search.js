@@ -0,0 +1,156 @@
+#!/usr/bin/env node
+/**
+ * Benchmark: the same two-word text queries through POST /findNotes (the fake
+ * AnkiConnect scans every note's fields on its main-thread queue), through the
+ * SQL Anki runs for a text search (n.flds LIKE '%word%' over notes) on the
+ * collection file, and through POST /search (the collection reader's FTS5 index),
+ * plus the FTS5 query alone
+ * Usage: node tests/bench/bench-search.js [notes] [queries] [concurrency]
+ */
+
+const os = require('os');
+const fs = require('fs');
+const path = require('path');
+const { spawn, spawnSync } = require('child_process');
+const { startFakeAnki, stopServer, startProxy, stopProxy, request, runLoad, formatRow } = require('./harness');
+
+const NOTES = parseInt(process.argv[2] || '50000', 10);
+const QUERIES = parseInt(process.argv[3] || '200', 10);
+const CONCURRENCY = parseInt(process.argv[4] || '8', 10);
+const VOCABULARY = 5000;
+const WORDS_PER_NOTE = 60;
+const READER_PORT = 18768;
+const READER_SCRIPT = path.join(__dirname, '..', '..', 'scripts', 'anki-collection-reader.py');
+
+// Times each query with the LIKE scan Anki's search builds for bare text,
+// printing per-query milliseconds as JSON
+const LIKE_SCAN = `
+import json, sqlite3, sys, time
+conn = sqlite3.connect(sys.argv[1])
+times = []
+for query in json.load(sys.stdin):
+    words = query.split()
+    where = " AND ".join("(n.sfld LIKE ? ESCAPE '\\\\' OR n.flds LIKE ? ESCAPE '\\\\')" for _ in words)
+    args = [f"%{w}%" for w in words for _ in (0, 1)]
+    start = time.perf_counter()
+    conn.execute(f"SELECT n.id FROM notes n WHERE {where}", args).fetchall()
+    times.append((time.perf_counter() - start) * 1000)
+print(json.dumps(times))
+`;
+
+// The same queries as FTS5 MATCH on the search index, top 20 by rank
+const FTS_QUERY = `
+import json, sqlite3, sys, time
+conn = sqlite3.connect(sys.argv[1])
+times = []
+for query in json.load(sys.stdin):
+    start = time.perf_counter()
+    conn.execute("SELECT rowid FROM notes_fts WHERE notes_fts MATCH ? ORDER BY rank LIMIT 20", (query,)).fetchall()
+    times.append((time.perf_counter() - start) * 1000)
+print(json.dumps(times))
+`;
+
+// Deterministic pseudo-random words, so runs are comparable
+let seed = 42;
+function random() {
+  seed = (seed * 1103515245 + 12345) % 2147483648;
+  return seed / 2147483648;
+}
+const word = () => `w${Math.floor(random() * VOCABULARY).toString(36)}x`;
+
+function seedNotes(state) {
+  for (let i = 0; i < NOTES; i++) {
+    const id = state.nextId++;
+    const text = n => Array.from({ length: n }, word).join(' ');
+    state.notes.set(id, {
+      noteId: id, modelName: 'Basic', tags: ['bench'], mod: 1790000000,
+      fields: { Front: text(10), Back: `<div>${text(WORDS_PER_NOTE - 10)}</div>` },
+    });
+  }
+}
+
+function buildCollection(state, dbPath) {
+  const input = JSON.stringify({ decks: state.decks, models: state.models, notes: Array.from(state.notes.values()) });
+  const out = spawnSync('python3', [path.join(__dirname, 'build-collection.py'), dbPath], {
+    input, stdio: ['pipe', 'inherit', 'inherit'], maxBuffer: 1 << 30,
+  });
+  if (out.status !== 0) throw new Error('build-collection.py failed');
+}
+
+function startReader(dbPath, indexPath) {
+  const child = spawn('python3', [READER_SCRIPT], {
+    env: { ...process.env, ANKI_COLLECTION_PATH: dbPath, ANKI_SEARCH_INDEX_PATH: indexPath, ANKI_READER_PORT: String(READER_PORT) },
+    stdio: ['ignore', 'pipe', 'inherit'],
+  });
+  return new Promise((resolve, reject) => {
+    let output = '';
+    child.stdout.on('data', chunk => {
+      output += chunk;
+      if (output.includes('Search index:') && output.includes('notes updated')) resolve({ child, output });
+    });
+    child.on('exit', code => reject(new Error(`collection reader exited with code ${code}`)));
+  });
+}
+
+function median(values) {
+  const sorted = values.slice().sort((a, b) => a - b);
+  return sorted[Math.floor(sorted.length / 2)];
+}
+
+async function main() {
+  const dbPath = path.join(os.tmpdir(), `bench-search-${process.pid}.anki2`);
+  const indexPath = path.join(os.tmpdir(), `bench-search-${process.pid}.fts`);
+  const anki = await startFakeAnki({ serviceMs: 1 });
+  seedNotes(anki.state);
+  buildCollection(anki.state, dbPath);
+  const queries = Array.from({ length: QUERIES }, () => `${word()} ${word()}`);
+
+  const buildStart = Date.now();
+  const { child: reader, output } = await startReader(dbPath, indexPath);
+  console.log(`${NOTES} notes, ${QUERIES} two-word queries, concurrency ${CONCURRENCY}`);
+  console.log(`index build: ${output.match(/(\d+) notes updated/)[1]} notes in ${((Date.now() - buildStart) / 1000).toFixed(1)}s ` +
+    `(${(fs.statSync(indexPath).size / 1048576).toFixed(0)} MB)`);
+
+  const proxy = await startProxy({ ANKI_READER_URL: `http://localhost:${READER_PORT}` });
+  try {
+    const latencies = { findNotes: [], search: [] };
+    const timed = (kind, fn) => async i => {
+      const start = process.hrtime.bigint();
+      const res = await fn(i);
+      latencies[kind].push(Number(process.hrtime.bigint() - start) / 1e6);
+      return res;
+    };
+    const viaFind = await runLoad({
+      total: QUERIES, concurrency: CONCURRENCY,
+      makeRequest: timed('findNotes', i => request('POST', '/findNotes', { query: queries[i] })),
+    });
+    const viaSearch = await runLoad({
+      total: QUERIES, concurrency: CONCURRENCY,
+      makeRequest: timed('search', i => request('POST', '/search', { query: queries[i], limit: 20 })),
+    });
+    const sqlTimes = (script, file) => JSON.parse(spawnSync('python3', ['-c', script, file], { input: JSON.stringify(queries.slice(0, 50)) }).stdout);
+    const likeMs = sqlTimes(LIKE_SCAN, dbPath);
+    const ftsMs = sqlTimes(FTS_QUERY, indexPath);
+
+    console.log(`${formatRow('POST /findNotes (fake)', viaFind)}  median ${median(latencies.findNotes).toFixed(1)} ms`);
+    console.log(`${formatRow('POST /search (FTS5)', viaSearch)}  median ${median(latencies.search).toFixed(1)} ms`);
+    console.log(`SQL only, ${likeMs.length} queries: Anki's LIKE scan median ${median(likeMs).toFixed(2)} ms, ` +
+      `FTS5 MATCH median ${median(ftsMs).toFixed(2)} ms`);
+
+    const found = JSON.parse((await request('POST', '/findNotes', { query: queries[0] })).body).result;
+    const searched = JSON.parse((await request('POST', '/search', { query: queries[0], limit: 10000 })).body).result;
+    const first = searched[0];
+    console.log(`"${queries[0]}": findNotes ${found.length} notes, search ${searched.length} notes` +
+      (first ? `, top hit ${first.noteId} score ${first.score}: ${first.snippet}` : ''));
+  } finally {
+    await stopProxy(proxy);
+    reader.removeAllListeners('exit');
+    reader.kill();
+    await stopServer(anki);
+    for (const file of [dbPath, indexPath]) {
+      for (const suffix of ['', '-wal', '-shm']) fs.rmSync(file + suffix, { force: true });
+    }
+  }
+}
+
+main().catch(err => { console.error(err); process.exit(1); });
@@ -0,0 +1,64 @@
+#!/usr/bin/env node
+/**
+ * Benchmark: proxy peak memory for a large result set, buffered
+ * findNotes + notesInfo vs streaming NDJSON from POST /streamNotes
+ * Usage: node tests/bench/bench-streaming.js [notes]
+ */
+
+const { startFakeAnki, stopServer, startProxy, stopProxy, request } = require('./harness');
+
+const NOTES = parseInt(process.argv[2] || '50000', 10);
+
+async function fill(anki) {
+  for (let i = 0; i < NOTES; i++) {
+    anki.state.notes.set(1500000000000 + i, {
+      noteId: 1500000000000 + i, modelName: 'Basic', tags: ['bench'], mod: 1700000000,
+      fields: { Front: `Question ${i}`, Back: `<div>${'answer text '.repeat(20)}</div>` },
+    });
+  }
+}
+
+// Poll the proxy's RSS while `work` runs and return the peak above baseline
+async function peakRss(work) {
+  const rss = async () => JSON.parse((await request('GET', '/stats')).body).memory.rssBytes;
+  const baseline = await rss();
+  let peak = baseline;
+  let running = true;
+  const sampler = (async () => {
+    while (running) {
+      peak = Math.max(peak, await rss());
+      await new Promise(r => setTimeout(r, 20));
+    }
+  })();
+  const start = Date.now();
+  const bytes = await work();
+  running = false;
+  await sampler;
+  return { peakMb: (peak - baseline) / 1048576, seconds: (Date.now() - start) / 1000, bytes };
+}
+
+async function measure(label, work) {
+  const anki = await startFakeAnki({ serviceMs: 0 });
+  await fill(anki);
+  const proxy = await startProxy({ ANKI_UPSTREAM_MAX_QUEUE: '100000' });
+  try {
+    const { peakMb, seconds, bytes } = await peakRss(work);
+    console.log(`${label.padEnd(28)} peak RSS +${peakMb.toFixed(0).padStart(5)} MB  ` +
+      `${(bytes / 1048576).toFixed(1)} MB delivered in ${seconds.toFixed(2)}s`);
+  } finally {
+    await stopProxy(proxy);
+    await stopServer(anki);
+  }
+}
+
+async function main() {
+  console.log(`${NOTES} notes`);
+  await measure('findNotes + notesInfo', async () => {
+    const ids = JSON.parse((await request('POST', '/findNotes', { query: 'tag:bench' })).body).result;
+    return (await request('POST', '/notesInfo', { notes: ids })).body.length;
+  });
+  await measure('streamNotes (NDJSON)', async () =>
+    (await request('POST', '/streamNotes', { query: 'tag:bench' })).body.length);
+}
+
+main().catch(err => { console.error(err); process.exit(1); });
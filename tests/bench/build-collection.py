@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Build a minimal schema-18 collection.anki2 for benchmarks
+Reads {"decks": [...], "models": {name: [fields]}, "notes": [{noteId, modelName, tags, fields, mod}]}
+as JSON on stdin and writes the tables the collection reader queries
+Usage: build-collection.py <path> < state.json
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import time
+
+
+def unicase(a, b):
+    a, b = a.casefold(), b.casefold()
+    return (a > b) - (a < b)
+
+
+SCHEMA = """
+CREATE TABLE col (id integer PRIMARY KEY, crt integer NOT NULL, mod integer NOT NULL, scm integer NOT NULL,
+  ver integer NOT NULL, dty integer NOT NULL, usn integer NOT NULL, ls integer NOT NULL, conf text NOT NULL,
+  models text NOT NULL, decks text NOT NULL, dconf text NOT NULL, tags text NOT NULL);
+CREATE TABLE notes (id integer PRIMARY KEY, guid text NOT NULL, mid integer NOT NULL, mod integer NOT NULL,
+  usn integer NOT NULL, tags text NOT NULL, flds text NOT NULL, sfld integer NOT NULL, csum integer NOT NULL,
+  flags integer NOT NULL, data text NOT NULL);
+CREATE TABLE cards (id integer PRIMARY KEY, nid integer NOT NULL, did integer NOT NULL, ord integer NOT NULL,
+  mod integer NOT NULL, usn integer NOT NULL, type integer NOT NULL, queue integer NOT NULL, due integer NOT NULL,
+  ivl integer NOT NULL, factor integer NOT NULL, reps integer NOT NULL, lapses integer NOT NULL,
+  left integer NOT NULL, odue integer NOT NULL, odid integer NOT NULL, flags integer NOT NULL, data text NOT NULL);
+CREATE TABLE decks (id integer PRIMARY KEY NOT NULL, name text NOT NULL COLLATE unicase, mtime_secs integer NOT NULL,
+  usn integer NOT NULL, common blob NOT NULL, kind blob NOT NULL);
+CREATE TABLE notetypes (id integer NOT NULL PRIMARY KEY, name text NOT NULL COLLATE unicase,
+  mtime_secs integer NOT NULL, usn integer NOT NULL, config blob NOT NULL);
+CREATE TABLE fields (ntid integer NOT NULL, ord integer NOT NULL, name text NOT NULL COLLATE unicase,
+  config blob NOT NULL, PRIMARY KEY (ntid, ord)) WITHOUT ROWID;
+CREATE INDEX ix_cards_nid ON cards (nid);
+CREATE INDEX ix_notes_usn ON notes (usn);
+CREATE UNIQUE INDEX idx_decks_name ON decks (name);
+CREATE UNIQUE INDEX idx_notetypes_name ON notetypes (name);
+"""
+
+
+def main():
+    path = sys.argv[1]
+    state = json.load(sys.stdin)
+    if os.path.exists(path):
+        os.unlink(path)
+    conn = sqlite3.connect(path)
+    conn.create_collation("unicase", unicase)
+    conn.execute("PRAGMA journal_mode = wal")
+    conn.executescript(SCHEMA)
+    now = int(time.time())
+    conn.execute("INSERT INTO col VALUES (1, ?, ?, ?, 18, 0, 0, 0, '', '', '', '', '')",
+                 (now, now * 1000, now * 1000))
+    for i, name in enumerate(state["decks"], start=1):
+        conn.execute("INSERT INTO decks VALUES (?, ?, ?, 0, x'', x'')", (i, name.replace("::", "\x1f"), now))
+    model_ids = {}
+    for i, (name, fields) in enumerate(state["models"].items(), start=1):
+        model_ids[name] = i
+        conn.execute("INSERT INTO notetypes VALUES (?, ?, ?, 0, x'')", (i, name, now))
+        conn.executemany("INSERT INTO fields VALUES (?, ?, ?, x'')",
+                         [(i, order, field) for order, field in enumerate(fields)])
+    for note in state["notes"]:
+        fields = state["models"][note["modelName"]]
+        flds = "\x1f".join(note["fields"].get(f, "") for f in fields)
+        conn.execute("INSERT INTO notes VALUES (?, ?, ?, ?, 0, ?, ?, '', 0, 0, '')",
+                     (note["noteId"], str(note["noteId"]), model_ids[note["modelName"]], note["mod"],
+                      " " + " ".join(note["tags"]) + " " if note["tags"] else "", flds))
+        conn.execute("INSERT INTO cards VALUES (?, ?, 1, 0, ?, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, '')",
+                     (note["noteId"] + 1, note["noteId"], note["mod"]))
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env node
+/**
+ * Local AnkiConnect stand-in for benchmarks
+ * Serializes every action through one queue with a fixed service time (plus an
+ * optional per-item cost for batch actions and an extra cost for sync), mimicking AnkiConnect running on
+ * Anki's single Qt main thread. With closeAfterReply (FAKE_ANKI_CLOSE_AFTER_REPLY=1) it closes the
+ * connection after each reply without a `Connection: close` header, as AnkiConnect's web server does
+ */
+
+const http = require('http');
+const fs = require('fs');
+const path = require('path');
+
+const PORT = parseInt(process.env.FAKE_ANKI_PORT || '18765', 10);
+const SERVICE_MS = parseFloat(process.env.FAKE_ANKI_SERVICE_MS || '1');
+const ITEM_MS = parseFloat(process.env.FAKE_ANKI_ITEM_MS || '0');
+const SYNC_MS = parseFloat(process.env.FAKE_ANKI_SYNC_MS || '0');
+const CLOSE_AFTER_REPLY = process.env.FAKE_ANKI_CLOSE_AFTER_REPLY === '1';
+
+function batchSize(action, params) {
+  if (action === 'multi') return (params.actions || []).length;
+  if (action === 'addNotes' || action === 'notesInfo') return (params.notes || []).length;
+  return 1;
+}
+
+// mediaDir: if set, storeMediaFile writes files there like collection.media
+function createFakeAnki({ serviceMs = SERVICE_MS, itemMs = ITEM_MS, syncMs = SYNC_MS, mediaDir = null,
+  closeAfterReply = CLOSE_AFTER_REPLY } = {}) {
+  const state = {
+    decks: ['Default'],
+    models: { Basic: ['Front', 'Back'] },
+    notes: new Map(),
+    // filename -> size in bytes
+    media: new Map(),
+    nextId: 1500000000000,
+    calls: {},
+    connections: 0,
+    // Set to true to simulate Anki wedged behind a modal dialog
+    stalled: false,
+  };
+
+  let queue = Promise.resolve();
+  function onMainThread(action, params, fn) {
+    const ms = serviceMs + itemMs * batchSize(action, params) + (action === 'sync' ? syncMs : 0);
+    const wait = () => new Promise(r => (ms > 0 ? setTimeout(r, ms) : setImmediate(r)));
+    const run = queue.then(wait).then(fn);
+    queue = run.catch(() => {});
+    return run;
+  }
+
+  function addNote(note) {
+    if (!note || !note.deckName || !note.modelName || !note.fields) throw new Error('invalid note');
+    if (!state.decks.includes(note.deckName)) throw new Error(`deck was not found: ${note.deckName}`);
+    const id = state.nextId++;
+    state.notes.set(id, { noteId: id, modelName: note.modelName, tags: note.tags || [], fields: note.fields, mod: Math.floor(Date.now() / 1000) });
+    return id;
+  }
+
+  const actions = {
+    version: () => 6,
+    deckNames: () => state.decks.slice(),
+    createDeck: ({ deck }) => { if (!state.decks.includes(deck)) state.decks.push(deck); return state.decks.indexOf(deck) + 1; },
+    modelNames: () => Object.keys(state.models),
+    modelFieldNames: ({ modelName }) => {
+      if (!state.models[modelName]) throw new Error(`model was not found: ${modelName}`);
+      return state.models[modelName];
+    },
+    addNote: ({ note }) => addNote(note),
+    addNotes: ({ notes }) => notes.map(n => { try { return addNote(n); } catch (e) { return null; } }),
+    // Bare words must all appear in a field (case-insensitive substring, like
+    // Anki's text search); other terms (deck:, tag:, ...) match every note
+    findNotes: ({ query = '' }) => {
+      const words = query.split(/\s+/).filter(w => w && !w.includes(':')).map(w => w.toLowerCase());
+      if (words.length === 0) return Array.from(state.notes.keys());
+      return Array.from(state.notes.values())
+        .filter(n => { const text = Object.values(n.fields).join('\x1f').toLowerCase(); return words.every(w => text.includes(w)); })
+        .map(n => n.noteId);
+    },
+    notesInfo: ({ notes }) => notes.map(id => {
+      const n = state.notes.get(id);
+      if (!n) return {};
+      const fields = {};
+      Object.entries(n.fields).forEach(([k, v], order) => { fields[k] = { value: v, order }; });
+      return { ...n, fields, cards: [] };
+    }),
+    updateNoteFields: ({ note }) => { const n = state.notes.get(note.id); if (!n) throw new Error('note was not found'); Object.assign(n.fields, note.fields); return null; },
+    deleteNotes: ({ notes }) => { notes.forEach(id => state.notes.delete(id)); return null; },
+    sync: () => null,
+    storeMediaFile: ({ filename, data, path: filePath }) => {
+      const bytes = data !== undefined ? Buffer.from(data, 'base64') : fs.readFileSync(filePath);
+      if (mediaDir) fs.writeFileSync(path.join(mediaDir, filename), bytes);
+      state.media.set(filename, bytes.length);
+      return filename;
+    },
+    multi: ({ actions: ops }) => ops.map(op => {
+      try { return { result: actions[op.action](op.params || {}), error: null }; }
+      catch (e) { return { result: null, error: e.message }; }
+    }),
+  };
+
+  const server = http.createServer((req, res) => {
+    const chunks = [];
+    req.on('data', c => chunks.push(c));
+    req.on('end', () => {
+      let payload;
+      try { payload = JSON.parse(Buffer.concat(chunks).toString('utf8')); }
+      catch (e) { res.end(JSON.stringify({ result: null, error: 'invalid json' })); return; }
+      const { action, params = {} } = payload;
+      state.calls[action] = (state.calls[action] || 0) + 1;
+      if (state.stalled) return;
+      onMainThread(action, params, () => {
+        if (!actions[action]) return { result: null, error: 'unsupported action' };
+        try { return { result: actions[action](params), error: null }; }
+        catch (e) { return { result: null, error: e.message }; }
+      }).then(out => {
+        res.writeHead(200, { 'Content-Type': 'application/json' });
+        res.end(JSON.stringify(out), () => { if (closeAfterReply) req.socket.destroy(); });
+      });
+    });
+  });
+  server.on('connection', () => { state.connections++; });
+  server.state = state;
+  return server;
+}
+
+module.exports = { createFakeAnki };
+
+if (require.main === module) {
+  createFakeAnki().listen(PORT, () => {
+    console.log(`Fake AnkiConnect listening on port ${PORT} (${SERVICE_MS}ms per action)`);
+  });
+}
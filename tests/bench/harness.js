@@ -0,0 +1,102 @@
+/**
+ * Shared helpers for REST proxy benchmarks
+ * Starts the fake AnkiConnect in-process and the real proxy as a child process
+ */
+
+const http = require('http');
+const path = require('path');
+const { spawn } = require('child_process');
+const { createFakeAnki } = require('./fake-ankiconnect');
+
+const PROXY_SCRIPT = path.join(__dirname, '..', '..', 'scripts', 'anki-rest-proxy.js');
+const FAKE_ANKI_PORT = 18765;
+const PROXY_PORT = 18767;
+
+function startFakeAnki(options = {}) {
+  const server = createFakeAnki(options);
+  return new Promise(resolve => server.listen(FAKE_ANKI_PORT, () => resolve(server)));
+}
+
+function stopServer(server) {
+  server.closeAllConnections();
+  return new Promise(resolve => server.close(resolve));
+}
+
+function startProxy(env = {}) {
+  const child = spawn(process.execPath, [PROXY_SCRIPT], {
+    env: {
+      ...process.env,
+      ANKI_CONNECT_URL: `http://localhost:${FAKE_ANKI_PORT}`,
+      ANKI_REST_PORT: String(PROXY_PORT),
+      ANKI_OPENAPI_PATH: path.join(__dirname, '..', '..', 'scripts', 'openapi-anki.json'),
+      ...env,
+    },
+    stdio: ['ignore', 'pipe', 'inherit'],
+  });
+  return new Promise((resolve, reject) => {
+    let output = '';
+    child.stdout.on('data', chunk => {
+      output += chunk;
+      if (output.includes('listening on port') && output.includes('AnkiConnect is ready')) resolve(child);
+    });
+    child.on('exit', code => reject(new Error(`proxy exited with code ${code}`)));
+  });
+}
+
+function stopProxy(child) {
+  return new Promise(resolve => {
+    child.removeAllListeners('exit');
+    child.on('exit', resolve);
+    child.kill();
+  });
+}
+
+const clientAgent = new http.Agent({ keepAlive: true, maxSockets: 256 });
+
+function request(method, urlPath, body, headers = {}) {
+  const payload = body === undefined ? undefined : (Buffer.isBuffer(body) ? body : JSON.stringify(body));
+  return new Promise((resolve, reject) => {
+    const req = http.request({
+      host: 'localhost',
+      port: PROXY_PORT,
+      method,
+      path: urlPath,
+      agent: clientAgent,
+      headers: payload ? { 'Content-Type': 'application/json', 'Content-Length': Buffer.byteLength(payload), ...headers } : headers,
+    }, res => {
+      const chunks = [];
+      res.on('data', c => chunks.push(c));
+      res.on('end', () => resolve({ status: res.statusCode, headers: res.headers, body: Buffer.concat(chunks) }));
+    });
+    req.on('error', reject);
+    if (payload) req.write(payload);
+    req.end();
+  });
+}
+
+// Run `total` calls of makeRequest(i) with `concurrency` workers, return throughput
+async function runLoad({ total, concurrency, makeRequest }) {
+  let next = 0;
+  let failures = 0;
+  const start = process.hrtime.bigint();
+  async function worker() {
+    while (next < total) {
+      const i = next++;
+      const res = await makeRequest(i);
+      if (res.status !== 200) failures++;
+    }
+  }
+  await Promise.all(Array.from({ length: concurrency }, worker));
+  const seconds = Number(process.hrtime.bigint() - start) / 1e9;
+  return { total, failures, seconds, perSecond: total / seconds };
+}
+
+function formatRow(label, result) {
+  return `${label.padEnd(28)} ${result.perSecond.toFixed(0).padStart(8)} req/s  ` +
+    `(${result.total} in ${result.seconds.toFixed(2)}s, ${result.failures} failed)`;
+}
+
+module.exports = {
+  FAKE_ANKI_PORT, PROXY_PORT,
+  startFakeAnki, stopServer, startProxy, stopProxy, request, runLoad, formatRow,
+};
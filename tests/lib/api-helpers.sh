@@ -117,3 +117,63 @@ collect_startup_statuses() {
 
     echo $statuses
 }
+
+# Run a second REST proxy on the sprite, on port 18767, with extra environment
+# (settings the anki-rest service doesn't use, or a different AnkiConnect URL)
+# Usage: test_proxy_start <sprite_name> "<VAR=value ...>"
+test_proxy_start() {
+    local name="$1"
+    local env="$2"
+
+    sprite exec -s "$name" bash -c "export NVM_DIR=/.sprite/languages/node/nvm; [ -s \$NVM_DIR/nvm.sh ] && . \$NVM_DIR/nvm.sh; \
+cd /home/sprite/anki; env $env ANKI_REST_PORT=18767 nohup node anki-rest-proxy.js >> /tmp/e2e-proxy.log 2>&1 < /dev/null & \
+echo \$! > /tmp/e2e-proxy.pid; \
+for i in \$(seq 1 20); do curl -s -o /dev/null localhost:18767/health && break; sleep 0.5; done"
+}
+
+# Stop the proxy started by test_proxy_start
+# Usage: test_proxy_stop <sprite_name>
+test_proxy_stop() {
+    local name="$1"
+
+    sprite exec -s "$name" bash -c 'kill $(cat /tmp/e2e-proxy.pid) 2>/dev/null; rm -f /tmp/e2e-proxy.pid; sleep 1'
+}
+
+# Call the proxy started by test_proxy_start
+# Usage: test_proxy_call <sprite_name> <method> <path> [data] [header]
+test_proxy_call() {
+    local name="$1"
+    local method="$2"
+    local path="$3"
+    local data="$4"
+    local header="$5"
+
+    local curl_args=(-s -X "$method" -H "Content-Type: application/json")
+    [ -n "$header" ] && curl_args+=(-H "$header")
+    [ -n "$data" ] && curl_args+=(-d "$data")
+
+    sprite exec -s "$name" -- curl "${curl_args[@]}" "localhost:18767$path"
+}
+
+# Run a collection reader with a search index on the sprite, on port 18769,
+# over a collection file of the test's own (Anki keeps its collection under an
+# exclusive lock while it runs)
+# Usage: test_reader_start <sprite_name> <collection_path>
+test_reader_start() {
+    local name="$1"
+    local collection="$2"
+
+    sprite exec -s "$name" bash -c "rm -f /tmp/e2e-search.sqlite*; \
+ANKI_COLLECTION_PATH='$collection' ANKI_SEARCH_INDEX_PATH=/tmp/e2e-search.sqlite ANKI_SEARCH_REFRESH_MS=500 \
+ANKI_READER_PORT=18769 nohup python3 /home/sprite/anki/anki-collection-reader.py >> /tmp/e2e-reader.log 2>&1 < /dev/null & \
+echo \$! > /tmp/e2e-reader.pid; \
+for i in \$(seq 1 20); do curl -s -o /dev/null localhost:18769/health && break; sleep 0.5; done"
+}
+
+# Stop the reader started by test_reader_start
+# Usage: test_reader_stop <sprite_name>
+test_reader_stop() {
+    local name="$1"
+
+    sprite exec -s "$name" bash -c 'kill $(cat /tmp/e2e-reader.pid) 2>/dev/null; rm -f /tmp/e2e-reader.pid'
+}
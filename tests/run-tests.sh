@@ -202,6 +202,63 @@ models_status=$(api_status "${SPRITE_URL}/anki-api/modelNames" GET)
 assert_status "200" "$models_status" "Model names endpoint returns 200"
 assert_json_null "$models_response" "error" "Model names has no error"
 
+# Test proxy stats endpoint
+log_info "Testing proxy stats endpoint..."
+stats_response=$(api_call "${SPRITE_URL}/anki-api/stats" GET)
+assert_json_field "$stats_response" "upstream.keepAlive" "true" "Stats report upstream keep-alive"
+
+# Test proxy health: readiness and circuit state
+log_info "Testing proxy health endpoint..."
+proxy_health=$(api_call "${SPRITE_URL}/anki-api/health" GET)
+assert_json_field "$proxy_health" "status" "ok" "Proxy health reports ok"
+assert_json_field "$proxy_health" "ready" "true" "Proxy health reports ready"
+assert_json_field "$proxy_health" "readiness.ready" "true" "Proxy health includes readiness details"
+assert_not_empty "$(echo "$proxy_health" | jq -r '.readiness.readyAt // empty')" "Proxy health reports when it became ready"
+assert_json_field "$proxy_health" "circuit.state" "closed" "Proxy health reports a closed circuit"
+assert_json_field "$proxy_health" "circuit.consecutiveFailures" "0" "Proxy health reports no upstream failures"
+
+# Trip the circuit on a second proxy whose upstream answers `version` (so the
+# proxy becomes ready) and drops every other call
+log_info "Testing proxy health with the circuit open..."
+sprite exec -s "$TEST_SPRITE_NAME" bash -c "nohup python3 -c '
+import http.server, json
+class H(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers[\"Content-Length\"])))
+        if body[\"action\"] != \"version\":
+            self.close_connection = True
+            return
+        out = json.dumps({\"result\": 6, \"error\": None}).encode()
+        self.send_response(200)
+        self.send_header(\"Content-Length\", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+http.server.HTTPServer((\"127.0.0.1\", 18766), H).serve_forever()
+' > /dev/null 2>&1 < /dev/null & echo \$! > /tmp/e2e-upstream.pid"
+test_proxy_start "$TEST_SPRITE_NAME" "ANKI_CONNECT_URL=http://localhost:18766 ANKI_CIRCUIT_FAILURE_THRESHOLD=1 ANKI_CIRCUIT_OPEN_MS=60000"
+test_proxy_call "$TEST_SPRITE_NAME" GET /deckNames > /dev/null
+degraded_health=$(test_proxy_call "$TEST_SPRITE_NAME" GET /health)
+assert_json_field "$degraded_health" "status" "degraded" "Proxy health reports degraded while the circuit is open"
+assert_json_field "$degraded_health" "ready" "true" "Proxy stays ready while the circuit is open"
+assert_json_field "$degraded_health" "circuit.state" "open" "Proxy health reports an open circuit"
+assert_json_field "$degraded_health" "circuit.trips" "1" "Proxy health counts the circuit trip"
+test_proxy_stop "$TEST_SPRITE_NAME"
+sprite exec -s "$TEST_SPRITE_NAME" bash -c 'kill $(cat /tmp/e2e-upstream.pid) 2>/dev/null; rm -f /tmp/e2e-upstream.pid'
+
+# Test Prometheus metrics endpoint
+log_info "Testing metrics endpoint..."
+metrics_response=$(api_call "${SPRITE_URL}/metrics" GET)
+assert_contains "$metrics_response" "anki_proxy_http_requests_total" "Metrics expose request counters"
+
+# Test OpenAPI spec revalidation
+log_info "Testing OpenAPI spec ETag..."
+openapi_etag=$(curl -s -D - -o /dev/null -u testuser:testpass123 "${SPRITE_URL}/anki-api/openapi.json" \
+    | tr -d '\r' | awk 'tolower($1) == "etag:" {print $2}')
+assert_not_empty "$openapi_etag" "OpenAPI spec is served with an ETag"
+openapi_revalidated=$(curl -s -o /dev/null -w '%{http_code} %{size_download}' -u testuser:testpass123 \
+    -H "If-None-Match: $openapi_etag" "${SPRITE_URL}/anki-api/openapi.json")
+assert_eq "304 0" "$openapi_revalidated" "OpenAPI spec with a matching If-None-Match returns 304 with an empty body"
+
 # Test creating a deck
 log_info "Testing deck creation..."
 create_deck_response=$(api_call "${SPRITE_URL}/anki-api/createDeck" POST '{"deck":"TestDeck-E2E"}')
@@ -224,8 +281,219 @@ log_info "Testing note search..."
 find_notes_response=$(api_call "${SPRITE_URL}/anki-api/findNotes" POST '{"query":"tag:e2e-test"}')
 assert_json_null "$find_notes_response" "error" "Find notes has no error"
 
+# Test cursor pagination
+log_info "Testing cursor pagination..."
+page_add_response=$(api_call "${SPRITE_URL}/anki-api/addNotes" POST '{"notes":[
+    {"deckName":"TestDeck-E2E","modelName":"Basic","fields":{"Front":"Page 1","Back":"A"},"tags":["e2e-page"]},
+    {"deckName":"TestDeck-E2E","modelName":"Basic","fields":{"Front":"Page 2","Back":"B"},"tags":["e2e-page"]},
+    {"deckName":"TestDeck-E2E","modelName":"Basic","fields":{"Front":"Page 3","Back":"C"},"tags":["e2e-page"]}
+]}')
+assert_json_null "$page_add_response" "error" "Adding notes to page through has no error"
+page1=$(api_call "${SPRITE_URL}/anki-api/findNotes" POST '{"query":"tag:e2e-page","limit":2}')
+assert_json_field "$page1" "total" "3" "First findNotes page reports the total"
+assert_json_field "$page1" "result | length" "2" "First findNotes page has limit results"
+cursor=$(echo "$page1" | jq -r '.nextCursor' 2>/dev/null)
+page2=$(api_call "${SPRITE_URL}/anki-api/notesInfo" POST "{\"cursor\":\"$cursor\",\"limit\":2}")
+assert_json_field "$page2" "result | length" "1" "findNotes cursor continues on notesInfo"
+assert_json_null "$page2" "nextCursor" "Last page has no next cursor"
+page_ids=$(echo "$page_add_response" | jq -c '.result' 2>/dev/null)
+ids_page1=$(api_call "${SPRITE_URL}/anki-api/notesInfo" POST "{\"notes\":$page_ids,\"limit\":2}")
+assert_json_field "$ids_page1" "result | length" "2" "notesInfo pages through a notes id list"
+ids_cursor=$(echo "$ids_page1" | jq -r '.nextCursor' 2>/dev/null)
+ids_page2=$(api_call "${SPRITE_URL}/anki-api/notesInfo" POST "{\"cursor\":\"$ids_cursor\",\"limit\":2}")
+assert_json_field "$ids_page2" "result[0].fields.Front.value" "Page 3" "notesInfo id list cursor returns the next note"
+expired_status=$(api_status "${SPRITE_URL}/anki-api/findNotes" POST '{"cursor":"e2eUnknownCursor.2","limit":2}')
+assert_status "410" "$expired_status" "Expired or unknown cursor returns 410"
+malformed_status=$(api_status "${SPRITE_URL}/anki-api/findNotes" POST '{"cursor":"not a cursor","limit":2}')
+assert_status "400" "$malformed_status" "Malformed cursor returns 400"
+
+# Test batch endpoint
+log_info "Testing batch endpoint..."
+batch_response=$(api_call "${SPRITE_URL}/anki-api/batch" POST '{"operations":[{"action":"deckNames"},{"action":"findNotes","params":{"query":"tag:e2e-test"}}]}')
+assert_json_null "$batch_response" "error" "Batch has no error"
+assert_json_null "$batch_response" "result[1].error" "Batched findNotes has no error"
+
+# Test media upload and serving
+log_info "Testing media upload..."
+media_put_response=$(curl -s -X PUT -u testuser:testpass123 --data-binary "e2e media file" \
+    "${SPRITE_URL}/anki-api/media/e2e-test.txt")
+assert_json_null "$media_put_response" "error" "Media upload has no error"
+media_body=$(curl -s -u testuser:testpass123 "${SPRITE_URL}/anki-api/media/e2e-test.txt")
+assert_eq "e2e media file" "$media_body" "Uploaded media file is served back"
+
+log_info "Testing media upload dedup..."
+media_dup_response=$(curl -s -X PUT -u testuser:testpass123 --data-binary "e2e media file" \
+    "${SPRITE_URL}/anki-api/media/e2e-test-copy.txt")
+assert_json_field "$media_dup_response" "result" "e2e-test.txt" "Identical upload returns the existing filename"
+assert_json_field "$media_dup_response" "deduplicated" "true" "Identical upload is marked deduplicated"
+media_copy_exists=$(sprite exec -s "$TEST_SPRITE_NAME" bash -c "test -e ~/anki/anki_data/.local/share/Anki2/'User 1'/collection.media/e2e-test-copy.txt && echo 'yes' || echo 'no'" 2>/dev/null)
+assert_eq "no" "$media_copy_exists" "Identical upload does not write a second file"
+
+log_info "Testing media file serving..."
+missing_media_status=$(api_status "${SPRITE_URL}/anki-api/media/e2e-missing.png" GET)
+assert_status "404" "$missing_media_status" "Missing media file returns 404"
+traversal_status=$(curl -s -o /dev/null -w "%{http_code}" --path-as-is -u testuser:testpass123 \
+    "${SPRITE_URL}/anki-api/media/..%2Fcollection.anki2")
+assert_status "404" "$traversal_status" "Media path traversal is refused"
+
+# Test the request body limit on a second proxy with a 64 KiB cap: the 413
+# arrives and the connection closes without a reset, with or without a
+# Content-Length up front
+log_info "Testing request body limit..."
+test_proxy_start "$TEST_SPRITE_NAME" "ANKI_MAX_BODY_BYTES=65536"
+sprite exec -s "$TEST_SPRITE_NAME" bash -c "head -c 1048576 /dev/zero | tr '\\0' x > /tmp/e2e-oversized.json"
+oversized_reply=$(sprite exec -s "$TEST_SPRITE_NAME" bash -c "curl -s -o /dev/null -w '%{http_code}' -X POST \
+-H 'Content-Type: application/json' --data-binary @/tmp/e2e-oversized.json localhost:18767/addNote; echo \" exit \$?\"")
+assert_eq "413 exit 0" "$oversized_reply" "Body over the cap returns 413 and the connection closes cleanly"
+chunked_reply=$(sprite exec -s "$TEST_SPRITE_NAME" bash -c "curl -s -o /dev/null -w '%{http_code}' -X POST \
+-H 'Content-Type: application/json' -H 'Transfer-Encoding: chunked' --data-binary @/tmp/e2e-oversized.json \
+localhost:18767/addNote; echo \" exit \$?\"")
+assert_eq "413 exit 0" "$chunked_reply" "Chunked body over the cap returns 413 and the connection closes cleanly"
+sprite exec -s "$TEST_SPRITE_NAME" -- rm -f /tmp/e2e-oversized.json
+test_proxy_stop "$TEST_SPRITE_NAME"
+
+# ============================================================================
+# Test 3: Safe Retries and Write Journal
+# ============================================================================
+echo ""
+echo "=========================================="
+echo "Test Suite: Safe Retries and Write Journal"
+echo "=========================================="
+
+# Idempotency-Key: a retry gets the first reply back without adding the note again
+log_info "Testing Idempotency-Key replay..."
+idem_key="e2e-$(date +%s)"
+idem_body='{"note":{"deckName":"TestDeck-E2E","modelName":"Basic","fields":{"Front":"Idempotent","Back":"Once"},"tags":["e2e-idem"]}}'
+idem_first=$(curl -s -X POST -u testuser:testpass123 -H "Content-Type: application/json" \
+    -H "Idempotency-Key: $idem_key" -d "$idem_body" "${SPRITE_URL}/anki-api/addNote")
+assert_json_null "$idem_first" "error" "First addNote with Idempotency-Key has no error"
+idem_headers=$(mktemp)
+idem_retry=$(curl -s -D "$idem_headers" -X POST -u testuser:testpass123 -H "Content-Type: application/json" \
+    -H "Idempotency-Key: $idem_key" -d "$idem_body" "${SPRITE_URL}/anki-api/addNote")
+assert_eq "$(echo "$idem_first" | jq -r '.result')" "$(echo "$idem_retry" | jq -r '.result')" "Retry returns the first note id"
+assert_contains "$(tr -d '\r' < "$idem_headers" | tr 'A-Z' 'a-z')" "idempotent-replayed: true" "Retry is marked Idempotent-Replayed"
+rm -f "$idem_headers"
+idem_count=$(api_call "${SPRITE_URL}/anki-api/findNotes" POST '{"query":"tag:e2e-idem"}' | jq '.result | length' 2>/dev/null)
+assert_eq "1" "$idem_count" "Retry did not add a second note"
+idem_conflict=$(curl -s -o /dev/null -w "%{http_code}" -X POST -u testuser:testpass123 -H "Content-Type: application/json" \
+    -H "Idempotency-Key: $idem_key" -d '{"note":{"deckName":"TestDeck-E2E","modelName":"Basic","fields":{"Front":"Different","Back":""}}}' \
+    "${SPRITE_URL}/anki-api/addNote")
+assert_status "422" "$idem_conflict" "Reusing an Idempotency-Key with a different body returns 422"
+
+# Write journal: a second proxy with ANKI_JOURNAL_PATH set, first pointed at a
+# closed port so the write is journaled, then restarted against AnkiConnect
+log_info "Testing the write journal..."
+journal_env="ANKI_JOURNAL_PATH=/tmp/e2e-journal.log ANKI_IDEMPOTENCY_PATH=/tmp/e2e-keys.log ANKI_MEDIA_DEDUP=0"
+sprite exec -s "$TEST_SPRITE_NAME" -- rm -f /tmp/e2e-journal.log /tmp/e2e-keys.log
+test_proxy_start "$TEST_SPRITE_NAME" "$journal_env ANKI_CONNECT_URL=http://localhost:1"
+journal_body='{"note":{"deckName":"TestDeck-E2E","modelName":"Basic","fields":{"Front":"Journaled","Back":"Later"},"tags":["e2e-journal"]}}'
+journal_reply=$(test_proxy_call "$TEST_SPRITE_NAME" POST /addNote "$journal_body" "Idempotency-Key: e2e-journal")
+assert_json_field "$journal_reply" "status" "queued" "Write is journaled while AnkiConnect is unreachable"
+journal_job=$(echo "$journal_reply" | jq -r '.id' 2>/dev/null)
+journal_retry=$(test_proxy_call "$TEST_SPRITE_NAME" POST /addNote "$journal_body" "Idempotency-Key: e2e-journal")
+assert_json_field "$journal_retry" "id" "$journal_job" "Retry of a journaled write returns the same job"
+test_proxy_stop "$TEST_SPRITE_NAME"
+
+test_proxy_start "$TEST_SPRITE_NAME" "$journal_env"
+journal_status="queued"
+for _ in $(seq 1 30); do
+    journal_job_reply=$(test_proxy_call "$TEST_SPRITE_NAME" GET "/jobs/${journal_job}")
+    journal_status=$(echo "$journal_job_reply" | jq -r '.status' 2>/dev/null)
+    if [ "$journal_status" = "done" ] || [ "$journal_status" = "failed" ]; then
+        break
+    fi
+    sleep 2
+done
+assert_eq "done" "$journal_status" "Journaled write is replayed after a proxy restart"
+journal_note=$(echo "$journal_job_reply" | jq -r '.result' 2>/dev/null)
+assert_not_empty "$(echo "$journal_note" | grep -v '^null$')" "Replayed job has the new note id"
+journal_settled=$(test_proxy_call "$TEST_SPRITE_NAME" POST /addNote "$journal_body" "Idempotency-Key: e2e-journal")
+assert_json_field "$journal_settled" "result" "$journal_note" "Retry after replay returns the replayed note id"
+journal_count=$(api_call "${SPRITE_URL}/anki-api/findNotes" POST '{"query":"tag:e2e-journal"}' | jq '.result | length' 2>/dev/null)
+assert_eq "1" "$journal_count" "Journaled write was applied once"
+test_proxy_stop "$TEST_SPRITE_NAME"
+
+# ============================================================================
+# Test 4: Full-text Search
+# ============================================================================
+echo ""
+echo "=========================================="
+echo "Test Suite: Full-text Search"
+echo "=========================================="
+
+# Search needs the collection reader, which the default setup leaves off
+log_info "Testing search without the collection reader..."
+reader_enabled=$(api_call "${SPRITE_URL}/anki-api/stats" GET | jq -r '.reader.enabled' 2>/dev/null)
+if [ "$reader_enabled" = "false" ]; then
+    search_off_status=$(api_status "${SPRITE_URL}/anki-api/search" POST '{"query":"coffee"}')
+    assert_status "404" "$search_off_status" "Search answers 404 without the collection reader"
+else
+    log_skip "Collection reader enabled on the sprite (ANKI_READ_REPLICA=true)"
+fi
+
+# A reader and a second proxy over a small collection built for the test:
+# the index is built, searched, and picks up a note added afterwards
+log_info "Testing search through a collection reader..."
+search_collection=/tmp/e2e-collection.anki2
+sprite exec -s "$TEST_SPRITE_NAME" -- python3 -c '
+import os, sqlite3, sys, time
+path = sys.argv[1]
+for suffix in ("", "-wal", "-shm"):
+    if os.path.exists(path + suffix):
+        os.unlink(path + suffix)
+conn = sqlite3.connect(path)
+conn.executescript("""
+CREATE TABLE col (id integer PRIMARY KEY, mod integer NOT NULL, scm integer NOT NULL);
+CREATE TABLE notes (id integer PRIMARY KEY, mid integer NOT NULL, mod integer NOT NULL, usn integer NOT NULL,
+  tags text NOT NULL, flds text NOT NULL);
+CREATE INDEX ix_notes_usn ON notes (usn);
+CREATE TABLE notetypes (id integer PRIMARY KEY, name text NOT NULL);
+CREATE TABLE fields (ntid integer NOT NULL, ord integer NOT NULL, name text NOT NULL);
+""")
+conn.execute("INSERT INTO notetypes VALUES (1, ?)", ("Basic",))
+conn.executemany("INSERT INTO fields VALUES (1, ?, ?)", [(0, "Front"), (1, "Back")])
+now = int(time.time())
+conn.execute("INSERT INTO col VALUES (1, ?, ?)", (now * 1000, now * 1000))
+conn.executemany("INSERT INTO notes VALUES (?, 1, ?, -1, ?, ?)", [
+    (1001, now, " vocab ", "Café au lait\x1f<div>coffee with milk</div>"),
+    (1002, now, " vocab ", "Green tea\x1fno milk"),
+])
+conn.commit()
+' "$search_collection"
+test_reader_start "$TEST_SPRITE_NAME" "$search_collection"
+test_proxy_start "$TEST_SPRITE_NAME" "ANKI_READER_URL=http://localhost:18769"
+search_reply=""
+for _ in $(seq 1 20); do
+    search_reply=$(test_proxy_call "$TEST_SPRITE_NAME" POST /search '{"query":"coffee milk"}')
+    [ "$(echo "$search_reply" | jq -r '.result | length' 2>/dev/null)" = "1" ] && break
+    sleep 0.5
+done
+assert_json_field "$search_reply" "result[0].noteId" "1001" "Search finds the note with every word"
+assert_contains "$(echo "$search_reply" | jq -r '.result[0].snippet' 2>/dev/null)" "<b>coffee</b>" "Search snippet highlights the match"
+accent_reply=$(test_proxy_call "$TEST_SPRITE_NAME" POST /search '{"query":"cafe"}')
+assert_json_field "$accent_reply" "result[0].noteId" "1001" "Search ignores accents"
+bad_query_reply=$(test_proxy_call "$TEST_SPRITE_NAME" POST /search '{"query":"\"coffee"}')
+assert_contains "$bad_query_reply" "invalid search" "Invalid FTS5 query is rejected"
+sprite exec -s "$TEST_SPRITE_NAME" -- python3 -c '
+import sqlite3, sys, time
+conn = sqlite3.connect(sys.argv[1])
+conn.execute("INSERT INTO notes VALUES (1003, 1, ?, -1, ?, ?)", (int(time.time()), "", "Espresso\x1fshort coffee"))
+conn.execute("UPDATE col SET mod = mod + 1")
+conn.commit()
+' "$search_collection"
+added_reply=""
+for _ in $(seq 1 20); do
+    added_reply=$(test_proxy_call "$TEST_SPRITE_NAME" POST /search '{"query":"espresso"}')
+    [ "$(echo "$added_reply" | jq -r '.result | length' 2>/dev/null)" = "1" ] && break
+    sleep 0.5
+done
+assert_json_field "$added_reply" "result[0].noteId" "1003" "Index picks up a note added after it was built"
+assert_json_field "$added_reply" "stale" "false" "Search is not stale once the index caught up"
+test_proxy_stop "$TEST_SPRITE_NAME"
+test_reader_stop "$TEST_SPRITE_NAME"
+
 # ============================================================================
-# Test 3: AnkiWeb Sync
+# Test 5: AnkiWeb Sync
 # ============================================================================
 echo ""
 echo "=========================================="
@@ -236,20 +504,29 @@ if [ "$SKIP_SYNC_TESTS" = true ]; then
     log_info "Skipping sync tests - AnkiWeb credentials not provided"
 else
     log_info "Testing sync with AnkiWeb..."
-    sync_response=$(api_call "${SPRITE_URL}/anki-api/sync" POST)
+    sync_job=$(api_call "${SPRITE_URL}/anki-api/sync" POST | jq -r '.id' 2>/dev/null)
+    sync_status="queued"
+    for _ in $(seq 1 60); do
+        sync_response=$(api_call "${SPRITE_URL}/anki-api/jobs/${sync_job}" GET)
+        sync_status=$(echo "$sync_response" | jq -r '.status' 2>/dev/null)
+        if [ "$sync_status" != "queued" ] && [ "$sync_status" != "running" ]; then
+            break
+        fi
+        sleep 5
+    done
     sync_error=$(echo "$sync_response" | jq -r '.error' 2>/dev/null)
 
-    if [ "$sync_error" = "null" ]; then
+    if [ "$sync_status" = "done" ] && [ "$sync_error" = "null" ]; then
         log_pass "Sync completed successfully"
     else
         # Any sync error should fail the test when credentials are provided
         # Common errors include: auth failures, invalid hkey, network issues
-        log_fail "Sync failed" "successful sync (error: null)" "$sync_error"
+        log_fail "Sync failed" "successful sync (error: null)" "status $sync_status, error: $sync_error"
     fi
 fi
 
 # ============================================================================
-# Test 4: API Key Authentication
+# Test 6: API Key Authentication
 # ============================================================================
 echo ""
 echo "=========================================="
@@ -275,7 +552,7 @@ no_auth_status=$(curl -s -o /dev/null -w "%{http_code}" \
 assert_status "401" "$no_auth_status" "No auth rejected"
 
 # ============================================================================
-# Test 5: Service Restart Behavior
+# Test 7: Service Restart Behavior
 # ============================================================================
 echo ""
 echo "=========================================="